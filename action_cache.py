@@ -0,0 +1,142 @@
+"""Opponent actions memoized on their observation.
+
+A frozen opponent is a function of its observation once its snapshot is fixed, and many
+observations repeat exactly: an empty view, no offer and nothing heard. ActionCache keys
+every row of a batch on a blake2b digest of its observation plus the snapshot id, and only
+the rows it hasn't seen go through the policy.
+
+Deterministic opponents cache their actions. Stochastic ones cache the parameters of
+their action distribution instead, and actions are sampled from them on every call.
+"""
+import numpy as np
+from hashlib import blake2b
+from collections import OrderedDict
+from gymnasium import spaces
+
+from utils import AgentAction, AgentObs
+
+class ActionCache:
+    """LRU of at most `capacity` rows, each a dict of arrays (actions or distribution parameters).
+
+    Rows live in preallocated tables, the LRU maps keys to table rows and evicted rows are reused.
+    """
+
+    def __init__(self, capacity : int = 4096):
+        assert capacity > 0
+        self.capacity = capacity
+        self.rows : OrderedDict[tuple, int] = OrderedDict() # key -> row of the tables
+        self.tables : dict[str, np.ndarray] = None # allocated on the first insert
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        self.rows.clear()
+
+    def keys(self, obs : AgentObs, snapshot_ids : list) -> list[tuple]:
+        """One key per row of a batch of (C-contiguous, as stack_obs makes them) observations"""
+        values = [obs] if isinstance(obs, np.ndarray) else list(obs.values())
+        keys = []
+        for i, snapshot_id in enumerate(snapshot_ids):
+            digest = blake2b(digest_size=16)
+            for value in values:
+                digest.update(value[i])
+            keys.append((snapshot_id, digest.digest()))
+        return keys
+
+    def get(self, obs : AgentObs, snapshot_ids : list, compute) -> dict[str, np.ndarray]:
+        """Batched entries for every row, compute(rows) is called on the rows not in the cache.
+
+        compute gets the row indices and returns a dict of arrays with one row per index.
+        """
+        keys = self.keys(obs, snapshot_ids)
+        # the rows of this batch are the most recent ones, inserting never evicts them
+        assert len(keys) <= self.capacity, f"a batch of {len(keys)} rows doesn't fit a cache of {self.capacity}"
+        rows = [self.rows.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        for key, row in zip(keys, rows):
+            if row is not None:
+                self.rows.move_to_end(key)
+
+        if missing:
+            computed = {name : np.asarray(value) for name, value in dict(compute(missing)).items()}
+            if self.tables is None:
+                self.tables = {name : np.zeros((self.capacity, ) + value.shape[1:], dtype=value.dtype)
+                               for name, value in computed.items()}
+            for j, i in enumerate(missing):
+                row = self.rows.get(keys[i]) # the same observation twice in one batch
+                if row is None:
+                    row = len(self.rows) if len(self.rows) < self.capacity else self.rows.popitem(last=False)[1]
+                    self.rows[keys[i]] = row
+                for name, value in computed.items():
+                    self.tables[name][row] = value[j]
+                rows[i] = row
+        return {name : table[rows] for name, table in self.tables.items()}
+
+def select_rows(obs : AgentObs, rows : list[int]) -> AgentObs:
+    if isinstance(obs, np.ndarray):
+        return obs[rows]
+    return {key : value[rows] for key, value in obs.items()}
+
+def distribution_params(policy, obs : AgentObs) -> dict[str, np.ndarray]:
+    """Parameters of the policy's action distribution for a batch, see sample_actions"""
+    policy = getattr(policy, "policy", policy)
+    if hasattr(policy, "distribution_params"): # a NumpyPolicy
+        return policy.distribution_params(obs)
+    import torch
+
+    obs_tensor, _ = policy.obs_to_tensor(obs)
+    with torch.no_grad():
+        distribution = policy.get_distribution(obs_tensor)
+    return {key : value.cpu().numpy() for key, value in _distribution_params(distribution, "").items()}
+
+def _distribution_params(distribution, prefix : str) -> dict:
+    # an SB3 Distribution wraps a torch distribution, a list of them (MultiDiscrete)
+    # or, for a Dict action space, a dict of SB3 Distributions
+    import torch
+
+    distribution = getattr(distribution, "distribution", distribution)
+    if isinstance(distribution, dict):
+        params = {}
+        for key, value in distribution.items():
+            params.update(_distribution_params(value, prefix + key + "/"))
+        return params
+    if isinstance(distribution, (list, tuple)):
+        return {prefix + "logits/" + str(i) : value.logits for i, value in enumerate(distribution)}
+    if isinstance(distribution, torch.distributions.Categorical):
+        return {prefix + "logits" : distribution.logits}
+    if isinstance(distribution, torch.distributions.Normal):
+        return {prefix + "mean" : distribution.loc, prefix + "std" : distribution.scale}
+    raise TypeError(f"can't cache a {type(distribution).__name__} action distribution")
+
+def sample_actions(params : dict[str, np.ndarray], action_space : spaces.Dict, rng : np.random.Generator) -> AgentAction:
+    """Samples a batch of actions like policy.predict(obs, deterministic=False) would"""
+    actions = {}
+    for key, space in action_space.spaces.items():
+        prefix = key + "/"
+        if isinstance(space, spaces.Discrete):
+            actions[key] = _sample_categorical(params[prefix + "logits"], rng) + space.start
+        elif isinstance(space, spaces.MultiDiscrete):
+            logits = [params[prefix + "logits/" + str(i)] for i in range(space.nvec.size)]
+            tokens = np.stack([_sample_categorical(value, rng) for value in logits], axis=1)
+            actions[key] = tokens.reshape((-1, ) + space.shape)
+        elif isinstance(space, spaces.Box):
+            mean, std = params[prefix + "mean"], params[prefix + "std"]
+            action = mean + std * rng.standard_normal(mean.shape, dtype=mean.dtype)
+            actions[key] = np.clip(action.reshape((-1, ) + space.shape), space.low, space.high)
+        else:
+            raise TypeError(f"can't sample a {type(space).__name__} action")
+    return actions
+
+def _sample_categorical(logits : np.ndarray, rng : np.random.Generator) -> np.ndarray:
+    # Gumbel-max: argmax of the logits plus Gumbel noise is a sample of softmax(logits)
+    return np.argmax(logits - np.log(-np.log(rng.random(logits.shape))), axis=-1)
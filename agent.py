@@ -1,6 +1,9 @@
+import numpy as np
 from enum import Enum
-from utils import (AgentAction, AgentObs,
-    calculate_dis, get_random_pos, get_emtpy_speech, cell_free, unpack_action, drop_piece_in_room)
+from world import World, NONE
+from instrumentation import EnvStats
+from utils import (AgentAction, AgentObs, ObsLayout,
+    calculate_dis, get_obs_layout_size, unflatten_obs, unpack_action)
 
 reward_config = {
     "invalid_movement_penalty" : 1,
@@ -15,6 +18,9 @@ reward_config = {
     "teammate_piece_found_reward" : 0.5,
 }
 
+# counted in EnvStats, penalties are counted for every agent even though only the learning agent pays them
+stat_events = ["offers", "trades", "pieces_found"] + [key for key in reward_config if key.endswith("_penalty")]
+
 class AgentActions(Enum):
     MOVE = 0
     PICK_UP_A_PIECE = 1
@@ -32,21 +38,36 @@ class Agent:
     n_colors = 0
     listen_history_size = 0
     vision_grid_size = 0
+    hearing_radius = 0
+    vision_mask = None
+    obs_layout : ObsLayout = None # set in flat observation mode
 
-    def __init__(self, id, x, y, model):
+    def __init__(self, id, world : World, model, stats : EnvStats = None):
         self.id = id
-        self.x = x
-        self.y = y
-        self.color = None
-        self.piece = None
-        self.piece_in_hand = None
-        self.piece_being_offered = None
-        self.agent_with_offer = None
+        self.ind = id - 1
+        self.world = world
+        self.stats = stats if stats is not None else EnvStats(stat_events)
         
         self.model = model
         self.reward = 0
-        self.my_speech = get_emtpy_speech() # what i said this turn
-        self.listen_history = [get_emtpy_speech() for i in range(Agent.listen_history_size)]
+        self.my_speech = world.speech.utterances[self.ind] # what i said this turn
+        self.history_slots = list(world.speech.histories[self.ind]) # ring buffer slots, in memory order
+
+        # observation buffers are written in place, the same dict (or flat array) is returned on every call
+        if Agent.obs_layout is not None:
+            self.flat_obs = np.zeros(get_obs_layout_size(Agent.obs_layout), dtype=np.float32)
+            self.obs_dict = unflatten_obs(self.flat_obs, Agent.obs_layout)
+        else:
+            self.flat_obs = None
+            self.obs_dict = {
+                "eyes" : np.zeros((Agent.vision_grid_size, Agent.vision_grid_size, 6), dtype=np.float32),
+                "offer" : np.zeros((1, 4), dtype=np.float32),
+                "desired_piece" : np.zeros((1, 2), dtype=np.float32)
+            }
+        self.speech_heard = None # utterances heard when the speech entries were last updated
+        self.vision_stamp = -1 # world stamp when the eyes were last built
+        self.vision_pos = None
+        self.offer_state = None
 
     def step(self, action : AgentAction, env_info) -> float:
         discrete_action, dx, dy, agent_ind, speech = unpack_action(action)
@@ -70,24 +91,18 @@ class Agent:
         else:
             ... # do nothing
 
-        if self.piece_in_hand != None:
-            self.piece_in_hand.x = self.x
-            self.piece_in_hand.y = self.y
-
         return self._get_reward()
 
     def process_obs(self, env_info) -> AgentObs:
+        # no side effects, parts whose inputs didn't change since the last call are left as they are.
+        # Returns the agent's own buffers, the next call overwrites them
         agents, pieces = env_info
 
-        self._process_listen_history(agents)
-        vision_grid = self._process_vision_grid(agents, pieces)
-        offer = self._process_offer(agents)
-        
-        obs_dict = {"eyes" : vision_grid, "offer" : offer, "desired_piece" : self.desired_piece}
-        for i in range(Agent.listen_history_size):
-            obs_dict["speech " + str(i + 1)] = self.listen_history[i]
+        self._process_vision_grid(agents, pieces)
+        self._process_offer(agents)
+        self._process_speech()
 
-        return obs_dict
+        return self.obs_dict if self.flat_obs is None else self.flat_obs
 
     def choose_action(self, obs : AgentObs) -> AgentAction:
         action, _ = self.model.predict(obs)
@@ -100,23 +115,20 @@ class Agent:
         new_x = self.x + dx
         new_y = self.y + dy
 
-        in_bounds = new_x < Agent.grid_size and new_y < Agent.grid_size and 0 <= new_x and 0 <= new_y
-
-        if in_bounds and cell_free(new_x, new_y, agents):
-            self.x, self.y = new_x, new_y
-        elif self.is_learning_agent():
-            self.reward -= reward_config["invalid_movement_penalty"]
+        if self.world.in_bounds(new_x, new_y) and self.world.cell_free(new_x, new_y):
+            self.world.move_agent(self.ind, new_x, new_y)
+        else:
+            self._penalize("invalid_movement_penalty")
 
     def pick_up_a_piece(self, pieces):
         if self.piece_in_hand == None:
-            for piece in pieces:
-                if piece.x == self.x and piece.y == self.y:
-                    if piece.color == self.color:
-                        self.piece_in_hand = piece
-                        self.reward += reward_config["correct_pick_up_reward"]
-                    elif self.is_learning_agent():
-                        self.reward -= reward_config["invalid_pick_up_penalty"]
-                    break
+            piece = self.world.piece_grid[self.x, self.y]
+            if piece != NONE:
+                if self.world.piece_color[piece] == self.color:
+                    self.world.give(piece, self.ind)
+                    self.reward += reward_config["correct_pick_up_reward"]
+                else:
+                    self._penalize("invalid_pick_up_penalty")
 
     def offer_a_piece(self, agents, agent_ind):
         if agent_ind != self.id - 1 and self.piece_in_hand != None:
@@ -125,16 +137,14 @@ class Agent:
             target_not_being_offered = target_agent.agent_with_offer == None
             target_in_distance = calculate_dis(self.x, self.y, target_agent.x, target_agent.y) <= Agent.vision_dis()
 
-            reward = 0
             if target_not_being_offered and target_in_distance:
                 target_agent.agent_with_offer = self.id
                 target_agent.piece_being_offered = self.piece_in_hand
-                reward += reward_config["successful_offer_reward"]
+                self.stats.count("offers")
+                if self.is_learning_agent():
+                    self.reward += reward_config["successful_offer_reward"]
             else:
-                reward -= reward_config["invalid_offer_penalty"]
-
-            if self.is_learning_agent():
-                self.reward += reward
+                self._penalize("invalid_offer_penalty")
 
     def accept_a_piece(self, agents, pieces, agent_ind):
         target_agent = agents[agent_ind]
@@ -154,49 +164,63 @@ class Agent:
                 else:
                     self.reward += reward_config["teammate_piece_found_reward"]
                 
+                self.world.remove_piece(self.piece_being_offered.ind)
+                self.world.agent_found[self.ind] = True
                 pieces.remove(self.piece_being_offered)
-                print("Piece found!")
+                self.stats.count("pieces_found")
             else:
-                print("Trade!")
-                self.piece_in_hand = self.piece_being_offered
+                self.stats.count("trades")
+                self.world.give(self.piece_being_offered.ind, self.ind)
             
             self.piece_being_offered = None
             self.agent_with_offer = None
-            target_agent.piece_in_hand = None
     
     def stop_offering_a_piece(self, agents, agent_ind):
         target_agent = agents[agent_ind]
         if self.piece_in_hand != None and target_agent.piece_being_offered == self.piece_in_hand:
             self.agent_with_offer = None
             target_agent.piece_being_offered = None
-        elif self.is_learning_agent():
-            self.reward -= reward_config["invalid_stop_offering_penalty"]
+        else:
+            self._penalize("invalid_stop_offering_penalty")
 
     def drop_piece(self, agents, pieces):
         if self.piece_in_hand != None:
-            drop_piece_in_room(self.piece_in_hand, agents + pieces, Agent.grid_size)
-            self.piece_in_hand = None
-        elif self.is_learning_agent():
-            self.reward -= reward_config["invalid_drop_piece_penalty"]
+            x, y = self.world.random_free_cell(self.world.empty_cells)
+            self.world.drop(self.piece_in_hand.ind, x, y)
+        else:
+            self._penalize("invalid_drop_piece_penalty")
 
     def speak(self, speech):
-        self.my_speech = speech
+        self.world.speech.say(self.ind, speech)
     
-    def reset(self, agents, color, piece):
-        for i in range(Agent.listen_history_size):
-            self.listen_history[i] = get_emtpy_speech()
+    def reset(self, color, piece):
         self._reset_speech()
         self.reward = 0
 
-        self.x, self.y = get_random_pos(agents, Agent.grid_size)
-        self.color = color
-        self.piece = piece
-        self.piece_in_hand = None
-        self.piece_being_offered = None
-        self.agent_with_offer = None
+        x, y = self.world.random_free_cell(self.world.no_agent_cells)
+        self.world.move_agent(self.ind, x, y)
+        self.world.agent_color[self.ind] = color
+        self.world.agent_target[self.ind] = piece.ind
+        self.world.agent_hand[self.ind] = NONE
+        self.world.agent_offered[self.ind] = NONE
+        self.world.agent_offer_from[self.ind] = NONE
+        self.invalidate_obs()
+
+    def invalidate_obs(self):
+        # for when the world was rewritten wholesale, the next process_obs rebuilds everything
+        self.vision_stamp = -1
+        self.vision_pos = None
+        self.offer_state = None
+        self.speech_heard = None
+        self.desired_piece[0] = (self.piece.letter / Agent.max_piece_letter, self.piece.color / Agent.n_colors)
 
     def _reset_speech(self):
-        self.my_speech = get_emtpy_speech()
+        self.world.speech.silence(self.ind)
+
+    def _penalize(self, penalty):
+        self.stats.count(penalty)
+        if self.is_learning_agent():
+            self.reward -= reward_config[penalty]
 
     def _get_reward(self):
         reward = self.reward 
@@ -206,80 +230,156 @@ class Agent:
     def _process_vision_grid(self, agents, pieces):
         # (agent id, agent color, piece letter, piece color,
         # letter of piece that agent is holding, color of piece that agent is holding)
-        vision_grid = [[(0, 0, 0, 0, 0, 0) for i in range(Agent.vision_grid_size)]
-                        for j in range(Agent.vision_grid_size)]
-
-        for agent in agents:
-            if calculate_dis(agent.x, agent.y, self.x, self.y) <= Agent.vision_dis():
-                x_, y_ = agent.x - (self.x - 2), agent.y - (self.y - 2)
-                _, _, piece_letter, piece_color, _, _  = vision_grid[x_][y_]
-
-                vision_grid[x_][y_] = (
-                    agent.id / Agent.max_agent_id,
-                    agent.color / Agent.n_colors,
-                    piece_letter,
-                    piece_color,
-                    0 if agent.piece_in_hand == None else agent.piece_in_hand.letter / Agent.max_piece_letter,
-                    0 if agent.piece_in_hand == None else agent.piece_in_hand.color / Agent.n_colors)
-
-        for piece in pieces:
-            if calculate_dis(piece.x, piece.y, self.x, self.y) <= Agent.vision_dis():
-                x_, y_ = piece.x - (self.x - 2), piece.y - (self.y - 2)
-                agent_id, agent_color, _, _, piece_in_hand_letter, piece_in_hand_color = vision_grid[x_][y_]
-
-                vision_grid[x_][y_] = (agent_id,
-                    agent_color,
-                    piece.letter / Agent.max_piece_letter,
-                    piece.color / Agent.n_colors,
-                    piece_in_hand_letter,
-                    piece_in_hand_color)
-                
+        world = self.world
+        vision_grid = self.obs_dict["eyes"]
+        pos = (self.x, self.y)
+        if pos == self.vision_pos and world.window_version(*pos, Agent.vision_dis()) <= self.vision_stamp:
+            return vision_grid
+        self.vision_pos = pos
+        self.vision_stamp = world.stamp
+        vision_grid.fill(0)
+
+        agent_window = world.agent_window(self.x, self.y, Agent.vision_dis())
+        piece_window = world.piece_window(self.x, self.y, Agent.vision_dis())
+
+        agent_cells = (agent_window != NONE) & Agent.vision_mask
+        if agent_cells.any():
+            seen_agents = agent_window[agent_cells]
+            vision_grid[agent_cells, 0] = (seen_agents + 1) / Agent.max_agent_id
+            vision_grid[agent_cells, 1] = world.agent_color[seen_agents] / Agent.n_colors
+
+            held_pieces = world.agent_hand[seen_agents]
+            holding = held_pieces != NONE
+            held_pieces = held_pieces[holding]
+            held_cells = np.zeros_like(agent_cells)
+            held_cells[agent_cells] = holding
+            vision_grid[held_cells, 4] = world.piece_letter[held_pieces] / Agent.max_piece_letter
+            vision_grid[held_cells, 5] = world.piece_color[held_pieces] / Agent.n_colors
+
+            # a held piece sits on its holder's cell, it shows up there unless a piece lies on the ground
+            held_cells &= piece_window == NONE
+            held_pieces = world.agent_hand[agent_window[held_cells]]
+            vision_grid[held_cells, 2] = world.piece_letter[held_pieces] / Agent.max_piece_letter
+            vision_grid[held_cells, 3] = world.piece_color[held_pieces] / Agent.n_colors
+
+        piece_cells = (piece_window != NONE) & Agent.vision_mask
+        if piece_cells.any():
+            seen_pieces = piece_window[piece_cells]
+            vision_grid[piece_cells, 2] = world.piece_letter[seen_pieces] / Agent.max_piece_letter
+            vision_grid[piece_cells, 3] = world.piece_color[seen_pieces] / Agent.n_colors
+
         return vision_grid
 
-    def _process_listen_history(self, agents):
-        speech = None
-        min_dis = 10000
-        for agent in agents:
-            if agent.id != self.id and not agent.my_speech.any():
-                dis_to_agent = calculate_dis(agent.x, agent.y, self.x, self.y)
-                if dis_to_agent < min_dis <= 5:
-                    min_dis = dis_to_agent
-                    speech = agent.my_speech
-
-        if speech != None:
-            self.listen_history.append(speech)
-        
-        if len(self.listen_history) > Agent.listen_history_size:
-            self.listen_history.pop(0)
+    def _process_speech(self):
+        # "speech i" entries are views of the ring buffer, oldest utterance first. They only
+        # need re-pointing when this agent heard something, nothing is copied.
+        # A flat observation can't point anywhere else, there the slots are copied in
+        speech = self.world.speech
+        if speech.heard[self.ind] != self.speech_heard:
+            self.speech_heard = speech.heard[self.ind]
+            head = speech.head[self.ind]
+            slots = self.history_slots[head:] + self.history_slots[:head]
+            for i, slot in enumerate(slots):
+                if self.flat_obs is None:
+                    self.obs_dict["speech " + str(i + 1)] = slot
+                else:
+                    self.obs_dict["speech " + str(i + 1)][...] = slot
 
     def _process_offer(self, agents):
         # piece letter, piece color, target agent, am i holding a piece
-        offer = [(
-            self.piece_being_offered.letter / Agent.max_piece_letter if self.piece_being_offered != None else 0,
-            self.piece_being_offered.color / Agent.n_colors if self.piece_being_offered != None else 0,
-            self.agent_with_offer / Agent.max_agent_id if self.agent_with_offer != None else 0,
+        offer = self.obs_dict["offer"]
+        world = self.world
+        state = (world.agent_offered[self.ind], world.agent_offer_from[self.ind], world.agent_hand[self.ind])
+        if state == self.offer_state:
+            return offer
+        self.offer_state = state
+
+        piece_being_offered = self.piece_being_offered
+        agent_with_offer = self.agent_with_offer
+
+        offer[0] = (
+            piece_being_offered.letter / Agent.max_piece_letter if piece_being_offered != None else 0,
+            piece_being_offered.color / Agent.n_colors if piece_being_offered != None else 0,
+            agent_with_offer / Agent.max_agent_id if agent_with_offer != None else 0,
             float(self.piece_in_hand != None)
-        )]
+        )
 
         return offer
 
     @property
     def desired_piece(self):
-        return [(
-            self.piece.letter / Agent.max_piece_letter,
-            self.piece.color / Agent.n_colors
-        )]
+        return self.obs_dict["desired_piece"]
+
+    @property
+    def x(self):
+        return int(self.world.agent_pos[self.ind, 0])
+
+    @property
+    def y(self):
+        return int(self.world.agent_pos[self.ind, 1])
+
+    @property
+    def color(self):
+        return int(self.world.agent_color[self.ind])
+
+    @property
+    def piece(self):
+        return self.world.piece_views[self.world.agent_target[self.ind]]
+
+    @property
+    def piece_in_hand(self):
+        return self._get_piece_view(self.world.agent_hand[self.ind])
+
+    @property
+    def piece_being_offered(self):
+        return self._get_piece_view(self.world.agent_offered[self.ind])
+
+    @piece_being_offered.setter
+    def piece_being_offered(self, piece):
+        self.world.agent_offered[self.ind] = NONE if piece == None else piece.ind
+
+    @property
+    def agent_with_offer(self):
+        agent = self.world.agent_offer_from[self.ind]
+        return None if agent == NONE else int(agent) + 1
+
+    @agent_with_offer.setter
+    def agent_with_offer(self, agent_id):
+        self.world.agent_offer_from[self.ind] = NONE if agent_id == None else agent_id - 1
+
+    def _get_piece_view(self, piece):
+        return None if piece == NONE else self.world.piece_views[piece]
 
     def vision_dis():
         return int(Agent.vision_grid_size/2)
 
 class Piece:
-    def __init__(self, x, y, color, letter):
-        self.x = x
-        self.y = y
-        self.color = color
-        self.letter = letter
-
-    def make_new_piece(pieces, letter):
-        x, y = get_random_pos(pieces, Agent.grid_size)
-        return Piece(x, y, None, letter) # Set color later
+    """View over the piece with index `ind` in a World"""
+
+    def __init__(self, ind, world : World):
+        self.ind = ind
+        self.world = world
+
+    @property
+    def x(self):
+        return int(self.world.get_piece_pos(self.ind)[0])
+
+    @property
+    def y(self):
+        return int(self.world.get_piece_pos(self.ind)[1])
+
+    @property
+    def color(self):
+        return int(self.world.piece_color[self.ind])
+
+    @color.setter
+    def color(self, color):
+        self.world.piece_color[self.ind] = color
+
+    @property
+    def letter(self):
+        return int(self.world.piece_letter[self.ind])
+
+    @letter.setter
+    def letter(self, letter):
+        self.world.piece_letter[self.ind] = letter
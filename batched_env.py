@@ -0,0 +1,552 @@
+"""B independent games stepped at once with NumPy.
+
+Implements the rules of Agent.step with every agent learning (the ParallelGameEnv
+setting): the same reward_config, the same order of resolution (actions grouped by
+type, lower agent ids first) and the same observation layout as
+CustomEnv.observation_space. agent.py stays the reference implementation,
+check_against_reference() replays random games on both and compares them.
+
+    python batched_env.py    # runs the reference check and a quick throughput test
+"""
+import time
+import numpy as np
+
+from agent import AgentActions, reward_config
+from world import NONE, disk_mask
+from speech import random_speech, speech_format
+from utils import copy_obs, get_obs_layout, get_obs_layout_size, unflatten_obs
+
+ACTION_KEYS = ["action", "dx", "dy", "agent", "speech"]
+
+class BatchedGameEnv:
+    def __init__(self,
+                 n_worlds,
+                 max_steps,
+                 n_colors,
+                 n_agents,
+                 n_pieces,
+                 n_letters,
+                 grid_size,
+                 listen_history_size = 5,
+                 vision_grid_size = 5,
+                 hearing_radius = 5,
+                 seed = None,
+                 auto_reset = False,
+                 flat_obs = False,
+                 speech_mode = "continuous",
+                 speech_vocab_size = 16,
+                 speech_length = 8):
+        assert 0 < n_agents <= n_pieces
+        assert n_colors > 1
+        assert n_letters > 0
+        assert vision_grid_size % 2 == 1 and hearing_radius >= 0
+
+        self.n_worlds = B = n_worlds
+        self.max_steps = max_steps
+        self.n_colors = n_colors
+        self.n_agents = N = n_agents
+        self.n_pieces = P = n_pieces
+        self.n_letters = n_letters
+        self.grid_size = G = grid_size
+        self.listen_history_size = listen_history_size
+        self.vision_grid_size = vision_grid_size
+        self.vision_dis = vision_grid_size // 2
+        self.hearing_radius = hearing_radius
+        self.speech_mode = speech_mode
+        self.speech_vocab_size = speech_vocab_size
+        self.speech_length = speech_length
+        self.speech_shape, speech_dtype = speech_format(speech_mode, speech_vocab_size, speech_length)
+        assert not (flat_obs and speech_mode == "tokens"), "flat observations are float32, token speech needs the dict ones"
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+
+        self.world_ind = np.arange(B)[:, None] # broadcasts against (B, N) / (B, P)
+        self.agent_ind = np.arange(N)[None, :]
+
+        self.steps = np.zeros(B, dtype=np.int64)
+        self.agent_pos = np.zeros((B, N, 2), dtype=np.int32)
+        self.agent_color = np.zeros((B, N), dtype=np.int32)
+        self.agent_target = np.zeros((B, N), dtype=np.int32)
+        self.agent_hand = np.full((B, N), NONE, dtype=np.int32)
+        self.agent_offered = np.full((B, N), NONE, dtype=np.int32)
+        self.agent_offer_from = np.full((B, N), NONE, dtype=np.int32)
+        self.agent_found = np.zeros((B, N), dtype=bool)
+        self.piece_pos = np.zeros((B, P, 2), dtype=np.int32)
+        self.piece_color = np.zeros((B, P), dtype=np.int32)
+        self.piece_letter = np.zeros((B, P), dtype=np.int32)
+        self.piece_holder = np.full((B, P), NONE, dtype=np.int32)
+        self.piece_alive = np.zeros((B, P), dtype=bool)
+        self.dropped = np.zeros((B, P), dtype=bool) # pieces placed on a random cell during the last step
+
+        self.speech = np.zeros((B, N) + self.speech_shape, dtype=speech_dtype)
+        self.speaking = np.zeros((B, N), dtype=bool)
+        self.listen_history = np.zeros((B, N, listen_history_size) + self.speech_shape, dtype=speech_dtype)
+
+        # padded occupancy grids, same layout as World
+        self.pad = max(self.vision_dis, 1)
+        padded_size = G + 2 * self.pad
+        self.agent_grid_padded = np.full((B, padded_size, padded_size), NONE, dtype=np.int32)
+        self.piece_grid_padded = np.full((B, padded_size, padded_size), NONE, dtype=np.int32)
+        inner = slice(self.pad, self.pad + G)
+        self.agent_grid = self.agent_grid_padded[:, inner, inner]
+        self.piece_grid = self.piece_grid_padded[:, inner, inner]
+
+        self.vision_mask, _ = disk_mask(self.vision_dis)
+        offsets = np.arange(-self.vision_dis, self.vision_dis + 1)
+        self.vision_dx = offsets[:, None] + np.zeros_like(offsets)[None, :]
+        self.vision_dy = np.zeros_like(offsets)[:, None] + offsets[None, :]
+
+        V = vision_grid_size
+        self.obs = {
+            "eyes" : np.zeros((B, N, V, V, 6), dtype=np.float32),
+            "offer" : np.zeros((B, N, 1, 4), dtype=np.float32),
+            "desired_piece" : np.zeros((B, N, 1, 2), dtype=np.float32)
+        }
+        for i in range(listen_history_size):
+            self.obs["speech " + str(i + 1)] = self.listen_history[:, :, i]
+
+        # flat mode: one (B, N, size) array laid out as CustomEnv's flat observations, the entries
+        # above become views of it and the listen history lives where its "speech i" entries are
+        self.flat_obs = None
+        self.obs_layout = None
+        if flat_obs:
+            self.obs_layout = get_obs_layout({key : value.shape[2:] for key, value in self.obs.items()})
+            self.flat_obs = np.zeros((B, N, get_obs_layout_size(self.obs_layout)), dtype=np.float32)
+            self.obs = unflatten_obs(self.flat_obs, self.obs_layout)
+            if listen_history_size > 0:
+                offset, _ = self.obs_layout["speech 1"]
+                self.listen_history = self.flat_obs[..., offset : offset + self.listen_history[0, 0].size].reshape(
+                    self.listen_history.shape)
+
+    # ----- reset
+
+    def reset(self, mask : np.ndarray = None) -> dict:
+        """Starts new games in the worlds selected by mask (all of them by default)"""
+        worlds = np.arange(self.n_worlds) if mask is None else np.flatnonzero(mask)
+        W, N, P = len(worlds), self.n_agents, self.n_pieces
+        rng = self.rng
+
+        self.steps[worlds] = 0
+        # agent colors are an even split over the colors, shuffled
+        colors = (np.arange(N) % self.n_colors) + 1
+        self.agent_color[worlds] = np.take_along_axis(np.broadcast_to(colors, (W, N)),
+                                                      np.argsort(rng.random((W, N)), axis=1), axis=1)
+        self.agent_target[worlds] = np.arange(N)
+        self.agent_hand[worlds] = NONE
+        self.agent_offered[worlds] = NONE
+        self.agent_offer_from[worlds] = NONE
+        self.agent_found[worlds] = False
+
+        # pieces on distinct cells, agents on distinct cells (agents may stand on pieces)
+        self.piece_pos[worlds] = self._distinct_cells(W, P)
+        self.agent_pos[worlds] = self._distinct_cells(W, N)
+        self.piece_letter[worlds] = rng.integers(1, self.n_letters + 1, (W, P))
+        self.piece_color[worlds] = rng.integers(1, self.n_colors + 1, (W, P))
+
+        # piece i is the one agent i wants, never of the agent's own color (generate_piece_color)
+        piece_color = rng.integers(0, self.n_colors, (W, N))
+        same = piece_color == self.agent_color[worlds] - 1
+        shift = rng.integers(1, self.n_colors, (W, N))
+        self.piece_color[worlds, :N] = np.where(same, (piece_color + shift) % self.n_colors, piece_color) + 1
+
+        self.piece_holder[worlds] = NONE
+        self.piece_alive[worlds] = True
+        self.dropped[worlds] = False
+        self.speech[worlds] = 0
+        self.speaking[worlds] = False
+        self.listen_history[worlds] = 0
+
+        self._rebuild_grids(worlds)
+        self._write_desired_piece(worlds)
+        return self._write_observations()
+
+    def _distinct_cells(self, n_worlds, n_cells) -> np.ndarray:
+        cells = np.argsort(self.rng.random((n_worlds, self.grid_size ** 2)), axis=1)[:, :n_cells]
+        return np.stack(np.divmod(cells, self.grid_size), axis=-1)
+
+    def _rebuild_grids(self, worlds):
+        p = self.pad
+        self.agent_grid_padded[worlds] = NONE
+        self.piece_grid_padded[worlds] = NONE
+
+        w = worlds[:, None]
+        pos = self.agent_pos[worlds]
+        self.agent_grid_padded[w, pos[..., 0] + p, pos[..., 1] + p] = np.arange(self.n_agents)
+
+        on_ground = self.piece_alive[worlds] & (self.piece_holder[worlds] == NONE)
+        w_ind, piece_ind = np.nonzero(on_ground)
+        pos = self.piece_pos[worlds[w_ind], piece_ind]
+        self.piece_grid_padded[worlds[w_ind], pos[:, 0] + p, pos[:, 1] + p] = piece_ind
+
+    def load_world(self, world : int, game_env) -> None:
+        """Copies the state of a GameEnv into one of the worlds"""
+        source = game_env.world
+        self.steps[world] = game_env.step_
+        for name in ("agent_pos", "agent_color", "agent_target", "agent_hand", "agent_offered",
+                     "agent_offer_from", "agent_found", "piece_pos", "piece_color", "piece_letter", "piece_holder", "piece_alive"):
+            getattr(self, name)[world] = getattr(source, name)
+        self.speech[world] = source.speech.utterances
+        self.listen_history[world] = source.speech.ordered_history()
+        self.speaking[world] = source.speech.speaking
+        self.dropped[world] = False
+
+        self._rebuild_grids(np.array([world]))
+        self._write_desired_piece(np.array([world]))
+        self._write_observations()
+
+    # ----- step
+
+    def step(self, actions : dict):
+        """actions: dict of (B, N) arrays, plus "speech" of shape (B, N) + speech_shape.
+
+        Returns observations, rewards (B, N), terminated (B,), truncated (B,) and info. A world
+        terminates once every agent found its piece. The observation buffers are reused across steps.
+        """
+        action = np.asarray(actions["action"])
+        delta = np.stack((np.asarray(actions["dx"]), np.asarray(actions["dy"])), axis=-1) - 1
+        target = np.asarray(actions["agent"])
+        speech = np.asarray(actions["speech"], dtype=self.speech.dtype).reshape(self.speech.shape)
+
+        rewards = np.zeros((self.n_worlds, self.n_agents), dtype=np.float32)
+        self.dropped.fill(False)
+
+        self._move(action == AgentActions.MOVE.value, delta, rewards)
+        self._pick_up(action == AgentActions.PICK_UP_A_PIECE.value, rewards)
+        self._offer(action == AgentActions.OFFER_A_PIECE.value, target, rewards)
+        self._accept(action == AgentActions.ACCEPT_A_PIECE.value, target, rewards)
+        self._stop_offering(action == AgentActions.STOP_OFFERING_A_PIECE.value, target, rewards)
+        self._drop(action == AgentActions.DROP_PIECE.value, rewards)
+        self._speak(action == AgentActions.SPEAK.value, speech)
+
+        self.steps += 1
+        self._hear()
+        obs = self._write_observations()
+
+        terminated = self.agent_found.all(axis=1)
+        truncated = ~terminated & (self.steps >= self.max_steps)
+        info = {}
+        if self.auto_reset and (terminated | truncated).any():
+            info["final_observation"] = copy_obs(obs)
+            obs = self.reset(terminated | truncated)
+        return obs, rewards, terminated, truncated, info
+
+    def _first_per_key(self, mask : np.ndarray, keys : np.ndarray) -> np.ndarray:
+        """Marks, among the masked (world, agent) entries, the lowest agent for every key"""
+        flat = np.flatnonzero(mask)
+        first = np.zeros(mask.shape, dtype=bool)
+        if len(flat):
+            flat_keys = keys.ravel()[flat]
+            order = np.argsort(flat_keys, kind="stable") # flat is already in (world, agent) order
+            sorted_keys = flat_keys[order]
+            is_first = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+            first.ravel()[flat[order[is_first]]] = True
+        return first
+
+    def _move(self, moving, delta, rewards):
+        G, p = self.grid_size, self.pad
+        new_pos = self.agent_pos + delta
+        in_bounds = moving & np.all((new_pos >= 0) & (new_pos < G), axis=-1)
+        new_pos = np.clip(new_pos, 0, G - 1)
+        occupant = np.where(in_bounds, self.agent_grid_padded[self.world_ind, new_pos[..., 0] + p, new_pos[..., 1] + p], NONE)
+        cell_keys = (self.world_ind * G + new_pos[..., 0]) * G + new_pos[..., 1]
+
+        # An agent moves if its cell is free at its turn: the occupant already moved away
+        # (it has a lower id) and no lower id moved in. That only depends on lower ids,
+        # so iterating from "nobody moved" settles after at most n_agents rounds.
+        moved = np.zeros_like(moving)
+        for _ in range(self.n_agents + 1):
+            occupant_left = (occupant != NONE) & (occupant < self.agent_ind) \
+                & np.take_along_axis(moved, np.maximum(occupant, 0), axis=1)
+            can_move = in_bounds & ((occupant == NONE) | occupant_left)
+            new_moved = self._first_per_key(can_move, cell_keys)
+            if (new_moved == moved).all():
+                break
+            moved = new_moved
+
+        w, a = np.nonzero(moved)
+        old = self.agent_pos[w, a]
+        self.agent_grid_padded[w, old[:, 0] + p, old[:, 1] + p] = NONE
+        self.agent_pos[w, a] = new_pos[w, a]
+        self.agent_grid_padded[w, new_pos[w, a, 0] + p, new_pos[w, a, 1] + p] = a
+
+        rewards -= (moving & ~moved) * reward_config["invalid_movement_penalty"]
+
+    def _pick_up(self, picking, rewards):
+        p = self.pad
+        picking = picking & (self.agent_hand == NONE)
+        piece = self.piece_grid_padded[self.world_ind, self.agent_pos[..., 0] + p, self.agent_pos[..., 1] + p]
+        picking &= piece != NONE
+        right_color = np.take_along_axis(self.piece_color, np.maximum(piece, 0), axis=1) == self.agent_color
+
+        w, a = np.nonzero(picking & right_color)
+        pieces = piece[w, a]
+        self.agent_hand[w, a] = pieces
+        self.piece_holder[w, pieces] = a
+        self.piece_grid_padded[w, self.agent_pos[w, a, 0] + p, self.agent_pos[w, a, 1] + p] = NONE
+
+        rewards += (picking & right_color) * reward_config["correct_pick_up_reward"]
+        rewards -= (picking & ~right_color) * reward_config["invalid_pick_up_penalty"]
+
+    def _offer(self, offering, target, rewards):
+        offering = offering & (target != self.agent_ind) & (self.agent_hand != NONE)
+        target_pos = np.take_along_axis(self.agent_pos, target[..., None], axis=1)
+        in_distance = ((target_pos - self.agent_pos) ** 2).sum(-1) <= self.vision_dis ** 2
+        free_target = np.take_along_axis(self.agent_offer_from, target, axis=1) == NONE
+
+        # the first offer to a target takes it, later ones find it already being offered
+        success = self._first_per_key(offering & in_distance & free_target, self.world_ind * self.n_agents + target)
+
+        w, a = np.nonzero(success)
+        self.agent_offer_from[w, target[w, a]] = a
+        self.agent_offered[w, target[w, a]] = self.agent_hand[w, a]
+
+        rewards += success * reward_config["successful_offer_reward"]
+        rewards -= (offering & ~success) * reward_config["invalid_offer_penalty"]
+
+    def _accept(self, accepting, target, rewards):
+        N = self.n_agents
+        offered = self.agent_offered.copy()
+        accepting = accepting & (offered != NONE)
+        if not accepting.any():
+            return
+
+        piece = np.maximum(offered, 0)
+        desired = self.agent_target
+        found = accepting & (np.take_along_axis(self.piece_color, piece, axis=1) == np.take_along_axis(self.piece_color, desired, axis=1)) \
+            & (np.take_along_axis(self.piece_letter, piece, axis=1) == np.take_along_axis(self.piece_letter, desired, axis=1))
+        first_holder = np.take_along_axis(self.piece_holder, piece, axis=1)
+        first_hand = self.agent_hand.copy()
+        earlier = np.tril(np.ones((N, N), dtype=bool), k=-1)[None] # [i, j]: j acts before i
+        same_piece = (offered[:, :, None] == offered[:, None, :]) & earlier
+        takes_my_hand = (first_hand[:, :, None] == offered[:, None, :]) & (first_hand[:, :, None] != NONE) & earlier
+
+        # An accept succeeds if the target holds the offered piece at the accepter's turn.
+        # That holder only depends on earlier accepts: the last earlier one that took the
+        # piece, or its first holder dropping it when accepting something else. As in
+        # _move, iterate from "nothing succeeded" until it settles. O(n_agents^2) per world.
+        success = np.zeros_like(accepting)
+        for _ in range(N + 1):
+            taker = np.where(same_piece & success[:, None, :], np.arange(N), NONE).max(-1)
+            taker_found = np.take_along_axis(found, np.maximum(taker, 0), axis=1)
+            holder = np.where(taker != NONE, np.where(taker_found, NONE, taker), first_holder)
+            first_holder_left = (taker == NONE) & (first_holder != NONE) & (first_holder < self.agent_ind) \
+                & np.take_along_axis(success, np.maximum(first_holder, 0), axis=1)
+            holder = np.where(first_holder_left, NONE, holder)
+
+            new_success = accepting & (holder == target)
+            if (new_success == success).all():
+                break
+            success = new_success
+
+        # what the accepters were holding at their turn gets dropped in the room
+        hand = np.where((takes_my_hand & success[:, None, :]).any(-1), NONE, first_hand)
+        dropping = success & (hand != NONE) & (hand != offered)
+
+        w, a = np.nonzero(dropping)
+        self._drop_pieces(w, hand[w, a])
+
+        # the last accepter of a piece decides where it ends up
+        w, a = np.nonzero(success)
+        last_taker = np.full(self.piece_holder.shape, NONE, dtype=np.int32)
+        np.maximum.at(last_taker, (w, offered[w, a]), a)
+        w, p = np.nonzero(last_taker != NONE)
+        taker = last_taker[w, p]
+        removed = found[w, taker]
+        self.piece_holder[w, p] = np.where(removed, NONE, taker)
+        self.piece_alive[w[removed], p[removed]] = False
+        self.agent_found |= success & found
+
+        self.agent_hand.fill(NONE)
+        w, p = np.nonzero(self.piece_alive & (self.piece_holder != NONE))
+        self.agent_hand[w, self.piece_holder[w, p]] = p
+
+        self.agent_offered[success] = NONE
+        self.agent_offer_from[success] = NONE
+
+        rewards += success * reward_config["accept_piece_reward"]
+        rewards += (success & found) * reward_config["piece_found_reward"]
+
+    def _stop_offering(self, stopping, target, rewards):
+        hand = self.agent_hand
+        success = stopping & (hand != NONE) & (np.take_along_axis(self.agent_offered, target, axis=1) == hand)
+
+        w, a = np.nonzero(success)
+        self.agent_offer_from[w, a] = NONE # as in Agent.stop_offering_a_piece
+        self.agent_offered[w, target[w, a]] = NONE
+
+        rewards -= (stopping & ~success) * reward_config["invalid_stop_offering_penalty"]
+
+    def _drop(self, dropping, rewards):
+        success = dropping & (self.agent_hand != NONE)
+        w, a = np.nonzero(success)
+        self._drop_pieces(w, self.agent_hand[w, a])
+        self.agent_hand[w, a] = NONE
+
+        rewards -= (dropping & ~success) * reward_config["invalid_drop_piece_penalty"]
+
+    def _drop_pieces(self, worlds, pieces):
+        """Puts the pieces (in drop order) on distinct random cells without agents or pieces"""
+        if len(worlds) == 0:
+            return
+        G, p = self.grid_size, self.pad
+        dropping_worlds, rank = np.unique(worlds, return_inverse=True)
+        occupied = (self.agent_grid[dropping_worlds] != NONE) | (self.piece_grid[dropping_worlds] != NONE)
+        occupied = occupied.reshape(len(dropping_worlds), -1)
+        keys = np.where(occupied, 2.0, self.rng.random(occupied.shape))
+        cells = np.argsort(keys, axis=1)
+
+        counts = np.bincount(rank)
+        if (counts > (~occupied).sum(axis=1)).any():
+            raise Exception("EMPTY CELL NOT FOUND")
+
+        # nth drop of a world takes that world's nth random free cell
+        nth = np.zeros(len(worlds), dtype=np.int64)
+        order = np.argsort(rank, kind="stable")
+        starts = np.r_[0, np.cumsum(counts)[:-1]]
+        nth[order] = np.arange(len(worlds)) - starts[rank[order]]
+
+        x, y = np.divmod(cells[rank, nth], G)
+        self.piece_holder[worlds, pieces] = NONE
+        self.piece_pos[worlds, pieces, 0] = x
+        self.piece_pos[worlds, pieces, 1] = y
+        self.piece_grid_padded[worlds, x + p, y + p] = pieces
+        self.dropped[worlds, pieces] = True
+
+    def _speak(self, speaking, speech):
+        speech_axes = tuple(range(2, self.speech.ndim))
+        self.speech[...] = np.where(np.expand_dims(speaking, speech_axes), speech, 0)
+        self.speaking[...] = speaking & self.speech.any(axis=speech_axes)
+
+    def _hear(self):
+        # nearest agent that spoke this turn within hearing radius, lowest id on ties. O(n_agents^2) per world
+        N = self.n_agents
+        dist2 = ((self.agent_pos[:, :, None, :] - self.agent_pos[:, None, :, :]) ** 2).sum(-1)
+        audible = self.speaking[:, None, :] & (dist2 <= self.hearing_radius ** 2) & ~np.eye(N, dtype=bool)[None]
+        w, a = np.nonzero(audible.any(-1))
+        if len(w) == 0:
+            return
+        keys = np.where(audible[w, a], dist2[w, a] * N + np.arange(N), np.iinfo(np.int64).max)
+        speaker = np.argmin(keys, axis=-1)
+
+        history = self.listen_history[w, a]
+        self.listen_history[w, a] = np.concatenate((history[:, 1:], self.speech[w, speaker][:, None]), axis=1)
+
+    # ----- observations
+
+    def _write_desired_piece(self, worlds):
+        desired = self.agent_target[worlds]
+        w = worlds[:, None]
+        self.obs["desired_piece"][worlds, :, 0, 0] = self.piece_letter[w, desired] / self.n_letters
+        self.obs["desired_piece"][worlds, :, 0, 1] = self.piece_color[w, desired] / self.n_colors
+
+    def _write_observations(self) -> dict:
+        N, L, C, p = self.n_agents, self.n_letters, self.n_colors, self.pad
+        w = self.world_ind[:, :, None, None]
+
+        # (agent id, agent color, piece letter, piece color, held piece letter, held piece color)
+        x = self.agent_pos[..., 0, None, None] + self.vision_dx + p
+        y = self.agent_pos[..., 1, None, None] + self.vision_dy + p
+        seen_agents = np.where(self.vision_mask, self.agent_grid_padded[w, x, y], NONE)
+        seen_pieces = np.where(self.vision_mask, self.piece_grid_padded[w, x, y], NONE)
+        agents = np.maximum(seen_agents, 0)
+        held = np.where(seen_agents != NONE, self.agent_hand[w, agents], NONE)
+        shown = np.where(seen_pieces != NONE, seen_pieces, held) # a held piece shows on its holder's cell
+
+        eyes = self.obs["eyes"]
+        eyes[..., 0] = np.where(seen_agents != NONE, (seen_agents + 1) / N, 0)
+        eyes[..., 1] = np.where(seen_agents != NONE, self.agent_color[w, agents] / C, 0)
+        eyes[..., 2] = np.where(shown != NONE, self.piece_letter[w, np.maximum(shown, 0)] / L, 0)
+        eyes[..., 3] = np.where(shown != NONE, self.piece_color[w, np.maximum(shown, 0)] / C, 0)
+        eyes[..., 4] = np.where(held != NONE, self.piece_letter[w, np.maximum(held, 0)] / L, 0)
+        eyes[..., 5] = np.where(held != NONE, self.piece_color[w, np.maximum(held, 0)] / C, 0)
+
+        # piece letter, piece color, agent making the offer, am i holding a piece
+        offered = self.agent_offered
+        offer = self.obs["offer"][:, :, 0]
+        offer[..., 0] = np.where(offered != NONE, np.take_along_axis(self.piece_letter, np.maximum(offered, 0), axis=1) / L, 0)
+        offer[..., 1] = np.where(offered != NONE, np.take_along_axis(self.piece_color, np.maximum(offered, 0), axis=1) / C, 0)
+        offer[..., 2] = np.where(self.agent_offer_from != NONE, (self.agent_offer_from + 1) / N, 0)
+        offer[..., 3] = self.agent_hand != NONE
+
+        return self.obs if self.flat_obs is None else self.flat_obs
+
+def random_actions(rng, n_worlds, n_agents, speech_mode = "continuous", speech_vocab_size = 16, speech_length = 8) -> dict:
+    return {
+        "action" : rng.integers(0, 8, (n_worlds, n_agents)),
+        "dx" : rng.integers(0, 3, (n_worlds, n_agents)),
+        "dy" : rng.integers(0, 3, (n_worlds, n_agents)),
+        "agent" : rng.integers(0, n_agents, (n_worlds, n_agents)),
+        "speech" : random_speech(rng, (n_worlds, n_agents), speech_mode, speech_vocab_size, speech_length)
+    }
+
+def check_against_reference(n_steps : int = 2000, seed : int = 0, **config) -> int:
+    """Plays the same random actions on ParallelGameEnv and a one-world BatchedGameEnv.
+
+    Pieces dropped on a random cell are the only allowed difference: their cells are
+    copied from the reference after every step. Returns the number of steps compared.
+    """
+    from game_env import GameEnv
+    from parallel_env import ParallelGameEnv, agent_name
+
+    config = dict(dict(max_steps=64, n_colors=2, n_agents=6, n_pieces=8, n_letters=1, grid_size=5), **config)
+    reference = ParallelGameEnv(GameEnv(**config, seed=seed))
+    batched = BatchedGameEnv(1, **config, seed=seed)
+    rng = np.random.default_rng(seed)
+    N = batched.n_agents
+
+    reference.reset()
+    batched.load_world(0, reference.env)
+    for step in range(n_steps):
+        actions = random_actions(rng, 1, N, batched.speech_mode, batched.speech_vocab_size, batched.speech_length)
+        # mostly actions that interact, otherwise trades almost never happen
+        actions["action"] = rng.choice([0, 1, 2, 2, 3, 3, 3, 4, 5, 6, 7], (1, N))
+        reference_actions = {agent_name(i + 1) : {key : value[0, i] for key, value in actions.items()} for i in range(N)}
+
+        obs, rewards, terminations, truncations, _ = reference.step(reference_actions)
+        _, batched_rewards, batched_terminated, _, _ = batched.step(actions)
+
+        world = reference.env.world
+        dropped = batched.dropped[0].copy()
+        batched.piece_pos[0, dropped] = world.piece_pos[dropped]
+        batched._rebuild_grids(np.array([0]))
+        batched._write_observations()
+
+        where = f"step {step}"
+        assert np.allclose([rewards[agent_name(i + 1)] for i in range(N)], batched_rewards[0]), where
+        for name in ("agent_pos", "agent_hand", "agent_offered", "agent_offer_from", "agent_found",
+                     "piece_holder", "piece_alive", "piece_pos"):
+            reference_value, batched_value = getattr(world, name), getattr(batched, name)[0]
+            if name == "piece_pos":
+                on_ground = world.piece_alive & (world.piece_holder == NONE)
+                reference_value, batched_value = reference_value[on_ground], batched_value[on_ground]
+            assert (reference_value == batched_value).all(), (where, name, reference_value, batched_value)
+        reference_obs = [obs[agent_name(i + 1)] for i in range(N)]
+        if batched.obs_layout is not None:
+            reference_obs = [unflatten_obs(agent_obs, batched.obs_layout) for agent_obs in reference_obs]
+        for key, value in batched.obs.items():
+            reference_value = np.stack([agent_obs[key] for agent_obs in reference_obs])
+            assert np.allclose(reference_value, value[0]), (where, key)
+
+        assert terminations[agent_name(1)] == batched_terminated[0], where
+        if terminations[agent_name(1)] or truncations[agent_name(1)]:
+            reference.reset()
+            batched.load_world(0, reference.env)
+    return n_steps
+
+if __name__ == "__main__":
+    print("steps matching the reference:", check_against_reference())
+    print("steps matching the reference, flat observations:", check_against_reference(flat_obs=True))
+    print("steps matching the reference, token speech:", check_against_reference(speech_mode="tokens"))
+
+    batched = BatchedGameEnv(1024, max_steps=256, n_colors=3, n_agents=9, n_pieces=9, n_letters=2, grid_size=12,
+                             seed=0, auto_reset=True)
+    rng = np.random.default_rng(0)
+    batched.reset()
+    actions = [random_actions(rng, batched.n_worlds, batched.n_agents) for _ in range(8)]
+    start = time.perf_counter()
+    n_steps = 100
+    for i in range(n_steps):
+        batched.step(actions[i % len(actions)])
+    elapsed = time.perf_counter() - start
+    print(f"{n_steps * batched.n_worlds / elapsed:.0f} world steps/s, "
+          f"{n_steps * batched.n_worlds * batched.n_agents / elapsed:.0f} agent steps/s")
@@ -0,0 +1,256 @@
+"""Benchmarks for the simulation core.
+
+Runs with a random stub opponent model, so no trained checkpoint is needed:
+
+    python benchmark.py --grid-sizes 12 24 --n-agents 9 36 --output results.json
+    python benchmark.py --compare old.json new.json
+    python benchmark.py --cold-start-only --cold-start-budget 1.0   # exits 1 when over budget
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+import numpy as np
+
+from env import CustomEnv
+from game_env import GameEnv
+
+class RandomModel:
+    """Stand-in for an SB3 model: uniform random actions, batched like model.predict"""
+
+    def __init__(self, n_agents, speech_shape = (1, 120), seed = 0):
+        self.n_agents = n_agents
+        self.speech_shape = speech_shape
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, obs, state = None, episode_start = None, deterministic = False):
+        eyes = obs["eyes"]
+        batched = eyes.ndim == 4
+        n = eyes.shape[0] if batched else 1
+
+        action = {
+            "action" : self.rng.integers(0, 8, n),
+            "dx" : self.rng.integers(0, 3, n),
+            "dy" : self.rng.integers(0, 3, n),
+            "agent" : self.rng.integers(0, self.n_agents, n),
+            "speech" : self.rng.uniform(-1, 1, (n, ) + self.speech_shape).astype(np.float32)
+        }
+        if not batched:
+            action = {key : value[0] for key, value in action.items()}
+        return action, None
+
+def latency_stats(latencies_ns : list[int]) -> dict:
+    latencies_us = np.asarray(latencies_ns) / 1000
+    return {
+        "calls" : len(latencies_us),
+        "calls_per_sec" : len(latencies_us) / (latencies_us.sum() / 1e6),
+        "mean_us" : float(latencies_us.mean()),
+        "p50_us" : float(np.percentile(latencies_us, 50)),
+        "p90_us" : float(np.percentile(latencies_us, 90)),
+        "p99_us" : float(np.percentile(latencies_us, 99)),
+    }
+
+def time_calls(fn, n_calls : int, warmup : int = 10, setup = None) -> dict:
+    """setup, if given, runs untimed before every call"""
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+    latencies = []
+    for _ in range(n_calls):
+        if setup is not None:
+            setup()
+        start = time.perf_counter_ns()
+        fn()
+        latencies.append(time.perf_counter_ns() - start)
+    return latency_stats(latencies)
+
+def make_env(config : dict, seed : int = 0, render_mode = None):
+    game_env = GameEnv(**config, seed=seed, render_mode=render_mode)
+    env = CustomEnv(game_env)
+    model = RandomModel(game_env.n_agents, seed=seed)
+    game_env.init_instances(model)
+    return game_env, env, model
+
+def bench_config(config : dict, n_steps : int, seed : int = 0, draw : bool = True) -> dict:
+    game_env, env, model = make_env(config, seed, render_mode = "rgb_array" if draw else None)
+    obs = game_env.reset()
+
+    def step():
+        nonlocal obs
+        action, _ = model.predict(obs)
+        obs, _, terminated, truncated = game_env.step(action)
+        if terminated or truncated:
+            obs = game_env.reset()
+
+    # an opponent's observation was last built before the step's actions, so this times the
+    # update after one step of changes (the learner's is already up to date after step())
+    opponent = next(agent for agent in game_env.agents if agent.id != game_env.learning_agent_id)
+    results = {
+        "GameEnv.reset" : time_calls(game_env.reset, max(n_steps // 10, 10)),
+        "GameEnv.step" : time_calls(step, n_steps),
+        "Agent.process_obs" : time_calls(lambda: opponent.process_obs(game_env.env_info), n_steps, setup=step),
+    }
+
+    learning_agent = game_env.learning_agent
+    actions = [model.predict(obs)[0] for _ in range(n_steps + 10)]
+    actions_iter = iter(actions)
+    results["Agent.step"] = time_calls(lambda: learning_agent.step(next(actions_iter), game_env.env_info), n_steps)
+
+    if draw:
+        game_env.render() # sets up the surface, fonts and caches outside of the timing
+        results["GameEnv.draw"] = time_calls(game_env.draw, max(n_steps // 10, 10))
+
+    env.close()
+    return results
+
+# Runs in a fresh interpreter, the way a new worker or evaluation process starts
+COLD_START_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+from env import CustomEnv
+from game_env import GameEnv
+from benchmark import RandomModel
+imported = time.perf_counter()
+config = json.loads(sys.argv[1])
+game_env = GameEnv(**config)
+env = CustomEnv(game_env)
+game_env.init_instances(RandomModel(game_env.n_agents))
+created = time.perf_counter()
+env.reset()
+done = time.perf_counter()
+print(json.dumps({"import_s" : imported - start, "create_s" : created - imported, "reset_s" : done - created}))
+"""
+
+def bench_cold_start(config : dict, n_runs : int) -> dict:
+    """Seconds from launching a new process to a reset env, median over n_runs processes"""
+    runs = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, "-c", COLD_START_SCRIPT, json.dumps(config)], text=True,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        total = time.perf_counter() - start
+        runs.append(dict(json.loads(output.splitlines()[-1]), total_s = total))
+    return {key : float(np.median([run[key] for run in runs])) for key in runs[0]}
+
+def print_cold_start(stats : dict, budget : float = None):
+    print("cold start (new process to a reset env)")
+    print("  " + "  ".join(f"{key[:-2]} {value * 1000:.1f}ms" for key, value in stats.items()))
+    if budget is not None:
+        verdict = "within" if stats["total_s"] <= budget else "OVER"
+        print(f"  {verdict} the {budget * 1000:.0f}ms budget")
+
+def sweep_configs(args) -> list[dict]:
+    configs = []
+    for grid_size, n_agents, n_pieces, listen_history_size in itertools.product(
+            args.grid_sizes, args.n_agents, args.n_pieces or [None], args.listen_history_sizes):
+        n_pieces = n_agents if n_pieces is None else n_pieces
+        if n_agents > n_pieces or n_agents + n_pieces > grid_size ** 2:
+            continue
+        configs.append(dict(max_steps = args.max_steps,
+                            n_colors = args.n_colors,
+                            n_agents = n_agents,
+                            n_pieces = n_pieces,
+                            n_letters = args.n_letters,
+                            grid_size = grid_size,
+                            listen_history_size = listen_history_size))
+    return configs
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args) -> dict:
+    report = {
+        "commit" : get_commit(),
+        "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "machine" : platform.machine(),
+        "n_steps" : args.n_steps,
+        "seed" : args.seed,
+        "results" : []
+    }
+    if args.cold_start_runs > 0:
+        report["cold_start"] = bench_cold_start(sweep_configs(args)[0], args.cold_start_runs)
+        print_cold_start(report["cold_start"], args.cold_start_budget)
+    if args.cold_start_only:
+        return report
+
+    for config in sweep_configs(args):
+        results = bench_config(config, args.n_steps, args.seed, draw = not args.no_draw)
+        report["results"].append({"config" : config, "benchmarks" : results})
+        print_results(config, results)
+    return report
+
+def config_key(config : dict) -> str:
+    return "grid={grid_size} agents={n_agents} pieces={n_pieces} history={listen_history_size}".format(**config)
+
+def print_results(config : dict, results : dict):
+    print(config_key(config))
+    for name, stats in results.items():
+        print(f"  {name:<20} {stats['calls_per_sec']:>12.1f}/s  p50 {stats['p50_us']:>9.1f}us"
+              f"  p90 {stats['p90_us']:>9.1f}us  p99 {stats['p99_us']:>9.1f}us")
+
+def compare(old_path : str, new_path : str):
+    with open(old_path) as f:
+        old_report = json.load(f)
+    with open(new_path) as f:
+        new_report = json.load(f)
+    old = {config_key(r["config"]) : r["benchmarks"] for r in old_report["results"]}
+    new = {config_key(r["config"]) : r["benchmarks"] for r in new_report["results"]}
+
+    if "cold_start" in old_report and "cold_start" in new_report:
+        print("cold start")
+        for name, seconds in new_report["cold_start"].items():
+            old_seconds = old_report["cold_start"].get(name)
+            if old_seconds:
+                print(f"  {name:<20} {old_seconds * 1000:>9.1f}ms -> {seconds * 1000:>9.1f}ms  ({old_seconds / seconds:.2f}x)")
+
+    for key in new:
+        if key not in old:
+            continue
+        print(key)
+        for name, stats in new[key].items():
+            if name in old[key]:
+                ratio = old[key][name]["p50_us"] / stats["p50_us"]
+                print(f"  {name:<20} p50 {old[key][name]['p50_us']:>9.1f}us -> {stats['p50_us']:>9.1f}us  ({ratio:.2f}x)")
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid-sizes", type=int, nargs="+", default=[12, 24])
+    parser.add_argument("--n-agents", type=int, nargs="+", default=[9, 36])
+    parser.add_argument("--n-pieces", type=int, nargs="+", default=None, help="defaults to n_agents")
+    parser.add_argument("--listen-history-sizes", type=int, nargs="+", default=[5])
+    parser.add_argument("--n-colors", type=int, default=3)
+    parser.add_argument("--n-letters", type=int, default=2)
+    parser.add_argument("--max-steps", type=int, default=256)
+    parser.add_argument("--n-steps", type=int, default=1000, help="timed calls per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-draw", action="store_true", help="skip the GameEnv.draw benchmark")
+    parser.add_argument("--cold-start-runs", type=int, default=5, help="fresh processes timed for the cold start, 0 skips it")
+    parser.add_argument("--cold-start-budget", type=float, default=None, help="seconds, exit with status 1 when over it")
+    parser.add_argument("--cold-start-only", action="store_true", help="only measure the cold start")
+    parser.add_argument("--output", default=None, help="write results as JSON to this path")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.cold_start_budget is not None and report.get("cold_start", {}).get("total_s", 0) > args.cold_start_budget:
+        sys.exit(1)
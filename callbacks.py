@@ -0,0 +1,12 @@
+from stable_baselines3.common.callbacks import BaseCallback
+
+class EnvStatsCallback(BaseCallback):
+    """Logs the episode_stats that GameEnv puts in info at the end of every episode"""
+
+    def _on_step(self) -> bool:
+        for info in self.locals["infos"]:
+            episode_stats = info.get("episode_stats")
+            if episode_stats is not None:
+                for key, value in episode_stats.items():
+                    self.logger.record_mean("env/" + key, value)
+        return True
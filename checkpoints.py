@@ -0,0 +1,131 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+def _cpu_copy(value):
+    # detached CPU copies of every tensor in a (nested) state dict
+    import torch
+
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key : _cpu_copy(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_cpu_copy(item) for item in value)
+    return value
+
+class Checkpoint:
+    """In-memory copy of everything model.save() would write, taken at one point of training"""
+
+    def __init__(self, step : int, data : dict, params : dict, pytorch_variables : dict):
+        self.step = step
+        self.data = data
+        self.params = params
+        self.pytorch_variables = pytorch_variables
+
+    @property
+    def policy_weights(self):
+        # same layout as opponents.get_policy_weights, sharing memory with the snapshot
+        return {key : value.numpy() for key, value in self.params["policy"].items()}
+
+    @classmethod
+    def from_model(cls, model, step : int):
+        """Mirrors BaseAlgorithm.save, minus the writing"""
+        from stable_baselines3.common.save_util import data_to_json, recursive_getattr
+
+        data = model.__dict__.copy()
+        exclude = set(model._excluded_save_params())
+        state_dicts_names, torch_variable_names = model._get_torch_save_params()
+        for torch_var in state_dicts_names + torch_variable_names:
+            exclude.add(torch_var.split(".")[0])
+        for param_name in exclude:
+            data.pop(param_name, None)
+
+        # serialized right away, training keeps mutating the objects in data.
+        # save_to_zip_file stores the already serialized entries unchanged.
+        data = json.loads(data_to_json(data))
+        pytorch_variables = {name : _cpu_copy(recursive_getattr(model, name)) for name in torch_variable_names}
+        return cls(step, data, _cpu_copy(model.get_parameters()), pytorch_variables)
+
+    def write(self, path : str) -> None:
+        from stable_baselines3.common.save_util import save_to_zip_file
+
+        # written next to the destination and renamed over it, a crash never leaves a partial checkpoint
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            save_to_zip_file(f, data=self.data, params=self.params, pytorch_variables=self.pytorch_variables)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+class CheckpointManager:
+    """Saves checkpoints as <save_dir>/<prefix>_<step>.zip on a background thread.
+
+    save() only takes the in-memory snapshot, serialization and disk writes overlap with
+    training. Keeps the last `keep_last` checkpoints plus every step that is a multiple
+    of `keep_every`. Checkpoints load with the usual Model.load(path).
+    """
+
+    def __init__(self, save_dir : str, prefix : str = "model", keep_last : int = 3, keep_every : int = None):
+        assert keep_last > 0
+        self.save_dir = save_dir
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.pattern = re.compile(re.escape(prefix) + r"_(\d+)\.zip")
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending = None
+
+        os.makedirs(save_dir, exist_ok=True)
+
+    def path(self, step : int) -> str:
+        return os.path.join(self.save_dir, f"{self.prefix}_{step}.zip")
+
+    def steps(self) -> list[int]:
+        matches = (self.pattern.fullmatch(name) for name in os.listdir(self.save_dir))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def latest_step(self) -> int:
+        steps = self.steps()
+        return steps[-1] if steps else None
+
+    def latest_path(self) -> str:
+        step = self.latest_step()
+        return None if step is None else self.path(step)
+
+    def save(self, model, step : int) -> Checkpoint:
+        checkpoint = Checkpoint.from_model(model, step)
+        # one write in flight at most, so snapshots can't pile up in memory if the disk is slow
+        self.wait()
+        self.pending = self.executor.submit(self._write, checkpoint)
+        return checkpoint
+
+    def wait(self) -> None:
+        # also re-raises errors from the background write
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self) -> None:
+        self.wait()
+        self.executor.shutdown()
+
+    def _write(self, checkpoint : Checkpoint) -> None:
+        checkpoint.write(self.path(checkpoint.step))
+        self._rotate()
+
+    def kept(self, steps : list[int]) -> set[int]:
+        """The steps rotation keeps out of `steps`"""
+        steps = sorted(steps)
+        keep = set(steps[-self.keep_last:])
+        if self.keep_every:
+            keep.update(step for step in steps if step % self.keep_every == 0)
+        return keep
+
+    def _rotate(self) -> None:
+        steps = self.steps()
+        keep = self.kept(steps)
+        for step in steps:
+            if step not in keep:
+                os.remove(self.path(step))
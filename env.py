@@ -2,57 +2,104 @@ import gymnasium
 from gymnasium import spaces
 
 import numpy as np
-from typing import Union
-from utils import AgentAction
+from typing import TYPE_CHECKING, Union
+from utils import AgentAction, ObsLayout, get_obs_layout
 from game_env import GameEnv
+from speech import SPEECH_SIZE
 
-from stable_baselines3.common.type_aliases import GymResetReturn, GymStepReturn
+if TYPE_CHECKING:
+    # importing stable_baselines3 pulls in torch, far too slow for every worker process
+    from stable_baselines3.common.type_aliases import GymResetReturn, GymStepReturn
+
+def make_speech_space(env : GameEnv) -> spaces.Space:
+    """An utterance, as said and as heard.
+
+    Tokens stay integers in the env and in rollouts, SB3 one-hot encodes MultiDiscrete
+    observations when it feeds them to the policy. The space is int64 although the env keeps
+    tokens in speech_dtype: SB3 sums nvec in the space's dtype to size the policy input, which
+    overflows a uint8
+    """
+    if env.speech_mode == "tokens":
+        return spaces.MultiDiscrete(np.full(env.speech_length, env.speech_vocab_size + 1), dtype=np.int64)
+    return spaces.Box(low=-1, high=1, shape=(1, SPEECH_SIZE), dtype=np.float32)
+
+def make_action_space(env : GameEnv) -> spaces.Dict:
+    #TODO: make agent see which piece he has and make drop action
+
+    # Which action | dx | dy | target agent | Speech
+    return spaces.Dict({
+        "action" : spaces.Discrete(8),
+        "dx" : spaces.Discrete(3),
+        "dy" : spaces.Discrete(3),
+        "agent" : spaces.Discrete(env.n_agents),
+        "speech" : make_speech_space(env)
+    })
+
+def make_observation_entries(env : GameEnv) -> dict[str, spaces.Space]:
+    # in the order of the flat layout, gymnasium's Dict sorts its keys
+    obs_dict = {
+        "eyes" : spaces.Box(low=0, high=1, shape=(env.vision_grid_size, env.vision_grid_size, 6), dtype=np.float32),
+        "offer" : spaces.Box(low=0, high=1, shape=(1, 4), dtype=np.float32),
+        "desired_piece" : spaces.Box(low=0, high=1, shape=(1, 2), dtype=np.float32)
+    }
+    for i in range(env.listen_history_size):
+        obs_dict["speech " + str(i + 1)] = make_speech_space(env)
+
+    return obs_dict
+
+def make_obs_layout(env : GameEnv) -> ObsLayout:
+    return get_obs_layout({key : space.shape for key, space in make_observation_entries(env).items()})
+
+def make_observation_space(env : GameEnv) -> spaces.Space:
+    """The Dict space, or with flat_obs one Box laid out as env.obs_layout (see utils.unflatten_obs)"""
+    obs_dict = make_observation_entries(env)
+    if not env.flat_obs:
+        return spaces.Dict(obs_dict)
+
+    low = np.concatenate([space.low.ravel() for space in obs_dict.values()])
+    high = np.concatenate([space.high.ravel() for space in obs_dict.values()])
+    return spaces.Box(low=low, high=high, dtype=np.float32)
 
 class CustomEnv(gymnasium.Env):
     """Custom Environment that follows gym interface"""
-    metadata = {'render.modes': ['human']}
+    metadata = {'render_modes': ['human', 'rgb_array'], 'render_fps': 60}
 
     def __init__(self, env : GameEnv):
         super(CustomEnv, self).__init__()
 
-        Speech = spaces.Box(low=-1, high=1, shape=(1, 120), dtype=np.float32)
-
-        #TODO: make agent see which piece he has and make drop action
-
-        # Which action | dx | dy | target agent | Speech
-        self.action_space = spaces.Dict({
-            "action" : spaces.Discrete(8),
-            "dx" : spaces.Discrete(3),
-            "dy" : spaces.Discrete(3),
-            "agent" : spaces.Discrete(env.n_agents),
-            "speech" : Speech
-        })
-
-        obs_dict = {
-            "eyes" : spaces.Box(low=0, high=1, shape=(5, 5, 6), dtype=np.float32),
-            "offer" : spaces.Box(low=0, high=1, shape=(1, 4), dtype=np.float32),
-            "desired_piece" : spaces.Box(low=0, high=1, shape=(1, 2), dtype=np.float32)
-        }
-        for i in range(5):
-            obs_dict["speech " + str(i + 1)] = Speech
-        
-        self.observation_space = spaces.Dict(obs_dict)
+        self.action_space = make_action_space(env)
+        self.observation_space = make_observation_space(env)
         
         self.env = env
+        self.render_mode = env.render_mode
+        self.obs_layout = env.obs_layout
 
     def step(
             self, action: AgentAction
-        ) -> GymStepReturn:
+        ) -> "GymStepReturn":
         
         obs, reward, terminated, truncated = self.env.step(action)
 
-        return obs, reward, terminated, truncated, {}
+        return obs, reward, terminated, truncated, self.env.info
 
     def reset(
             self, seed: int = None, options: dict = None
-        ) -> GymResetReturn:
-        obs = self.env.reset()
+        ) -> "GymResetReturn":
+        super().reset(seed=seed)
+        obs = self.env.reset(seed=seed)
         return (obs, {})
 
-    def render(self, mode='human'):
-        ...
+    def get_state(self) -> dict:
+        return self.env.get_state()
+
+    def set_state(self, state : dict):
+        return self.env.set_state(state)
+
+    def push_opponent_snapshot(self, weights, snapshot_id = None):
+        self.env.push_opponent_snapshot(weights, snapshot_id)
+
+    def render(self):
+        return self.env.render()
+
+    def close(self):
+        self.env.close()
@@ -0,0 +1,328 @@
+"""Tournaments between checkpoints.
+
+A game seats two checkpoints at one GameEnv, about half of the agents each, and every agent
+plays its checkpoint's policy. Games are spread over a process pool in tasks of one pairing,
+played in lockstep so a step costs one forward pass per checkpoint however many games the task
+holds. Game pairs share a seed with the seats swapped, and pair m always gets seed `seed + m`,
+so results don't depend on the number of workers. Sampled actions (--stochastic) are drawn per
+task from generators seeded with its first game's seed, those also depend on games_per_task.
+
+Evaluator.submit() runs a tournament in the background, main.py keeps training meanwhile.
+
+    python evaluate.py saves/coolmodel_*.zip --games-per-pair 64
+"""
+import os
+import re
+import time
+import argparse
+import itertools
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from agent import stat_events
+from instrumentation import EnvStats
+from numpy_policy import NumpyPolicy, NumpyPolicyFactory
+from opponents import WEIGHT_DTYPES, OpponentPool, OpponentSlots, compress_weights, get_policy_weights, same_weights
+from utils import stack_obs, unstack_action
+
+SCHEDULES = ["round_robin", "sampled"]
+COUNTED = ["pieces_found", "trades", "offers"]
+
+def load_checkpoint_weights(path : str) -> dict[str, np.ndarray]:
+    """Policy weights of a checkpoint written by model.save() or CheckpointManager, without loading the model"""
+    from stable_baselines3.common.save_util import load_from_zip_file
+
+    _, params, _ = load_from_zip_file(path, load_data=False, device="cpu")
+    return {key : value.numpy() for key, value in params["policy"].items()}
+
+def schedule_games(ids : list[int], schedule : str = "round_robin", games_per_pair : int = 32,
+                   n_games : int = 1000, seed : int = 0) -> list[tuple]:
+    """(a, b, seed, mirrored) for every game, grouped by pairing.
+
+    round_robin plays games_per_pair games between every two checkpoints, sampled n_games
+    between uniformly drawn pairs. Both are rounded up to whole mirrored pairs.
+    """
+    assert schedule in SCHEDULES
+    assert len(ids) > 1, "a tournament needs two checkpoints"
+    pairs = list(itertools.combinations(ids, 2))
+    if schedule == "round_robin":
+        pairings = [pair for pair in pairs for _ in range(-(-games_per_pair // 2))]
+    else:
+        rng = np.random.default_rng(seed)
+        pairings = sorted(pairs[i] for i in rng.integers(len(pairs), size=-(-n_games // 2)))
+    return [(a, b, seed + m, mirrored) for m, (a, b) in enumerate(pairings) for mirrored in (False, True)]
+
+def seat_sides(n_agents : int, seed : int, mirrored : bool) -> np.ndarray:
+    # 0 for a's seats and 1 for b's, a gets the odd seat and the mirrored game swaps them
+    sides = np.zeros(n_agents, dtype=np.int64)
+    sides[np.random.default_rng(seed).permutation(n_agents)[(n_agents + 1) // 2:]] = 1
+    return 1 - sides if mirrored else sides
+
+class TournamentWorker:
+    """Plays tasks in a pool process: keeps the envs and the loaded policies between tasks"""
+
+    def __init__(self, game_config : dict, policy_factory, deterministic : bool = True, cache_size : int = 4096):
+        from game_env import GameEnv
+        from parallel_env import ParallelGameEnv
+
+        self.make_env = lambda : ParallelGameEnv(GameEnv(**game_config))
+        self.envs = [self.make_env()]
+        env = self.envs[0]
+        template = policy_factory(env.observation_space(None), env.action_space(None))
+        # NumPy exports sample from their own generator, torch policies from torch's
+        self.torch = not isinstance(template, NumpyPolicy)
+        if self.torch:
+            import torch
+            torch.set_num_threads(1) # one process per core already
+        self.slots = OpponentSlots(template)
+        self.pool = OpponentPool(4)
+        self.deterministic = deterministic
+        self.cache = None
+        if deterministic and cache_size > 0:
+            from action_cache import ActionCache
+            self.cache = ActionCache(cache_size)
+
+    def play(self, a : int, b : int, weights : dict, games : list[tuple]) -> list[dict]:
+        # every task brings its own copy of the weights, the pool only takes them when they changed
+        # so policies already loaded with one of the ids are reused as they are
+        for snapshot_id in (a, b):
+            if snapshot_id not in self.pool or not same_weights(self.pool.get(snapshot_id), weights[snapshot_id]):
+                self.pool.add(weights[snapshot_id], snapshot_id)
+        models = self.slots.load([a, b], self.pool)
+        while len(self.envs) < len(games):
+            self.envs.append(self.make_env())
+        if self.torch:
+            import torch
+            torch.manual_seed(games[0][2])
+        else:
+            for side, snapshot_id in enumerate((a, b)):
+                models[snapshot_id].seed((games[0][2], side))
+
+        envs = self.envs[:len(games)]
+        sides, observations = [], []
+        for env, (_, _, seed, mirrored) in zip(envs, games):
+            observations.append(env.reset(seed)[0])
+            for agent in env.env.agents:
+                agent.stats = EnvStats(stat_events) # counted per seat
+            sides.append(seat_sides(env.env.n_agents, seed, mirrored))
+        rewards = np.zeros((len(games), envs[0].env.n_agents))
+        active = list(range(len(games)))
+        while active:
+            actions = {i : {} for i in active}
+            for side, snapshot_id in enumerate((a, b)):
+                seats = [(i, name) for i in active for j, name in enumerate(envs[i].possible_agents) if sides[i][j] == side]
+                obs = stack_obs([observations[i][name] for i, name in seats])
+                batch_actions = self._predict(models[snapshot_id], snapshot_id, obs)
+                for k, (i, name) in enumerate(seats):
+                    actions[i][name] = unstack_action(batch_actions, k)
+
+            for i in active:
+                observations[i], step_rewards, _, _, _ = envs[i].step(actions[i])
+                rewards[i] += [step_rewards[name] for name in envs[i].possible_agents]
+            active = [i for i in active if envs[i].agents]
+
+        return [self._result(game, env.env, game_sides, game_rewards)
+                for game, env, game_sides, game_rewards in zip(games, envs, sides, rewards)]
+
+    def _predict(self, model, snapshot_id : int, obs):
+        if self.cache is None:
+            return model.predict(obs, deterministic=self.deterministic)[0]
+        from action_cache import select_rows
+        n = len(obs) if isinstance(obs, np.ndarray) else len(next(iter(obs.values())))
+        return self.cache.get(obs, [snapshot_id] * n, lambda rows : model.predict(select_rows(obs, rows), deterministic=True)[0])
+
+    def _result(self, game : tuple, game_env, sides : np.ndarray, rewards : np.ndarray) -> dict:
+        a, b, seed, mirrored = game
+        result = {"a" : a, "b" : b, "seed" : seed, "mirrored" : mirrored, "length" : game_env.step_,
+                  "solved" : game_env.solved, "seats" : np.bincount(sides, minlength=2).tolist(),
+                  "reward" : np.bincount(sides, rewards, minlength=2).tolist()}
+        for event in COUNTED:
+            counts = [agent.stats.episode_counters[event] for agent in game_env.agents]
+            result[event] = np.bincount(sides, counts, minlength=2).tolist()
+        return result
+
+_worker : TournamentWorker = None
+
+def _init_worker(*args):
+    global _worker
+    _worker = TournamentWorker(*args)
+
+def _play(a : int, b : int, weights : dict, games : list[tuple]) -> list[dict]:
+    return _worker.play(a, b, weights, games)
+
+def game_score(game : dict) -> float:
+    """1 when a's seats earned more per seat than b's, 0 when less, 0.5 on a draw"""
+    a_reward, b_reward = (reward / seats for reward, seats in zip(game["reward"], game["seats"]))
+    return 0.5 if np.isclose(a_reward, b_reward) else float(a_reward > b_reward)
+
+def bradley_terry(games : list[dict], ids : list[int], prior : float = 1.0, n_iter : int = 1000) -> dict[int, float]:
+    """Elo-scale ratings (mean 1000) of the Bradley-Terry model fitted to the game scores.
+
+    Minorization-maximization fit, with `prior` virtual draws between every two checkpoints
+    that played so an unbeaten one still gets a finite rating.
+    """
+    index = {snapshot_id : i for i, snapshot_id in enumerate(ids)}
+    wins = np.zeros((len(ids), len(ids)))
+    for game in games:
+        i, j = index[game["a"]], index[game["b"]]
+        score = game_score(game)
+        wins[i, j] += score
+        wins[j, i] += 1 - score
+    played = (wins + wins.T) > 0
+    wins += prior / 2 * played
+    n_games = wins + wins.T
+
+    strength = np.ones(len(ids))
+    for _ in range(n_iter):
+        denominator = (n_games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = wins.sum(axis=1) / np.maximum(denominator, 1e-12)
+        updated = np.maximum(updated, 1e-12)
+        updated /= np.exp(np.log(updated).mean())
+        converged = np.allclose(updated, strength, rtol=1e-9)
+        strength = updated
+        if converged:
+            break
+    return {snapshot_id : 1000 + 400 * np.log10(strength[index[snapshot_id]]) for snapshot_id in ids}
+
+def summarize(games : list[dict], ids : list[int]) -> dict[int, dict]:
+    """Per checkpoint: games, wins, draws, losses, score and per-seat reward and events"""
+    totals = {snapshot_id : dict.fromkeys(["games", "wins", "draws", "losses", "seats", "reward", "length", "solved"]
+                                          + COUNTED, 0.0) for snapshot_id in ids}
+    for game in games:
+        score = game_score(game)
+        for side, (snapshot_id, side_score) in enumerate(((game["a"], score), (game["b"], 1 - score))):
+            total = totals[snapshot_id]
+            total["games"] += 1
+            total["wins" if side_score == 1 else "losses" if side_score == 0 else "draws"] += 1
+            total["seats"] += game["seats"][side]
+            total["length"] += game["length"]
+            total["solved"] += game["solved"]
+            for key in ["reward"] + COUNTED:
+                total[key] += game[key][side]
+
+    stats = {}
+    for snapshot_id, total in totals.items():
+        n, seats = max(total["games"], 1), max(total["seats"], 1)
+        stats[snapshot_id] = {
+            "games" : int(total["games"]), "wins" : int(total["wins"]), "draws" : int(total["draws"]),
+            "losses" : int(total["losses"]), "score" : (total["wins"] + total["draws"] / 2) / n,
+            "reward_per_seat" : total["reward"] / seats,
+            "pieces_found_per_seat" : total["pieces_found"] / seats,
+            "trades_per_seat" : total["trades"] / seats,
+            "offers_per_seat" : total["offers"] / seats,
+            "episode_length" : total["length"] / n,
+            "solved" : total["solved"] / n,
+        }
+    return stats
+
+class Evaluator:
+    """Plays tournaments on a pool of n_workers processes, kept alive between tournaments.
+
+    checkpoints map an id (the training step) to a checkpoint path or to policy weights. Workers
+    keep what they loaded under its id and reload it if the id comes with other weights. Paths are
+    read once, a path has to stand for the same checkpoint for the Evaluator's lifetime.
+    deterministic opponents play their most likely action and share an ActionCache of cache_size rows.
+    Weights are sent to the workers as compress_weights(weights, weight_dtype).
+    """
+
+    def __init__(self, game_config : dict, policy_factory, n_workers : int = None, deterministic : bool = True,
+                 games_per_task : int = 16, cache_size : int = 4096, start_method : str = None,
+                 weight_dtype : str = "float32"):
+        if start_method is None:
+            # as for the inference server, forked workers would inherit the learner's torch threads
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self.games_per_task = games_per_task
+        self.weight_dtype = weight_dtype
+        self.executor = ProcessPoolExecutor(n_workers or os.cpu_count() or 1, mp.get_context(start_method),
+                                            initializer=_init_worker,
+                                            initargs=(game_config, policy_factory, deterministic, cache_size))
+        self.background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="evaluate")
+        self.weights = {} # path -> weights, paths are read once
+
+    def run(self, checkpoints : dict, schedule : str = "round_robin", games_per_pair : int = 32,
+            n_games : int = 1000, seed : int = 0) -> dict:
+        """Plays a tournament, returns {"games", "stats", "ratings", "seconds"}"""
+        start = time.perf_counter()
+        ids = sorted(checkpoints)
+        weights = {snapshot_id : self._weights(value) for snapshot_id, value in checkpoints.items()}
+        self.weights = {path : self.weights[path] for path in checkpoints.values() if isinstance(path, str)}
+
+        games = schedule_games(ids, schedule, games_per_pair, n_games, seed)
+        tasks = []
+        for (a, b), pairing in itertools.groupby(games, key=lambda game : game[:2]):
+            pairing = list(pairing)
+            for i in range(0, len(pairing), self.games_per_task):
+                tasks.append(self.executor.submit(_play, a, b, {a : weights[a], b : weights[b]},
+                                                  pairing[i : i + self.games_per_task]))
+        results = [result for task in tasks for result in task.result()]
+        return {
+            "games" : results,
+            "stats" : summarize(results, ids),
+            "ratings" : bradley_terry(results, ids),
+            "seconds" : time.perf_counter() - start,
+        }
+
+    def submit(self, checkpoints : dict, **kwargs) -> Future:
+        """run() in the background, the caller checks on the future between training iterations"""
+        return self.background.submit(self.run, checkpoints, **kwargs)
+
+    def _weights(self, checkpoint) -> dict[str, np.ndarray]:
+        if isinstance(checkpoint, str):
+            if checkpoint not in self.weights:
+                self.weights[checkpoint] = compress_weights(load_checkpoint_weights(checkpoint), self.weight_dtype)
+            return self.weights[checkpoint]
+        if not isinstance(checkpoint, dict):
+            checkpoint = get_policy_weights(getattr(checkpoint, "policy", checkpoint))
+        return compress_weights(checkpoint, self.weight_dtype)
+
+    def close(self):
+        self.background.shutdown()
+        self.executor.shutdown()
+
+def print_tournament(result : dict):
+    print(f"{len(result['games'])} games in {result['seconds']:.1f}s")
+    print(f"{'checkpoint':>12} {'rating':>7} {'score':>6} {'W-D-L':>13} {'reward':>8} {'found':>6} {'trades':>7} {'length':>7}")
+    for snapshot_id, rating in sorted(result["ratings"].items(), key=lambda item : -item[1]):
+        stats = result["stats"][snapshot_id]
+        record = f"{stats['wins']}-{stats['draws']}-{stats['losses']}"
+        print(f"{snapshot_id:>12} {rating:>7.0f} {stats['score']:>6.3f} {record:>13} {stats['reward_per_seat']:>8.2f} "
+              f"{stats['pieces_found_per_seat']:>6.3f} {stats['trades_per_seat']:>7.3f} {stats['episode_length']:>7.1f}")
+
+def checkpoint_id(path : str, default : int) -> int:
+    # the step in <prefix>_<step>.zip
+    match = re.search(r"_(\d+)\.zip$", path)
+    return int(match.group(1)) if match else default
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Tournament between saved checkpoints")
+    parser.add_argument("checkpoints", nargs="+", help="checkpoint .zip files")
+    parser.add_argument("--schedule", choices=SCHEDULES, default="round_robin")
+    parser.add_argument("--games-per-pair", type=int, default=32, help="round robin games between every two checkpoints")
+    parser.add_argument("--n-games", type=int, default=1000, help="games of the sampled schedule")
+    parser.add_argument("--workers", type=int, default=None, help="defaults to the number of cores")
+    parser.add_argument("--games-per-task", type=int, default=16, help="games a worker plays in lockstep")
+    parser.add_argument("--stochastic", action="store_true", help="sample actions instead of taking the most likely one")
+    parser.add_argument("--torch", action="store_true", help="play the torch policies instead of their NumPy exports")
+    parser.add_argument("--weight-dtype", choices=WEIGHT_DTYPES, default="float32", help="weights as sent to the workers")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    from sb3_plus import MultiOutputPPO
+    from main import game_config
+    from vec_env import OpponentPolicyFactory
+    from env import CustomEnv
+    from game_env import GameEnv
+
+    args = parse_args()
+    checkpoints = {checkpoint_id(path, i) : path for i, path in enumerate(args.checkpoints)}
+    policy_factory = OpponentPolicyFactory(MultiOutputPPO.policy_aliases["MIMOPolicy"])
+    if not args.torch:
+        policy_factory = NumpyPolicyFactory(policy_factory)
+        env = CustomEnv(GameEnv(**game_config))
+        policy_factory.export(env.observation_space, env.action_space)
+    evaluator = Evaluator(game_config, policy_factory, n_workers=args.workers, deterministic=not args.stochastic,
+                          games_per_task=args.games_per_task, weight_dtype=args.weight_dtype)
+    print_tournament(evaluator.run(checkpoints, args.schedule, args.games_per_pair, args.n_games, args.seed))
+    evaluator.close()
@@ -1,7 +1,15 @@
-import pygame
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
 import random as rnd
-from agent import Agent, Piece
-from utils import AgentAction, AgentObs, get_color, get_action_id, get_action_queue
+from agent import Agent, Piece, stat_events
+from instrumentation import EnvStats, Timer
+from world import World, disk_mask
+from opponents import OpponentPool, OpponentSlots
+from recorder import EpisodeRecorder
+from speech import SPEECH_MODES, speech_format
+from utils import (AgentAction, AgentObs,
+    copy_obs, get_color, get_action_id, get_action_queue, stack_obs, unstack_action)
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -11,12 +19,16 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 BLUE = (0, 255, 0)
 
+FONT_PATH = 'C:\\Windows\\Fonts\\micross.ttf'
+RENDER_MODES = [None, "rgb_array", "human"]
+OPPONENT_SAMPLING = ["latest", "uniform"]
+
 # -----
 
-def generate_piece_color(agent_color, n_colors):
-    piece_color = rnd.randint(0, n_colors - 1)
+def generate_piece_color(agent_color, n_colors, rng = rnd):
+    piece_color = rng.randint(0, n_colors - 1)
     if piece_color == (agent_color - 1):
-        piece_color = (piece_color + rnd.randint(1, n_colors - 1)) % n_colors
+        piece_color = (piece_color + rng.randint(1, n_colors - 1)) % n_colors
     return piece_color + 1
 
 class GameEnv:
@@ -29,7 +41,26 @@ class GameEnv:
                  grid_size,
                  cell_size = 24,
                  listen_history_size = 5,
-                 fps = 60):
+                 vision_grid_size = 5,
+                 hearing_radius = 5,
+                 fps = 60,
+                 render_mode = None,
+                 seed = None,
+                 opponent_pool_size = 8,
+                 opponent_sampling = "latest",
+                 pipeline_opponents = False,
+                 auto_reset = False,
+                 flat_obs = False,
+                 speech_mode = "continuous",
+                 speech_vocab_size = 16,
+                 speech_length = 8,
+                 opponent_deterministic = False,
+                 opponent_action_cache = 0):
+        assert render_mode in RENDER_MODES
+        assert opponent_sampling in OPPONENT_SAMPLING
+        assert speech_mode in SPEECH_MODES
+        assert not (flat_obs and speech_mode == "tokens"), "flat observations are float32, token speech needs the dict ones"
+
         self.step_ = 0
         self.max_steps = max_steps
         self.fps = fps
@@ -38,33 +69,76 @@ class GameEnv:
         self.n_pieces = n_pieces
         self.n_colors = n_colors
         self.listen_history_size = listen_history_size
+        self.vision_grid_size = vision_grid_size
+        self.hearing_radius = hearing_radius
+        # continuous speech is a (1, 120) float vector, token speech speech_length tokens out of
+        # 1..speech_vocab_size (0 is silence) stored as small ints, see speech.speech_format
+        self.speech_mode = speech_mode
+        self.speech_vocab_size = speech_vocab_size
+        self.speech_length = speech_length
+        self.speech_shape, self.speech_dtype = speech_format(speech_mode, speech_vocab_size, speech_length)
 
         self.grid_size = grid_size
         self.cell_size = cell_size
+        self.render_mode = render_mode
+        self.rng = rnd.Random(seed)
+
+        self.screen = None
+        self.background = None
+        self.glyph_cache = {}
 
         self.agents : list[Agent] = []
         self.pieces : list[Piece] = []
         self.learning_agent_id = -1
+        self.opponent_model = None
+        self.opponent_pool = OpponentPool(opponent_pool_size)
+        self.opponent_sampling = opponent_sampling
+        self.opponent_slots = None
+        self.opponent_snapshot_ids = {} # agent id -> snapshot the agent is playing with
+        self.batch_obs_buffers = {}
+        self.inference_client = None
+
+        # opponents play their policy's most likely action, or sample it (SB3's default)
+        self.opponent_deterministic = opponent_deterministic
+        # with opponent_action_cache > 0, an LRU of that many observations (see action_cache.py) skips the
+        # forward pass of opponents that saw the same thing before. Sampled opponents cache their action
+        # distribution and draw from opponent_action_rng
+        self.action_cache = None
+        self.opponent_action_rng = np.random.default_rng(seed)
+        self.policy_seed = seed # for opponent policies with their own generator (NumpyPolicy.seed)
+        if opponent_action_cache > 0:
+            from action_cache import ActionCache
+            self.action_cache = ActionCache(opponent_action_cache)
+
+        # pipelined mode: next step's opponent actions are computed in the background
+        # while the caller runs the learner's policy
+        self.pipeline_opponents = pipeline_opponents
+        self.inference_executor = None
+        self.pending_opponent_actions = None
+
+        # start the next episode right away when one ends, the last observation goes in info["final_observation"].
+        # Leave it off under SB3 VecEnvs, they reset on their own
+        self.auto_reset = auto_reset
+
+        # observations as one float32 array laid out as obs_layout instead of a dict (see env.make_observation_space)
+        self.flat_obs = flat_obs
+        self.obs_layout = None
 
         assert 0 < self.n_agents <= self.n_pieces
         assert self.n_colors > 1
         assert self.n_letters > 0
+        assert self.vision_grid_size % 2 == 1 and self.hearing_radius >= 0
 
         self.ep_reward = 0
+        self.stats = EnvStats(stat_events)
+        self.info = {}
+        self.recorder = None
 
         self._init()
 
     def _init(self):
-        pygame.init()
-        pygame.font.init()
-
         self.screen_width, self.screen_height = self.grid_size * self.cell_size, self.grid_size * self.cell_size
 
-        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
-        #self.clock = pygame.time.Clock()
-        self.font_normal = pygame.font.Font('C:\Windows\Fonts\micross.ttf', 18)
-        self.font_small = pygame.font.Font('C:\Windows\Fonts\micross.ttf', 14)
-
         print("GAME ENV INITIALIZED")
 
         Agent.max_agent_id = self.n_agents
@@ -72,109 +146,413 @@ class GameEnv:
         Agent.grid_size = self.grid_size
         Agent.n_colors = self.n_colors
         Agent.listen_history_size = self.listen_history_size
-        Agent.vision_grid_size = 5
+        Agent.vision_grid_size = self.vision_grid_size
+        Agent.hearing_radius = self.hearing_radius
+        Agent.vision_mask, _ = disk_mask(Agent.vision_dis())
+        if self.flat_obs:
+            from env import make_obs_layout
+            self.obs_layout = make_obs_layout(self)
+        Agent.obs_layout = self.obs_layout
+
+        self.world = World(self.n_agents, self.n_pieces, self.grid_size, self.rng,
+                           query_radius = Agent.vision_dis(), listen_history_size = self.listen_history_size,
+                           speech_shape = self.speech_shape, speech_dtype = self.speech_dtype)
+        self.all_pieces = [Piece(i, self.world) for i in range(self.n_pieces)]
+        self.world.piece_views = self.all_pieces
 
     def init_instances(self, model):
+        self._cancel_opponent_prefetch()
+        if self.action_cache is not None:
+            self.action_cache.clear() # rows without a snapshot id belonged to the previous model
         self.agents.clear()
-        self.learning_agent_id = rnd.randint(1, self.n_agents)
+        self.opponent_model = model
+        self.opponent_slots = None
+        self._seed_opponent_policies(self.policy_seed)
+        self.opponent_snapshot_ids.clear()
+        self.learning_agent_id = self.rng.randint(1, self.n_agents)
         for i in range(self.n_agents):
             if i + 1 == self.learning_agent_id:
-                self.agents.append(Agent(i + 1, 0, 0, None)) # Learning agent
+                self.agents.append(Agent(i + 1, self.world, None, self.stats)) # Learning agent
             else:
-                self.agents.append(Agent(i + 1, 0, 0, model))
+                self.agents.append(Agent(i + 1, self.world, model, self.stats))
 
         self.reset()
 
-    def reset(self):
+    def connect_inference_server(self, client):
+        """Run the opponents on an InferenceServer slot (see inference_server.py) instead of local policies.
+
+        Call before init_instances(client). The weights then only live in the server: snapshots are
+        pushed here with empty weights, the pool only keeps track of their ids.
+        """
+        assert self.action_cache is None or self.opponent_deterministic, \
+            "sampled opponents cache their action distribution, the server only returns actions"
+        self.inference_client = client
+
+    def add_opponent_snapshot(self, weights, snapshot_id = None) -> int:
+        if self.action_cache is not None and snapshot_id in self.opponent_pool:
+            self._cancel_opponent_prefetch()
+            self.action_cache.clear() # the id now stands for other weights
+        return self.opponent_pool.add(weights, snapshot_id)
+
+    def swap_opponents(self, snapshot_ids : list[int] = None):
+        """Hot-swap the opponents' weights and pick a new learning seat, without rebuilding agents.
+
+        snapshot_ids gives one pool snapshot per opponent seat; by default every seat gets the
+        latest snapshot, or a uniformly sampled one with opponent_sampling = "uniform".
+        """
+        # a running prefetch still uses the slot policies that are about to be overwritten
+        self._cancel_opponent_prefetch()
+        self.learning_agent_id = self.rng.randint(1, self.n_agents)
+        opponent_ids = [agent.id for agent in self.agents if agent.id != self.learning_agent_id]
+        if snapshot_ids is None:
+            if self.opponent_sampling == "uniform":
+                snapshot_ids = [self.opponent_pool.sample(self.rng) for _ in opponent_ids]
+            else:
+                snapshot_ids = [self.opponent_pool.latest_id for _ in opponent_ids]
+
+        if self.inference_client is not None:
+            models = dict.fromkeys(snapshot_ids, self.inference_client)
+            for snapshot_id in models:
+                self.opponent_pool.get(snapshot_id) # same recency order, and so sampling, as local policies
+        else:
+            if self.opponent_slots is None:
+                self.opponent_slots = OpponentSlots(self.opponent_model)
+            models = self.opponent_slots.load(snapshot_ids, self.opponent_pool)
+        self.learning_agent.model = None
+        self.opponent_snapshot_ids = dict(zip(opponent_ids, snapshot_ids))
+        for agent_id, snapshot_id in self.opponent_snapshot_ids.items():
+            self.agents[agent_id - 1].model = models[snapshot_id]
+
+        return self.reset()
+
+    def push_opponent_snapshot(self, weights, snapshot_id = None):
+        self.add_opponent_snapshot(weights, snapshot_id)
+        self.swap_opponents()
+
+    def reset(self, seed : int = None):
+        # the prefetched actions are stale, and a running prefetch would draw from the generators reseeded here
+        self._cancel_opponent_prefetch()
+        if seed is not None:
+            self.rng.seed(seed)
+            self.opponent_action_rng = np.random.default_rng(seed)
+            self._seed_opponent_policies(seed)
         self.step_ = 0
         self.ep_reward = 0
         self.collective_reward = 0
+        self.stats.end_episode() # drops whatever an unfinished episode counted
 
         #TODO: generalize this for color teams of different sizes
         agent_colors = [(i % self.n_colors) + 1 for i in range(self.n_agents)]
-        rnd.shuffle(agent_colors)
-
-        self.pieces.clear()
-        for i in range(self.n_pieces):
-            self.pieces.append(Piece.make_new_piece(self.pieces, rnd.randint(1, self.n_letters)))
+        self.rng.shuffle(agent_colors)
+
+        self.world.clear()
+        self.pieces[:] = self.all_pieces
+        for i, piece in enumerate(self.pieces):
+            x, y = self.world.random_free_cell(self.world.no_piece_cells)
+            self.world.place_piece(i, x, y)
+            piece.letter = self.rng.randint(1, self.n_letters)
             if i >= self.n_agents:
-                self.pieces[-1].color = rnd.randint(1, self.n_colors)
+                piece.color = self.rng.randint(1, self.n_colors)
 
         for i in range(self.n_agents):
-            self.pieces[i].color = generate_piece_color(agent_colors[i], self.n_colors)
-            self.agents[i].reset(self.agents, agent_colors[i], self.pieces[i])
-
-        return self.learning_agent.process_obs(self.env_info)
+            self.pieces[i].color = generate_piece_color(agent_colors[i], self.n_colors, self.rng)
+            self.agents[i].reset(agent_colors[i], self.pieces[i])
+
+        if self.recorder is not None:
+            self.recorder.begin_episode(self)
+        obs = copy_obs(self.learning_agent.process_obs(self.env_info))
+        self._prefetch_opponent_actions()
+        return obs
+
+    def get_state(self) -> dict:
+        """Copy of everything that changes during an episode, rng included, as numpy arrays and plain values"""
+        state = self.world.get_state()
+        state["step"] = self.step_
+        state["ep_reward"] = self.ep_reward
+        state["collective_reward"] = self.collective_reward
+        state["learning_agent_id"] = self.learning_agent_id
+        state["rng"] = self.rng.getstate()
+        state["opponent_action_rng"] = self.opponent_action_rng.bit_generator.state
+        state["policy_rngs"] = [policy.rng.bit_generator.state for policy in self._seeded_opponent_policies()]
+        return state
+
+    def set_state(self, state : dict) -> AgentObs:
+        """Continues from a get_state() copy, which is left untouched so it can be restored again.
+
+        Opponents keep their current models. Returns the learning agent's observation, like reset().
+        """
+        self._cancel_opponent_prefetch()
+        self.stats.end_episode() # drops whatever the abandoned trajectory counted
+
+        self.world.set_state(state)
+        self.pieces[:] = [self.all_pieces[i] for i in np.flatnonzero(self.world.piece_alive)]
+        for agent in self.agents:
+            agent.invalidate_obs()
+
+        self.step_ = state["step"]
+        self.ep_reward = state["ep_reward"]
+        self.collective_reward = state["collective_reward"]
+        self.rng.setstate(state["rng"])
+        self.opponent_action_rng.bit_generator.state = state["opponent_action_rng"]
+        for policy, rng_state in zip(self._seeded_opponent_policies(), state["policy_rngs"]):
+            policy.rng.bit_generator.state = rng_state
+
+        learning_agent_id = state["learning_agent_id"]
+        if learning_agent_id != self.learning_agent_id:
+            # the seat's model goes to the previous learning agent
+            new_learning_agent = self.agents[learning_agent_id - 1]
+            self.learning_agent.model, new_learning_agent.model = new_learning_agent.model, None
+            if learning_agent_id in self.opponent_snapshot_ids:
+                self.opponent_snapshot_ids[self.learning_agent_id] = self.opponent_snapshot_ids.pop(learning_agent_id)
+            self.learning_agent_id = learning_agent_id
+
+        if self.recorder is not None:
+            self.recorder.begin_episode(self)
+        obs = copy_obs(self.learning_agent.process_obs(self.env_info))
+        self._prefetch_opponent_actions()
+        return obs
 
     def step(self, learning_agent_action : AgentAction):
-        obs : AgentObs = []
+        """(obs, reward, terminated, truncated): terminated once every agent found its piece, truncated at max_steps"""
         reward = 0
-
-        obs = self.learning_agent.process_obs(self.env_info)
-
-        if self.step_ >= self.max_steps:
-            print("END OF EPISODE", "TOTAL REWARD: ", self.ep_reward + self.collective_reward)
-            return obs, self.collective_reward, True, False
+        self.info = {}
 
         # Start of Frame
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                print("USER QUIT !!!")
-                exit() #TODO: something more elegant?
-        
-        # End of Input Event
-
         # Step Event
         env_info = self.env_info
-        action_queue = {}
-
-        action_queue = get_action_queue()
 
         # Choosing other agent's actions
-        for agent in self.agents:
-            if not agent.is_learning_agent():
-                obs_ = agent.process_obs(env_info)
-                action = agent.choose_action(obs_)
-                action_queue[get_action_id(action)].append((agent.id, action))
+        if self.pending_opponent_actions is not None:
+            # only the time spent waiting for the background forward pass is counted
+            with Timer(self.stats, "opponent_inference"):
+                actions = self.pending_opponent_actions.result()
+            self.pending_opponent_actions = None
+        else:
+            actions = self._choose_opponent_actions(env_info)
+        actions[self.learning_agent_id] = learning_agent_action
+
+        rewards = self.resolve_actions(actions)
+        for agent_id, agent_reward in rewards.items():
+            if agent_id == self.learning_agent_id:
+                reward = agent_reward
             else:
-                action_queue[get_action_id(learning_agent_action)].append((self.learning_agent_id, learning_agent_action))
-
-        for action_id in action_queue:
-            for pair in action_queue[action_id]:
-                agent_id, action = pair
-                agent = self.agents[agent_id - 1]
+                self.collective_reward += agent_reward
 
-                if not agent.is_learning_agent():
-                    self.collective_reward += agent.step(action, env_info)
-                else:
-                    reward = agent.step(action, env_info)
-
-        obs = self.learning_agent.process_obs(env_info)
+        with Timer(self.stats, "learner_obs"):
+            # process_obs writes into the agent's own buffers, callers keep what they are given
+            obs = copy_obs(self.learning_agent.process_obs(env_info))
 
         # End of Step Event
-
-        # Draw Event
-        self.draw()
-        # End of Draw Event
-
-        #self.clock.tick(self.fps)
+        # Drawing only happens on render(), so it stays off the training hot path
         # End of Frame
         self.step_ += 1
         self.ep_reward += reward
 
-        return obs, reward, False, False
-    
-    def draw(self):
-        self.screen.fill(BACKGROUND_COLOR)
+        terminated = self.solved
+        truncated = not terminated and self.step_ >= self.max_steps
+        if not (terminated or truncated):
+            self._prefetch_opponent_actions()
+            return obs, reward, False, False
+
+        # what the teammates earned is paid out with the last transition
+        reward += self.collective_reward
+        self.info["episode_stats"] = self.stats.end_episode(
+            total_reward = self.ep_reward + self.collective_reward,
+            collective_reward = self.collective_reward,
+            length = self.step_,
+            solved = float(terminated))
+        if self.auto_reset:
+            self.info["final_observation"] = obs
+            obs = self.reset()
+        return obs, reward, terminated, truncated
+
+    def resolve_actions(self, actions : dict[int, AgentAction]) -> dict[int, float]:
+        """Applies one action per agent id, grouped by action type in agent order, and returns every agent's reward"""
+        env_info = self.env_info
+        action_queue = get_action_queue()
+        for agent in self.agents:
+            action = actions[agent.id]
+            action_queue[get_action_id(action)].append((agent.id, action))
+
+        rewards = {}
+        with Timer(self.stats, "action_resolution"):
+            for action_id in action_queue:
+                for pair in action_queue[action_id]:
+                    agent_id, action = pair
+                    rewards[agent_id] = self.agents[agent_id - 1].step(action, env_info)
+
+            # everyone hears the nearest agent that said something this turn
+            self.world.speech.hear_nearest(self.world.agent_pos, self.hearing_radius)
+
+        if self.recorder is not None:
+            self.recorder.record_step(self, actions, rewards)
+        return rewards
+
+    def record(self, path : str, **kwargs):
+        """Appends every episode from the next reset on to the recording at path (see recorder.py)"""
+        self.stop_recording()
+        self.recorder = EpisodeRecorder(path, self, **kwargs)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def _choose_opponent_actions(self, env_info) -> dict[int, AgentAction]:
+        with Timer(self.stats, "opponent_obs"):
+            batches = self._build_opponent_batches(env_info)
+        with Timer(self.stats, "opponent_inference"):
+            return self._predict_opponent_actions(batches)
+
+    def _build_opponent_batches(self, env_info):
+        # One batched forward pass per model instead of one per agent
+        groups = {}
+        for agent in self.agents:
+            if not agent.is_learning_agent():
+                groups.setdefault(id(agent.model), []).append(agent)
+
+        batches = []
+        for model_id, group in groups.items():
+            obs_list = [agent.process_obs(env_info) for agent in group]
+            if group[0].model is self.inference_client:
+                # stacked straight into the shared memory the server reads
+                batches.append((group, stack_obs(obs_list, self.inference_client.obs_slot(len(group)))))
+                continue
+            key = (model_id, len(group))
+            self.batch_obs_buffers[key] = stack_obs(obs_list, self.batch_obs_buffers.get(key))
+            batches.append((group, self.batch_obs_buffers[key]))
+        return batches
+
+    def _predict_opponent_actions(self, batches) -> dict[int, AgentAction]:
+        actions = {}
+        for group, obs in batches:
+            model = group[0].model
+            snapshot_ids = [self.opponent_snapshot_ids.get(agent.id) for agent in group]
+            if self.action_cache is not None:
+                batch_actions = self._cached_opponent_actions(model, obs, snapshot_ids)
+            else:
+                batch_actions = self._forward_opponents(model, obs, snapshot_ids)
+            for i, agent in enumerate(group):
+                actions[agent.id] = unstack_action(batch_actions, i)
+        return actions
+
+    def _forward_opponents(self, model, obs, snapshot_ids) -> AgentAction:
+        if model is self.inference_client:
+            batch_actions, _ = model.predict(obs, snapshot_ids)
+        else:
+            batch_actions, _ = model.predict(obs, deterministic=self.opponent_deterministic)
+        return batch_actions
+
+    def _cached_opponent_actions(self, model, obs, snapshot_ids) -> AgentAction:
+        from action_cache import distribution_params, sample_actions, select_rows
+
+        cache = self.action_cache
+        hits, misses = cache.hits, cache.misses
+        if self.opponent_deterministic:
+            batch_actions = cache.get(obs, snapshot_ids, lambda rows: self._forward_opponents(
+                model, select_rows(obs, rows), [snapshot_ids[i] for i in rows]))
+        else:
+            params = cache.get(obs, snapshot_ids, lambda rows: distribution_params(model, select_rows(obs, rows)))
+            action_space = getattr(model, "policy", model).action_space
+            batch_actions = sample_actions(params, action_space, self.opponent_action_rng)
+        self.stats.count("action_cache_hits", cache.hits - hits)
+        self.stats.count("action_cache_misses", cache.misses - misses)
+        return batch_actions
+
+    def _prefetch_opponent_actions(self):
+        # Opponent observations only depend on the world as it is now, so their
+        # actions for the next step can be computed before the learner has acted
+        self._cancel_opponent_prefetch()
+        if not self.pipeline_opponents:
+            return
+
+        if self.inference_executor is None:
+            self.inference_executor = ThreadPoolExecutor(max_workers=1)
+        with Timer(self.stats, "opponent_obs"):
+            batches = self._build_opponent_batches(self.env_info)
+        self.pending_opponent_actions = self.inference_executor.submit(self._predict_opponent_actions, batches)
+
+    def _seeded_opponent_policies(self) -> list:
+        # the template and the slots, slots copy the template (generator included) when they are created
+        policies = [self.opponent_model] + (self.opponent_slots.policies if self.opponent_slots is not None else [])
+        return [policy for policy in policies if hasattr(policy, "seed")]
+
+    def _seed_opponent_policies(self, seed : int):
+        for policy in self._seeded_opponent_policies():
+            policy.seed(seed)
+
+    def _cancel_opponent_prefetch(self):
+        if self.pending_opponent_actions is not None:
+            self.pending_opponent_actions.cancel()
+            # the batch buffers may still be in use by a running forward pass
+            wait([self.pending_opponent_actions])
+            self.pending_opponent_actions = None
+
+    def render(self):
+        if self.render_mode is None:
+            return None
+
+        # imported on the first render, headless workers never load it
+        import pygame
+        if self.screen is None:
+            self._init_render()
+
+        if self.render_mode == "human":
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    print("USER QUIT !!!")
+                    exit() #TODO: something more elegant?
+
+        with Timer(self.stats, "draw"):
+            self.draw()
+
+        if self.render_mode == "human":
+            pygame.display.flip()
+            self.clock.tick(self.fps)
+        else:
+            return np.transpose(pygame.surfarray.array3d(self.screen), axes=(1, 0, 2))
+
+    def _init_render(self):
+        import pygame
+
+        pygame.font.init()
 
-        # GRID
+        if self.render_mode == "human":
+            pygame.display.init()
+            self.screen = pygame.display.set_mode((self.screen_width, self.screen_height))
+            self.clock = pygame.time.Clock()
+        else:
+            self.screen = pygame.Surface((self.screen_width, self.screen_height))
+
+        # Falls back to pygame's default font when micross is not available (e.g. not on Windows)
+        font_path = FONT_PATH if os.path.exists(FONT_PATH) else None
+        self.font_normal = pygame.font.Font(font_path, 18)
+        self.font_small = pygame.font.Font(font_path, 14)
+
+        # GRID (drawn once, blitted every frame)
+        self.background = pygame.Surface((self.screen_width, self.screen_height))
+        self.background.fill(BACKGROUND_COLOR)
         for i in range(self.grid_size):
             for j in range(self.grid_size):
-                color = GRAY
-                pygame.draw.rect(self.screen, color,
+                pygame.draw.rect(self.background, GRAY,
                                 (i * self.cell_size, j * self.cell_size, self.cell_size, self.cell_size),
                                 width = 1)
+
+    def _get_glyph(self, letter, color, small = False):
+        key = (letter, color, small)
+        glyph = self.glyph_cache.get(key)
+        if glyph is None:
+            font = self.font_small if small else self.font_normal
+            glyph = font.render(str(letter), True, get_color(color, dark = True))
+            self.glyph_cache[key] = glyph
+        return glyph
+
+    def draw(self):
+        import pygame
+
+        self.screen.blit(self.background, (0, 0))
+
         # AGENTS  
         for agent in self.agents:
             pygame.draw.circle(self.screen,
@@ -183,22 +561,52 @@ class GameEnv:
                                 radius = 16)
             # piece agent wants
             pygame.draw.circle(self.screen, WHITE, ((agent.x - 1/2) * self.cell_size, (agent.y - 1/2) * self.cell_size), 10)
-            piece_letter = self.font_small.render(str(agent.piece.letter), True, get_color(agent.piece.color, dark=True))
+            piece_letter = self._get_glyph(agent.piece.letter, agent.piece.color, small = True)
             piece_pos = (agent.x - 3/4) * self.cell_size, (agent.y - 3/4) * self.cell_size
             self.screen.blit(piece_letter, piece_pos)
 
         # PIECES
         for piece in self.pieces:
-            piece_letter = self.font_normal.render(str(piece.letter), True, get_color(piece.color, dark = True))
+            piece_letter = self._get_glyph(piece.letter, piece.color)
             piece_pos = ((piece.x - 1/2) * self.cell_size, (piece.y - 1/2) * self.cell_size)
             self.screen.blit(piece_letter, piece_pos)
 
-        pygame.display.flip()
-    
+    def __getstate__(self):
+        # pygame surfaces and fonts can't be pickled, they are rebuilt on the next render()
+        state = self.__dict__.copy()
+        for key in ("screen", "background", "font_normal", "font_small", "clock"):
+            state.pop(key, None)
+        state["screen"] = None
+        state["background"] = None
+        state["glyph_cache"] = {}
+        state["inference_executor"] = None
+        state["pending_opponent_actions"] = None
+        state["recorder"] = None
+        return state
+
+    def close(self):
+        self._cancel_opponent_prefetch()
+        self.stop_recording()
+        if self.inference_client is not None:
+            self.inference_client.close()
+        if self.inference_executor is not None:
+            self.inference_executor.shutdown()
+            self.inference_executor = None
+        if self.screen is not None:
+            if self.render_mode == "human":
+                import pygame
+                pygame.display.quit()
+            self.screen = None
+            self.glyph_cache.clear()
+
     @property
     def env_info(self):
         return (self.agents, self.pieces)
     
+    @property
+    def solved(self):
+        return bool(self.world.agent_found.all())
+
     @property
     def learning_agent(self):
         return self.agents[self.learning_agent_id - 1]
@@ -0,0 +1,247 @@
+"""One process running every worker's opponents.
+
+Each worker owns a slot of a shared memory block. An InferenceClient stacks its opponents'
+observations straight into the slot, flags it and wakes the server, then waits on the slot's
+semaphore. The server takes every flagged slot, runs one forward pass per snapshot over all of
+their rows and writes the actions back, so N workers cost one model and a few large batches
+instead of N models and N small ones.
+"""
+import time
+import threading
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from opponents import OpponentPool, OpponentSlots, get_policy_weights
+from utils import AgentAction, AgentObs
+
+LATEST = -1 # snapshot id of rows that play the newest snapshot
+FAILED = -1 # count the server writes back when the forward pass raised
+
+class SlotLayout:
+    """Offsets of the arrays in the shared block, each one has a leading (slot, row) shape"""
+
+    def __init__(self, observation_space, action_space, n_slots : int, max_batch : int):
+        fields = [("pending", np.int8, (n_slots, )), ("count", np.int64, (n_slots, )),
+                  ("snapshot", np.int64, (n_slots, max_batch))]
+        # a flat observation space is a single entry with an empty key
+        self.flat_obs = not hasattr(observation_space, "spaces")
+        obs_spaces = {"" : observation_space} if self.flat_obs else observation_space.spaces
+        fields += [("obs/" + key, space.dtype, (n_slots, max_batch) + space.shape)
+                   for key, space in obs_spaces.items()]
+        fields += [("action/" + key, space.dtype, (n_slots, max_batch) + space.shape)
+                   for key, space in action_space.spaces.items()]
+
+        self.n_slots = n_slots
+        self.max_batch = max_batch
+        self.fields = {}
+        offset = 0
+        for name, dtype, shape in fields:
+            dtype = np.dtype(dtype)
+            offset = -(-offset // 64) * 64 # cache line aligned
+            self.fields[name] = (offset, dtype.str, shape)
+            offset += dtype.itemsize * int(np.prod(shape))
+        self.nbytes = max(offset, 1)
+
+    def arrays(self, buffer) -> dict[str, np.ndarray]:
+        return {name : np.ndarray(shape, dtype, buffer=buffer, offset=offset)
+                for name, (offset, dtype, shape) in self.fields.items()}
+
+def _split(arrays : dict[str, np.ndarray], prefix : str) -> dict[str, np.ndarray]:
+    return {name[len(prefix):] : value for name, value in arrays.items() if name.startswith(prefix)}
+
+class InferenceClient:
+    """A worker's slot, GameEnv runs its opponents on it in place of a policy (see GameEnv.connect_inference_server)"""
+
+    def __init__(self, layout : SlotLayout, block_name : str, slot : int, requested, ready, timeout : float):
+        self.layout = layout
+        self.block_name = block_name
+        self.slot = slot
+        self.requested = requested
+        self.ready = ready
+        self.timeout = timeout
+        self.block = None
+
+    def _attach(self):
+        # attached lazily, in the worker process
+        self.block = shared_memory.SharedMemory(name=self.block_name)
+        arrays = self.layout.arrays(self.block.buf)
+        self.pending = arrays["pending"][self.slot : self.slot + 1]
+        self.count = arrays["count"][self.slot : self.slot + 1]
+        self.snapshot = arrays["snapshot"][self.slot]
+        self.obs = {key : value[self.slot] for key, value in _split(arrays, "obs/").items()}
+        self.actions = {key : value[self.slot] for key, value in _split(arrays, "action/").items()}
+        self.obs_views = {}
+
+    def obs_slot(self, n : int) -> AgentObs:
+        """Views of the slot's first n observation rows, for stack_obs(..., out=)"""
+        if self.block is None:
+            self._attach()
+        if n not in self.obs_views:
+            assert n <= self.layout.max_batch, f"{n} opponents, the server was sized for {self.layout.max_batch}"
+            self.obs_views[n] = {key : value[:n] for key, value in self.obs.items()}
+        return self.obs_views[n][""] if self.layout.flat_obs else self.obs_views[n]
+
+    def predict(self, obs : AgentObs, snapshot_ids : list[int]) -> tuple[AgentAction, None]:
+        n = len(snapshot_ids)
+        rows = self.obs_slot(n)
+        if self.layout.flat_obs:
+            obs, rows = {"" : obs}, {"" : rows}
+        for key, value in rows.items():
+            if obs[key] is not value:
+                value[...] = obs[key]
+        self.snapshot[:n] = [LATEST if snapshot_id is None else snapshot_id for snapshot_id in snapshot_ids]
+        self.count[0] = n
+
+        self.pending[0] = 1
+        self.requested.release()
+        if not self.ready.acquire(timeout=self.timeout):
+            raise RuntimeError(f"the inference server did not answer within {self.timeout}s")
+        if self.count[0] == FAILED:
+            raise RuntimeError("the inference server failed, see its traceback")
+        # copies, the slot is overwritten by the next request
+        return {key : value[:n].copy() for key, value in self.actions.items()}, None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("pending", "count", "snapshot", "obs", "actions", "obs_views"):
+            state.pop(key, None)
+        state["block"] = None
+        return state
+
+    def close(self):
+        if self.block is not None:
+            self.obs = self.actions = self.obs_views = self.pending = self.count = self.snapshot = None
+            self.block.close()
+            self.block = None
+
+class InferenceServer:
+    """Starts the server process. Clients are handed to the workers, weights are pushed here only once.
+
+    n_slots is the number of workers and max_batch the most opponents a worker asks for at once.
+    The server keeps its own pool of pool_size snapshots; a row asking for one it doesn't hold
+    plays the newest, and until the first push every row plays policy_factory's fresh policy.
+    After the first request it waits up to batch_wait seconds for the other workers to join the batch.
+    deterministic is passed on to policy.predict, it has to be set for GameEnv's opponent_action_cache.
+    """
+
+    def __init__(self, policy_factory, observation_space, action_space, n_slots : int, max_batch : int,
+                 pool_size : int = 8, batch_wait : float = 0.0002, timeout : float = 60.0, start_method : str = None,
+                 deterministic : bool = False):
+        if start_method is None:
+            # as SubprocVecEnv does, a forked server would inherit the learner's torch threads and can deadlock
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(start_method)
+        self.layout = SlotLayout(observation_space, action_space, n_slots, max_batch)
+        self.block = shared_memory.SharedMemory(create=True, size=self.layout.nbytes)
+        # named semaphores (not a fork context's) reach workers however the VecEnv starts them.
+        # requested gets one release per flagged slot, it wakes the server up
+        semaphores = mp.get_context("spawn")
+        self.requested = semaphores.Semaphore(0)
+        self.ready = [semaphores.Semaphore(0) for _ in range(n_slots)]
+        self.control, server_control = ctx.Pipe()
+        self.timeout = timeout
+
+        self.process = ctx.Process(target=serve, daemon=True,
+                                   args=(self.layout, self.block.name, self.requested, self.ready, server_control,
+                                         policy_factory, observation_space, action_space, pool_size, batch_wait, deterministic))
+        self.process.start()
+        server_control.close()
+
+    def client(self, slot : int) -> InferenceClient:
+        return InferenceClient(self.layout, self.block.name, slot, self.requested, self.ready[slot], self.timeout)
+
+    def push_weights(self, weights, snapshot_id : int):
+        """weights: a policy, or weights already taken from one"""
+        if not isinstance(weights, dict):
+            weights = get_policy_weights(weights)
+        self.control.send(("weights", snapshot_id, weights))
+        # workers may ask for the snapshot as soon as this returns
+        if not self.control.poll(self.timeout):
+            raise RuntimeError(f"the inference server did not load snapshot {snapshot_id} within {self.timeout}s")
+        self.control.recv()
+
+    def close(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.control.send(("stop", ))
+        self.process.join()
+        self.process = None
+        self.control.close()
+        self.block.close()
+        self.block.unlink()
+
+def serve(layout : SlotLayout, block_name : str, requested, ready, control,
+          policy_factory, observation_space, action_space, pool_size : int, batch_wait : float, deterministic : bool):
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays = layout.arrays(block.buf)
+    pending = arrays["pending"]
+    policy = policy_factory(observation_space, action_space)
+    pool = OpponentPool(pool_size)
+    slots = OpponentSlots(policy)
+    pool_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def receive():
+        # weights are bigger than a pipe buffer, they are read as they arrive rather than between batches
+        while True:
+            message = control.recv()
+            if message[0] == "stop":
+                stopped.set()
+                requested.release()
+                return
+            with pool_lock:
+                pool.add(message[2], message[1])
+            control.send(message[1])
+
+    threading.Thread(target=receive, daemon=True).start()
+    while not stopped.is_set():
+        requested.acquire()
+        deadline = time.perf_counter() + batch_wait
+        while not pending.all():
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0 or not requested.acquire(timeout=timeout):
+                break
+        # slots are flagged before their release, whatever was released so far is flagged by now
+        while requested.acquire(False):
+            pass
+
+        batch = np.flatnonzero(pending)
+        if len(batch) == 0:
+            continue
+        pending[batch] = 0
+        try:
+            with pool_lock:
+                answer(batch, arrays, policy, pool, slots, deterministic)
+        except BaseException:
+            arrays["count"][batch] = FAILED
+            raise
+        finally:
+            for slot in batch:
+                ready[slot].release()
+
+    del arrays, pending
+    block.close()
+
+def answer(batch : np.ndarray, arrays : dict[str, np.ndarray], policy, pool : OpponentPool, slots : OpponentSlots,
+           deterministic : bool = False):
+    counts = arrays["count"][batch]
+    slot_ind = np.repeat(batch, counts)
+    row_ind = np.concatenate([np.arange(count) for count in counts])
+    snapshot_ids = arrays["snapshot"][slot_ind, row_ind]
+    fallback = LATEST if pool.latest_id is None else pool.latest_id
+    snapshot_ids[~np.isin(snapshot_ids, list(pool.snapshots))] = fallback
+
+    wanted = [int(snapshot_id) for snapshot_id in np.unique(snapshot_ids)]
+    models = slots.load([snapshot_id for snapshot_id in wanted if snapshot_id != LATEST], pool)
+    models[LATEST] = policy
+
+    obs, actions = _split(arrays, "obs/"), _split(arrays, "action/")
+    for snapshot_id in wanted:
+        rows = snapshot_ids == snapshot_id
+        batch = {key : value[slot_ind[rows], row_ind[rows]] for key, value in obs.items()}
+        # a flat observation has the one entry
+        batch_actions, _ = models[snapshot_id].predict(batch.get("", batch), deterministic=deterministic)
+        for key, value in dict(batch_actions).items():
+            actions[key][slot_ind[rows], row_ind[rows]] = value
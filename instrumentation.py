@@ -0,0 +1,52 @@
+from time import perf_counter
+from collections import Counter
+
+STEP_PHASES = ["opponent_obs", "opponent_inference", "action_resolution", "learner_obs", "draw"]
+
+class EnvStats:
+    """Cumulative time per phase of GameEnv.step and event counters.
+
+    Everything is plain float/int accumulation so it can stay on in production.
+    Episode values are reset by end_episode(), totals are kept for the env's lifetime.
+    """
+
+    def __init__(self, events : list[str] = ()):
+        # events listed up front are reported even when they didn't happen in an episode
+        self.events = list(events)
+        self.phase_time = dict.fromkeys(STEP_PHASES, 0.0)
+        self.counters = Counter()
+        self.episode_phase_time = dict.fromkeys(STEP_PHASES, 0.0)
+        self.episode_counters = Counter()
+
+    def add_time(self, phase : str, seconds : float):
+        self.phase_time[phase] += seconds
+        self.episode_phase_time[phase] += seconds
+
+    def count(self, event : str, n : int = 1):
+        self.counters[event] += n
+        self.episode_counters[event] += n
+
+    def end_episode(self, **extra) -> dict:
+        """Summary of the episode that just ended (counters, seconds per phase and `extra`)"""
+        summary = dict.fromkeys(self.events, 0)
+        summary.update(self.episode_counters)
+        summary.update({"time/" + phase : seconds for phase, seconds in self.episode_phase_time.items()})
+        summary.update(extra)
+
+        self.episode_counters.clear()
+        self.episode_phase_time = dict.fromkeys(STEP_PHASES, 0.0)
+        return summary
+
+class Timer:
+    """with Timer(stats, "phase"): ... adds the elapsed time to that phase"""
+
+    def __init__(self, stats : EnvStats, phase : str):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.phase, perf_counter() - self.start)
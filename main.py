@@ -1,34 +1,83 @@
 import os
-import gymnasium as gym
-from env import CustomEnv
-from game_env import GameEnv
+from vec_env import OpponentPolicyFactory, make_vec_env, make_inference_server, broadcast_opponent_weights
+from checkpoints import CheckpointManager
+from evaluate import Evaluator, print_tournament
+from numpy_policy import NumpyPolicyFactory
 
-from sb3_plus import MultiOutputPPO
-
-game_env = GameEnv(
+game_config = dict(
                     max_steps= 256,
                     n_colors= 3,
                     n_agents= 9,
                     n_pieces= 9,
                     n_letters= 2,
                     grid_size = 12)
-env = CustomEnv(env=game_env)
+n_envs = os.cpu_count() or 1
+timesteps_per_iteration = 2048 * 5
+# one rollout per iteration, split over the workers, so opponents and checkpoints refresh every
+# timesteps_per_iteration steps however many cores the machine has
+n_steps = -(-timesteps_per_iteration // n_envs)
+opponent_weight_dtype = "float32" # snapshots as the opponent pools keep them: float32, float16 or int8
+
+save_dir = "saves"
+model_path = "saves/coolmodel.save" # single file written by older versions
+
+if __name__ == "__main__":
+    # imported here, spawned worker processes re-import this module and don't need torch
+    from sb3_plus import MultiOutputPPO
+    from callbacks import EnvStatsCallback
+    from env import CustomEnv
+    from game_env import GameEnv
 
-model_path = "saves/coolmodel.save"
+    # frozen opponents run as NumPy matmuls. The policy is exported once here, checked against torch,
+    # and the server and evaluation workers get the export without importing torch
+    policy_factory = NumpyPolicyFactory(OpponentPolicyFactory(MultiOutputPPO.policy_aliases["MIMOPolicy"]))
+    spaces_env = CustomEnv(GameEnv(**game_config))
+    policy_factory.export(spaces_env.observation_space, spaces_env.action_space)
+    # one process runs every worker's opponents in shared batches
+    inference_server = make_inference_server(game_config, n_envs, policy_factory)
+    env = make_vec_env(game_config, n_envs, policy_factory, seed=0, inference_server=inference_server)
 
-model = MultiOutputPPO(policy='MIMOPolicy', env=env, verbose=1, tensorboard_log="logs/")
-if not os.path.exists(model_path):
-    model.save(model_path)
-else:
-    model = model.load(model_path, env=env)
+    checkpoints = CheckpointManager(save_dir, prefix="coolmodel", keep_last=3, keep_every=50)
+    first_iteration = 0
+    # a fresh model is only built when there is nothing to resume from
+    if checkpoints.latest_path() is not None:
+        model = MultiOutputPPO.load(checkpoints.latest_path(), env=env, n_steps=n_steps)
+        first_iteration = checkpoints.latest_step() + 1
+    elif os.path.exists(model_path):
+        model = MultiOutputPPO.load(model_path, env=env, n_steps=n_steps)
+    else:
+        model = MultiOutputPPO(policy='MIMOPolicy', env=env, n_steps=n_steps, verbose=1, tensorboard_log="logs/")
 
-for i in range(1000):
-    print(f"Iteration {i}")
-    game_env.init_instances(model.load(model_path))
+    # the latest checkpoint plays the last few in the background, results are printed an iteration later.
+    # One worker: the env workers and the inference server already have a process per core
+    evaluator = Evaluator(game_config, policy_factory, n_workers=1)
+    evaluation = None
 
-    model.learn(total_timesteps=2048 * 5, progress_bar=True, tb_log_name="MO_PPO")
-    print("Saving...")
-    model.save(model_path)
+    opponent_weights = model.policy
+    for i in range(first_iteration, first_iteration + 1000):
+        print(f"Iteration {i}")
+        broadcast_opponent_weights(env, opponent_weights, snapshot_id=i, inference_server=inference_server,
+                                   weight_dtype=opponent_weight_dtype)
+
+        model.learn(total_timesteps=timesteps_per_iteration, progress_bar=True, tb_log_name="MO_PPO",
+                    callback=EnvStatsCallback())
+        # written in the background, the next iteration's opponents come from the in-memory snapshot
+        opponent_weights = checkpoints.save(model, i).policy_weights
+
+        if evaluation is not None and evaluation.done():
+            print_tournament(evaluation.result())
+            evaluation = None
+        # only steps that survive the rotation of the save above, it may still be running
+        previous = sorted(checkpoints.kept(set(checkpoints.steps()) | {i}) - {i})[-4:]
+        if evaluation is None and previous:
+            # the newest file may still be being written, its weights are already in memory
+            tournament = {step : checkpoints.path(step) for step in previous}
+            tournament[i] = opponent_weights
+            evaluation = evaluator.submit(tournament, games_per_pair=64, seed=i)
+    evaluator.close()
+    checkpoints.close()
+    env.close()
+    inference_server.close()
 
 """
 # The ideia is train the agent together with n of its clones and update the clones with the new knowladge every k steps
@@ -39,4 +88,4 @@ for _ in range(1000):
     action, _states = model.predict(obs)
     obs, rewards, dones, info = env.step(action)
     env.render()
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,86 @@
+"""SB3 VecEnv over ParallelGameEnvs, apart from parallel_env so playing games doesn't import SB3 (and torch)"""
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from parallel_env import ParallelGameEnv
+from utils import AgentAction, copy_obs, stack_obs, unstack_action
+
+class MultiAgentVecEnv(VecEnv):
+    """SB3 VecEnv over one or more ParallelGameEnvs, one vector slot per agent.
+
+    Slot i is agent (i % n_agents) + 1 of game i // n_agents, so a single shared policy
+    collects n_games * n_agents transitions per simulated step. Games reset automatically
+    when their episode ends, as SB3 expects.
+    """
+
+    def __init__(self, envs : list[ParallelGameEnv]):
+        self.envs = envs
+        self.n_agents = len(envs[0].possible_agents)
+        self.actions = None
+        super().__init__(len(envs) * self.n_agents, envs[0].observation_space(None), envs[0].action_space(None))
+
+    def reset(self):
+        obs_list = []
+        for i, env in enumerate(self.envs):
+            observations, _ = env.reset(seed = self._seeds[i * self.n_agents])
+            obs_list.extend(observations[name] for name in env.possible_agents)
+        self._reset_seeds()
+        return stack_obs(obs_list)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        obs_list = []
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        infos = []
+
+        for i, env in enumerate(self.envs):
+            first_slot = i * self.n_agents
+            actions = {name : self._get_action(first_slot + j) for j, name in enumerate(env.possible_agents)}
+            observations, env_rewards, terminations, truncations, env_infos = env.step(actions)
+
+            for j, name in enumerate(env.possible_agents):
+                rewards[first_slot + j] = env_rewards[name]
+                dones[first_slot + j] = terminations[name] or truncations[name]
+                info = env_infos[name]
+                info["TimeLimit.truncated"] = truncations[name] and not terminations[name]
+                infos.append(info)
+
+            if dones[first_slot]:
+                for j, name in enumerate(env.possible_agents):
+                    infos[first_slot + j]["terminal_observation"] = copy_obs(observations[name])
+                observations, _ = env.reset()
+            obs_list.extend(observations[name] for name in env.possible_agents)
+
+        return stack_obs(obs_list), rewards, dones, infos
+
+    def _get_action(self, slot : int) -> AgentAction:
+        # SB3 hands over either a dict of batched arrays or one action per slot
+        if isinstance(self.actions, dict):
+            return unstack_action(self.actions, slot)
+        return self.actions[slot]
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+    def _get_games(self, indices) -> list[int]:
+        return [i // self.n_agents for i in self._get_indices(indices)]
+
+    def get_attr(self, attr_name, indices = None):
+        return [getattr(self.envs[game], attr_name) for game in self._get_games(indices)]
+
+    def set_attr(self, attr_name, value, indices = None):
+        for game in set(self._get_games(indices)):
+            setattr(self.envs[game], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices = None, **method_kwargs):
+        # slots of the same game share it, so the method runs once per game
+        games = self._get_games(indices)
+        results = {game : getattr(self.envs[game], method_name)(*method_args, **method_kwargs) for game in dict.fromkeys(games)}
+        return [results[game] for game in games]
+
+    def env_is_wrapped(self, wrapper_class, indices = None):
+        return [False for _ in self._get_games(indices)]
@@ -0,0 +1,241 @@
+"""Frozen opponent policies as plain NumPy.
+
+An opponent only needs actions, and SB3's predict wraps a small MLP in observation preprocessing,
+tensor conversion, no_grad and distribution objects. NumpyPolicy runs the same forward pass with
+NumPy matmuls, exported from the weights of an ActorCriticPolicy with a flatten / combined
+features extractor (MIMOPolicy's layout): mlp_extractor.policy_net, then action_net as one Linear
+split over the action keys or as one Linear per key, and log_std for Box actions.
+
+Discrete and MultiDiscrete observations (token speech) aren't one-hot encoded, their tokens pick
+rows of the first layer's weights. The forward pass runs in float32, weights compressed to float16
+or int8 (opponents.compress_weights, as pools keep and ship them) are expanded when loaded.
+"""
+import copy
+import numpy as np
+from gymnasium import spaces
+
+from opponents import decompress_weights
+from utils import AgentAction, AgentObs, stack_obs
+
+POLICY_NET = "mlp_extractor.policy_net."
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+def _identity(x):
+    return x
+
+ACTIVATIONS = {"Tanh" : np.tanh, "ReLU" : _relu, "Identity" : _identity}
+
+def action_dims(action_space : spaces.Dict) -> dict[str, int]:
+    """Outputs of action_net per action key: logits, or the mean of a Box"""
+    dims = {}
+    for key, space in action_space.spaces.items():
+        if isinstance(space, spaces.Discrete):
+            dims[key] = int(space.n)
+        elif isinstance(space, spaces.MultiDiscrete):
+            dims[key] = int(space.nvec.sum())
+        elif isinstance(space, spaces.Box):
+            dims[key] = int(np.prod(space.shape))
+        else:
+            raise TypeError(f"can't export a policy with a {type(space).__name__} action")
+    return dims
+
+class NumpyPolicy:
+    """Inference-only policy, a drop-in for the model of an opponent Agent (predict() as SB3's).
+
+    weights: the policy's state dict as numpy arrays (opponents.get_policy_weights).
+    """
+
+    def __init__(self, weights : dict[str, np.ndarray], observation_space : spaces.Space, action_space : spaces.Dict,
+                 activation : str = "Tanh", seed : int = None):
+        assert activation in ACTIVATIONS, f"unsupported activation {activation}"
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.activation = activation
+        self.seed(seed)
+        self.dims = action_dims(action_space)
+        self._init_inputs()
+        self.load_weights(weights)
+
+    def _init_inputs(self):
+        # the features extractor's input, flattened entries in the Dict's (sorted) key order.
+        # Categorical entries are one-hot there, here they index rows of the first layer
+        entries = {"" : self.observation_space} if not isinstance(self.observation_space, spaces.Dict) \
+            else self.observation_space.spaces
+        self.dense, self.categorical, dense_rows = [], [], []
+        offset = 0
+        for key, space in entries.items():
+            if isinstance(space, (spaces.Discrete, spaces.MultiDiscrete)):
+                nvec = np.atleast_1d(space.n if isinstance(space, spaces.Discrete) else space.nvec).ravel()
+                self.categorical.append((key, offset + np.r_[0, np.cumsum(nvec)[:-1]]))
+                offset += int(nvec.sum())
+            elif isinstance(space, (spaces.Box, spaces.MultiBinary)):
+                size = int(np.prod(space.shape))
+                self.dense.append(key)
+                dense_rows.append(np.arange(offset, offset + size))
+                offset += size
+            else:
+                raise TypeError(f"can't export a policy with a {type(space).__name__} observation")
+        self.n_inputs = offset
+        self.dense_rows = np.concatenate(dense_rows) if dense_rows else np.zeros(0, dtype=np.int64)
+
+    def seed(self, seed : int = None):
+        """Seeds the generator sampled actions are drawn from"""
+        self.rng = np.random.default_rng(seed)
+
+    def load_weights(self, weights : dict[str, np.ndarray]):
+        """Takes new weights of the same architecture, see opponents.load_policy_weights"""
+        weights = decompress_weights(weights)
+        for key in weights:
+            if "features_extractor." in key:
+                raise ValueError(f"{key}: only feature extractors without weights (flatten) can be exported")
+        layers = sorted(int(key[len(POLICY_NET):].split(".")[0]) for key in weights
+                        if key.startswith(POLICY_NET) and key.endswith(".weight"))
+        if not layers:
+            raise ValueError("no mlp_extractor.policy_net layers in the weights")
+        arrays = {}
+        for i, layer in enumerate(layers):
+            arrays[f"layer {i}"] = weights[f"{POLICY_NET}{layer}.weight"]
+            arrays[f"bias {i}"] = weights[f"{POLICY_NET}{layer}.bias"]
+
+        # action_net: one Linear whose outputs are split over the action keys in order, or one per key
+        if "action_net.weight" in weights:
+            arrays["head"], arrays["head bias"] = weights["action_net.weight"], weights["action_net.bias"]
+        else:
+            arrays["head"] = np.concatenate([weights[f"action_net.{key}.weight"] for key in self.dims])
+            arrays["head bias"] = np.concatenate([weights[f"action_net.{key}.bias"] for key in self.dims])
+        boxes = [key for key, space in self.action_space.spaces.items() if isinstance(space, spaces.Box)]
+        if boxes:
+            arrays["log_std"] = weights["log_std"] if "log_std" in weights \
+                else np.concatenate([weights["log_std." + key] for key in boxes])
+
+        if arrays["layer 0"].shape[1] != self.n_inputs:
+            raise ValueError(f"the first layer takes {arrays['layer 0'].shape[1]} inputs, the observation has {self.n_inputs}")
+        if arrays["head"].shape[0] != sum(self.dims.values()):
+            raise ValueError(f"action_net has {arrays['head'].shape[0]} outputs, the actions need {sum(self.dims.values())}")
+
+        # float32, matrices transposed so a layer is x @ weight
+        self.n_layers = len(layers)
+        self.weights = {name : np.asarray(value, dtype=np.float32) for name, value in arrays.items()}
+        for name in [f"layer {i}" for i in range(self.n_layers)] + ["head"]:
+            self.weights[name] = self.weights[name].T.copy()
+        self.dense_weight = self.weights["layer 0"][self.dense_rows]
+        # std of each Box action, doesn't depend on the observation
+        self.std, start = {}, 0
+        for key in boxes:
+            self.std[key] = np.exp(self.weights["log_std"][start : start + self.dims[key]])
+            start += self.dims[key]
+
+    def distribution_params(self, obs : AgentObs) -> dict[str, np.ndarray]:
+        """Batched parameters of the action distribution, in action_cache.sample_actions' format"""
+        weights, activation = self.weights, ACTIVATIONS[self.activation]
+        entries = {"" : obs} if isinstance(obs, np.ndarray) else obs
+        n = len(next(iter(entries.values())))
+
+        if self.dense:
+            x = np.concatenate([np.asarray(entries[key], dtype=np.float32).reshape(n, -1) for key in self.dense], axis=1)
+            hidden = x @ self.dense_weight + weights["bias 0"]
+        else:
+            hidden = np.tile(weights["bias 0"], (n, 1))
+        for key, offsets in self.categorical:
+            rows = np.asarray(entries[key]).reshape(n, -1).astype(np.int64) + offsets
+            hidden += weights["layer 0"][rows].sum(axis=1)
+        hidden = activation(hidden)
+        for i in range(1, self.n_layers):
+            hidden = activation(hidden @ weights[f"layer {i}"] + weights[f"bias {i}"])
+        out = hidden @ weights["head"] + weights["head bias"]
+
+        params, start = {}, 0
+        for key, space in self.action_space.spaces.items():
+            value = out[:, start : start + self.dims[key]]
+            start += self.dims[key]
+            if isinstance(space, spaces.Discrete):
+                params[key + "/logits"] = value
+            elif isinstance(space, spaces.MultiDiscrete):
+                splits = np.cumsum(space.nvec.ravel())[:-1]
+                for i, logits in enumerate(np.split(value, splits, axis=1)):
+                    params[f"{key}/logits/{i}"] = logits
+            else:
+                params[key + "/mean"] = value
+                params[key + "/std"] = np.broadcast_to(self.std[key], value.shape)
+        return params
+
+    def predict(self, obs : AgentObs, state = None, episode_start = None, deterministic : bool = False) -> tuple[AgentAction, None]:
+        single = not self._is_batched(obs)
+        if single:
+            obs = obs[None] if isinstance(obs, np.ndarray) else {key : np.asarray(value)[None] for key, value in obs.items()}
+        params = self.distribution_params(obs)
+        if deterministic:
+            actions = self._most_likely(params)
+        else:
+            from action_cache import sample_actions
+            actions = sample_actions(params, self.action_space, self.rng)
+        if single:
+            actions = {key : value[0] for key, value in actions.items()}
+        return actions, None
+
+    def _most_likely(self, params : dict[str, np.ndarray]) -> AgentAction:
+        actions = {}
+        for key, space in self.action_space.spaces.items():
+            if isinstance(space, spaces.Discrete):
+                actions[key] = params[key + "/logits"].argmax(axis=1) + space.start
+            elif isinstance(space, spaces.MultiDiscrete):
+                tokens = np.stack([params[f"{key}/logits/{i}"].argmax(axis=1) for i in range(space.nvec.size)], axis=1)
+                actions[key] = tokens.reshape((-1, ) + space.shape)
+            else:
+                mean = params[key + "/mean"].reshape((-1, ) + space.shape)
+                actions[key] = np.clip(mean, space.low, space.high)
+        return actions
+
+    def _is_batched(self, obs : AgentObs) -> bool:
+        if isinstance(obs, np.ndarray):
+            return obs.ndim > len(self.observation_space.shape)
+        key, value = next(iter(obs.items()))
+        return np.ndim(value) > len(self.observation_space.spaces[key].shape)
+
+    def verify(self, policy, n_samples : int = 32, seed : int = 0):
+        """Raises ValueError unless the most likely actions match policy.predict's on sampled observations"""
+        observation_space = copy.deepcopy(self.observation_space)
+        observation_space.seed(seed)
+        obs = stack_obs([observation_space.sample() for _ in range(n_samples)])
+        expected, _ = policy.predict(obs, deterministic=True)
+        actions, _ = self.predict(obs, deterministic=True)
+        for key, value in dict(expected).items():
+            if not np.allclose(np.asarray(value, dtype=np.float64), actions[key], atol=1e-4):
+                raise ValueError(f"the exported policy's {key} actions don't match {type(policy).__name__}'s")
+
+    @classmethod
+    def from_policy(cls, policy, verify : bool = True, seed : int = None) -> "NumpyPolicy":
+        """Export of an SB3 policy (or algorithm), checked against it unless verify is False"""
+        from opponents import get_policy_weights
+
+        policy = getattr(policy, "policy", policy)
+        activation = getattr(policy, "activation_fn", None)
+        activation = "Tanh" if activation is None else activation.__name__
+        numpy_policy = cls(get_policy_weights(policy), policy.observation_space, policy.action_space, activation, seed)
+        if verify:
+            numpy_policy.verify(policy)
+        return numpy_policy
+
+class NumpyPolicyFactory:
+    """Wraps an OpponentPolicyFactory: the policy it builds is exported to a NumpyPolicy.
+
+    Call export() in the main process and the factory carries the export, processes it is shipped
+    to copy it and never import torch. Snapshots load into the copies (opponents.load_policy_weights).
+    """
+
+    def __init__(self, policy_factory):
+        self.policy_factory = policy_factory
+        self.policy = None
+
+    def export(self, observation_space, action_space) -> NumpyPolicy:
+        self.policy = NumpyPolicy.from_policy(self.policy_factory(observation_space, action_space))
+        return self.policy
+
+    def __call__(self, observation_space, action_space) -> NumpyPolicy:
+        if self.policy is None:
+            return NumpyPolicy.from_policy(self.policy_factory(observation_space, action_space))
+        assert observation_space == self.policy.observation_space and action_space == self.policy.action_space, \
+            "exported for other spaces"
+        return copy.deepcopy(self.policy)
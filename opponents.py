@@ -0,0 +1,150 @@
+import copy
+import numpy as np
+import random as rnd
+from collections import OrderedDict
+
+# Weights travel between processes as plain numpy arrays, which pickle much
+# faster and smaller than a full SB3 model
+
+def get_policy_weights(policy) -> dict[str, np.ndarray]:
+    # copies, so later optimizer steps on the live policy don't leak into the snapshot
+    return {key : value.detach().cpu().numpy().copy() for key, value in policy.state_dict().items()}
+
+WEIGHT_DTYPES = ["float32", "float16", "int8"]
+SCALE_SUFFIX = ":scale"
+
+def compress_weights(weights : dict[str, np.ndarray], weight_dtype : str = "float32") -> dict[str, np.ndarray]:
+    """Weights to keep and ship: float16 copies, or int8 matrices with a float32 scale per row
+    under key + ":scale" (vectors stay as they are). float32 returns them unchanged.
+    """
+    assert weight_dtype in WEIGHT_DTYPES
+    if weight_dtype == "float32":
+        return weights
+    compressed = {}
+    for key, value in weights.items():
+        if value.dtype.kind != "f" or key.endswith(SCALE_SUFFIX): # already compressed
+            compressed[key] = value
+        elif weight_dtype == "float16":
+            compressed[key] = value.astype(np.float16)
+        elif value.ndim == 2:
+            scale = np.abs(value).max(axis=1, keepdims=True) / 127
+            scale[scale == 0] = 1
+            compressed[key] = np.rint(value / scale).astype(np.int8)
+            compressed[key + SCALE_SUFFIX] = scale.astype(np.float32)
+        else:
+            compressed[key] = value
+    return compressed
+
+def decompress_weights(weights : dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """float32 weights back from compress_weights, plain weights pass through"""
+    decompressed = {}
+    for key, value in weights.items():
+        if key.endswith(SCALE_SUFFIX):
+            continue
+        if key + SCALE_SUFFIX in weights:
+            value = value.astype(np.float32) * weights[key + SCALE_SUFFIX]
+        elif value.dtype == np.float16:
+            value = value.astype(np.float32)
+        decompressed[key] = value
+    return decompressed
+
+def load_policy_weights(policy, weights : dict[str, np.ndarray]) -> None:
+    # accepts a whole SB3 algorithm as well as its policy, and compressed weights
+    policy = getattr(policy, "policy", policy)
+    weights = decompress_weights(weights)
+    if hasattr(policy, "load_weights"): # a NumpyPolicy takes the arrays as they are
+        policy.load_weights(weights)
+        return
+    import torch
+
+    policy.load_state_dict({key : torch.as_tensor(value) for key, value in weights.items()})
+
+def get_weights_nbytes(weights : dict[str, np.ndarray]) -> int:
+    return sum(value.nbytes for value in weights.values())
+
+def same_weights(a : dict[str, np.ndarray], b : dict[str, np.ndarray]) -> bool:
+    return a.keys() == b.keys() and all(np.array_equal(a[key], b[key]) for key in a)
+
+class OpponentPool:
+    """Recent policy snapshots kept in memory as CPU weight copies.
+
+    Holds at most `capacity` snapshots (and at most `max_bytes` of weights if given),
+    evicting the least recently used one. The newest snapshot is never evicted.
+    """
+
+    def __init__(self, capacity : int = 8, max_bytes : int = None):
+        assert capacity > 0
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.snapshots : OrderedDict[int, dict[str, np.ndarray]] = OrderedDict()
+        self.latest_id = None
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __contains__(self, snapshot_id):
+        return snapshot_id in self.snapshots
+
+    def add(self, weights : dict[str, np.ndarray], snapshot_id : int = None) -> int:
+        if snapshot_id is None:
+            snapshot_id = 0 if self.latest_id is None else self.latest_id + 1
+
+        if snapshot_id in self.snapshots:
+            self.nbytes -= get_weights_nbytes(self.snapshots.pop(snapshot_id))
+        self.snapshots[snapshot_id] = weights
+        self.nbytes += get_weights_nbytes(weights)
+        self.latest_id = snapshot_id
+
+        self._evict()
+        return snapshot_id
+
+    def get(self, snapshot_id : int) -> dict[str, np.ndarray]:
+        self.snapshots.move_to_end(snapshot_id)
+        return self.snapshots[snapshot_id]
+
+    def sample(self, rng = rnd) -> int:
+        return rng.choice(list(self.snapshots))
+
+    def _evict(self):
+        while len(self.snapshots) > 1 and (len(self.snapshots) > self.capacity
+                or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            for snapshot_id in self.snapshots:
+                if snapshot_id != self.latest_id:
+                    self.nbytes -= get_weights_nbytes(self.snapshots.pop(snapshot_id))
+                    break
+
+class OpponentSlots:
+    """Policy instances the opponents run on, reloaded in place when snapshots are swapped"""
+
+    def __init__(self, template):
+        # the template is only copied, never loaded into, it may be a live model
+        self.template = template
+        self.policies = []
+        self.loaded_ids = []
+        self.loaded_weights = [] # the pool's weights each slot was loaded with
+
+    def load(self, snapshot_ids : list[int], pool : OpponentPool) -> dict[int, object]:
+        # one policy per distinct snapshot, reusing whatever is already loaded
+        wanted = list(dict.fromkeys(snapshot_ids))
+        while len(self.policies) < len(wanted):
+            self.policies.append(copy.deepcopy(self.template))
+            self.loaded_ids.append(None)
+            self.loaded_weights.append(None)
+        for slot, snapshot_id in enumerate(self.loaded_ids):
+            if snapshot_id in wanted and pool.snapshots[snapshot_id] is not self.loaded_weights[slot]:
+                self.loaded_ids[slot] = None # the id was added again, with other weights
+
+        free = [i for i, loaded_id in enumerate(self.loaded_ids) if loaded_id not in wanted]
+        models = {}
+        for snapshot_id in wanted:
+            if snapshot_id in self.loaded_ids:
+                slot = self.loaded_ids.index(snapshot_id)
+                pool.get(snapshot_id) # refresh recency
+            else:
+                slot = free.pop(0)
+                self.loaded_weights[slot] = pool.get(snapshot_id)
+                load_policy_weights(self.policies[slot], self.loaded_weights[slot])
+                self.loaded_ids[slot] = snapshot_id
+            models[snapshot_id] = self.policies[slot]
+        return models
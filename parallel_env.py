@@ -0,0 +1,78 @@
+from gymnasium import spaces
+
+from env import make_action_space, make_observation_space
+from game_env import GameEnv
+from utils import AgentAction, AgentObs
+
+def agent_name(agent_id : int) -> str:
+    return "agent_" + str(agent_id)
+
+class ParallelGameEnv:
+    """PettingZoo parallel style interface where every agent is learning.
+
+    All agents act at once and every agent gets its own reward, so one simulated step
+    yields n_agents transitions. Observations are the agents' own buffers and are
+    overwritten on the next step, copy them if they need to be kept.
+    """
+    metadata = {"name" : "unbabel_parallel_v0", "render_modes" : ["human", "rgb_array"]}
+
+    def __init__(self, env : GameEnv):
+        self.env = env
+        self.render_mode = env.render_mode
+        self.possible_agents = [agent_name(i + 1) for i in range(env.n_agents)]
+        self.agent_ids = {name : i + 1 for i, name in enumerate(self.possible_agents)}
+        self.agents = []
+        self.episode_reward = 0
+
+        self._observation_space = make_observation_space(env)
+        self._action_space = make_action_space(env)
+
+        # no agent has a model, so every one of them gets the learning agent's rewards
+        env.init_instances(None)
+
+    def observation_space(self, agent : str) -> spaces.Space:
+        return self._observation_space
+
+    def action_space(self, agent : str) -> spaces.Dict:
+        return self._action_space
+
+    def reset(self, seed : int = None, options : dict = None):
+        self.env.reset(seed)
+        self.agents = list(self.possible_agents)
+        self.episode_reward = 0
+        return self._get_observations(), {name : {} for name in self.agents}
+
+    def step(self, actions : dict[str, AgentAction]):
+        rewards = self.env.resolve_actions({self.agent_ids[name] : action for name, action in actions.items()})
+        self.env.step_ += 1
+
+        observations = self._get_observations()
+        self.episode_reward += sum(rewards.values())
+        rewards = {agent_name(agent_id) : reward for agent_id, reward in rewards.items()}
+        terminated = self.env.solved
+        truncated = not terminated and self.env.step_ >= self.env.max_steps
+        terminations = {name : terminated for name in self.agents}
+        truncations = {name : truncated for name in self.agents}
+        infos = {name : {} for name in self.agents}
+
+        if terminated or truncated:
+            episode_stats = self.env.stats.end_episode(
+                total_reward = self.episode_reward,
+                mean_reward = self.episode_reward / len(self.agents),
+                length = self.env.step_,
+                solved = float(terminated))
+            for name in self.agents:
+                infos[name]["episode_stats"] = episode_stats
+            self.agents = []
+
+        return observations, rewards, terminations, truncations, infos
+
+    def _get_observations(self) -> dict[str, AgentObs]:
+        env_info = self.env.env_info
+        return {agent_name(agent.id) : agent.process_obs(env_info) for agent in self.env.agents}
+
+    def render(self):
+        return self.env.render()
+
+    def close(self):
+        self.env.close()
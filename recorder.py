@@ -0,0 +1,240 @@
+"""Records GameEnv episodes to a compact columnar log, so nothing has to be drawn during training.
+
+A recording is a directory with one raw binary file per column, rows appended in chunks and
+read back with np.memmap, plus meta.json with the env config, dtypes, shapes and row counts.
+Step columns get one row per env step and one for the state right after reset (action -1).
+Episode columns are the index: first row, number of steps and what stays fixed in an episode.
+replay.py renders recordings.
+"""
+import os
+import json
+import numpy as np
+
+from world import NONE
+from utils import unpack_action
+from speech import SPEECH_SIZE
+
+META_FILE = "meta.json"
+SPEECH_SCALE = 127 # int8 speech holds round(speech * SPEECH_SCALE)
+RECORDED_CONFIG = ["max_steps", "n_colors", "n_agents", "n_pieces", "n_letters", "grid_size",
+                   "cell_size", "listen_history_size", "vision_grid_size", "hearing_radius",
+                   "speech_mode", "speech_vocab_size", "speech_length"]
+
+def speech_column(game_env, quantize_speech = True) -> tuple:
+    # tokens are recorded as they are, quantize_speech only applies to continuous speech
+    if game_env.speech_mode == "tokens":
+        return (np.dtype(game_env.speech_dtype).name, (game_env.n_agents, game_env.speech_length))
+    return ("int8" if quantize_speech else "float32", (game_env.n_agents, SPEECH_SIZE))
+
+def step_columns(n_agents, n_pieces, speech : tuple) -> dict:
+    return {
+        "agent_pos" : ("int16", (n_agents, 2)),
+        "agent_hand" : ("int16", (n_agents, )),
+        "agent_offered" : ("int16", (n_agents, )),
+        "agent_offer_from" : ("int16", (n_agents, )),
+        "piece_pos" : ("int16", (n_pieces, 2)),
+        "piece_holder" : ("int16", (n_pieces, )),
+        "piece_alive" : ("bool", (n_pieces, )),
+        "action" : ("int8", (n_agents, )),
+        "dx" : ("int8", (n_agents, )),
+        "dy" : ("int8", (n_agents, )),
+        "target" : ("int16", (n_agents, )),
+        "reward" : ("float32", (n_agents, )),
+        "speech" : speech,
+    }
+
+def episode_columns(n_agents, n_pieces) -> dict:
+    return {
+        "start" : ("int64", ()),
+        "length" : ("int64", ()),
+        "learning_agent_id" : ("int16", ()),
+        "agent_color" : ("int8", (n_agents, )),
+        "agent_target" : ("int16", (n_agents, )),
+        "piece_color" : ("int8", (n_pieces, )),
+        "piece_letter" : ("int8", (n_pieces, )),
+    }
+
+def column_path(path, table, name):
+    return os.path.join(path, f"{table}.{name}.bin")
+
+class ColumnTable:
+    """Fixed-size rows over a set of columns, buffered in memory and appended to disk a chunk at a time.
+
+    on_chunk is called after append() wrote a full chunk.
+    """
+
+    def __init__(self, path : str, table : str, columns : dict, n_rows : int = 0, chunk_rows : int = 1024,
+                 on_chunk = None):
+        self.path = path
+        self.table = table
+        self.columns = columns
+        self.n_rows = n_rows # rows on disk
+        self.chunk_rows = chunk_rows
+        self.on_chunk = on_chunk
+        self.buffers = {name : np.zeros((chunk_rows, ) + shape, dtype=dtype) for name, (dtype, shape) in columns.items()}
+        self.n_buffered = 0
+
+        # rows past n_rows are left over from a run that died before updating meta.json
+        for name, (dtype, shape) in columns.items():
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+            with open(column_path(path, table, name), "ab") as f:
+                f.truncate(n_rows * row_bytes)
+
+    def __len__(self):
+        return self.n_rows + self.n_buffered
+
+    def append(self) -> dict:
+        """Buffers of the next row, to be filled in place"""
+        if self.n_buffered == self.chunk_rows:
+            self.flush()
+            if self.on_chunk is not None:
+                self.on_chunk()
+        row = {name : buffer[self.n_buffered, ...] for name, buffer in self.buffers.items()}
+        self.n_buffered += 1
+        return row
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        for name, buffer in self.buffers.items():
+            with open(column_path(self.path, self.table, name), "ab") as f:
+                f.write(buffer[:self.n_buffered].tobytes())
+        self.n_rows += self.n_buffered
+        self.n_buffered = 0
+
+def open_columns(path, table, columns, n_rows) -> dict:
+    arrays = {}
+    for name, (dtype, shape) in columns.items():
+        if n_rows == 0:
+            arrays[name] = np.zeros((0, ) + tuple(shape), dtype=dtype)
+        else:
+            arrays[name] = np.memmap(column_path(path, table, name), dtype=dtype, mode="r", shape=(n_rows, ) + tuple(shape))
+    return arrays
+
+class EpisodeRecorder:
+    """Appends the episodes of a GameEnv to the recording at `path`, see GameEnv.record().
+
+    An existing recording with the same config is continued. Rows are written, and meta.json
+    updated, every `chunk_steps` steps and on flush() / close(): a run that dies loses at most
+    the last chunk.
+    """
+
+    def __init__(self, path : str, game_env, quantize_speech : bool = True, chunk_steps : int = 1024):
+        self.path = path
+        self.config = {key : getattr(game_env, key) for key in RECORDED_CONFIG}
+        self.quantize_speech = quantize_speech and game_env.speech_mode == "continuous"
+        n_agents, n_pieces = game_env.n_agents, game_env.n_pieces
+
+        n_steps = n_episodes = 0
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["config"] != self.config or meta["quantize_speech"] != self.quantize_speech:
+                raise ValueError(f"{path} was recorded with a different config")
+            n_steps, n_episodes = meta["n_steps"], meta["n_episodes"]
+        os.makedirs(path, exist_ok=True)
+
+        speech = speech_column(game_env, self.quantize_speech)
+        self.steps = ColumnTable(path, "steps", step_columns(n_agents, n_pieces, speech), n_steps, chunk_steps, self.flush)
+        self.episodes = ColumnTable(path, "episodes", episode_columns(n_agents, n_pieces), n_episodes, 64, self.flush)
+        self.episode = None # index row of the episode being recorded
+
+    def begin_episode(self, game_env):
+        self.end_episode()
+        world = game_env.world
+        self.episode = {
+            "start" : len(self.steps),
+            "learning_agent_id" : game_env.learning_agent_id,
+            "agent_color" : world.agent_color.copy(),
+            "agent_target" : world.agent_target.copy(),
+            "piece_color" : world.piece_color.copy(),
+            "piece_letter" : world.piece_letter.copy()
+        }
+        row = self._append_state(game_env)
+        row["action"].fill(NONE)
+
+    def record_step(self, game_env, actions : dict, rewards : dict):
+        if self.episode is None:
+            return
+        row = self._append_state(game_env)
+        for agent in game_env.agents:
+            discrete_action, dx, dy, agent_ind, _ = unpack_action(actions[agent.id])
+            row["action"][agent.ind] = discrete_action
+            row["dx"][agent.ind] = dx
+            row["dy"][agent.ind] = dy
+            row["target"][agent.ind] = agent_ind
+            row["reward"][agent.ind] = rewards[agent.id]
+
+        # what every agent said this turn
+        utterances = game_env.world.speech.utterances.reshape(game_env.n_agents, -1)
+        if self.quantize_speech:
+            # saturates rather than wrapping around in int8, callers may step with any speech
+            np.rint(np.clip(utterances, -1, 1) * SPEECH_SCALE, out=row["speech"], casting="unsafe")
+        else:
+            row["speech"][...] = utterances
+
+    def _append_state(self, game_env) -> dict:
+        world = game_env.world
+        row = self.steps.append()
+        for key in ("agent_pos", "agent_hand", "agent_offered", "agent_offer_from", "piece_pos", "piece_holder", "piece_alive"):
+            row[key][...] = getattr(world, key)
+        for key in ("dx", "dy", "target", "reward", "speech"):
+            row[key].fill(0)
+        return row
+
+    def end_episode(self):
+        if self.episode is None:
+            return
+        self.episode["length"] = len(self.steps) - self.episode["start"] - 1
+        row = self.episodes.append()
+        for key, value in self.episode.items():
+            row[key][...] = value
+        self.episode = None
+
+    def flush(self):
+        # both tables, an episode row is only indexed once its steps are on disk too
+        self.steps.flush()
+        self.episodes.flush()
+        meta = {
+            "config" : self.config,
+            "quantize_speech" : self.quantize_speech,
+            "speech_scale" : SPEECH_SCALE,
+            "n_steps" : self.steps.n_rows,
+            "n_episodes" : self.episodes.n_rows,
+            "steps" : self.steps.columns,
+            "episodes" : self.episodes.columns
+        }
+        # meta.json is what readers trust, so it is only replaced once the rows are on disk
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def close(self):
+        self.end_episode()
+        self.flush()
+
+class Recording:
+    """Read-only view of a recording, columns are memory-mapped"""
+
+    def __init__(self, path : str):
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.config = self.meta["config"]
+        self.steps = open_columns(path, "steps", self.meta["steps"], self.meta["n_steps"])
+        self.episodes = open_columns(path, "episodes", self.meta["episodes"], self.meta["n_episodes"])
+
+    def __len__(self):
+        return self.meta["n_episodes"]
+
+    def episode(self, i : int) -> dict:
+        """Episode columns of episode i, and its step columns with one row per frame (length + 1 rows)"""
+        episode = {name : column[i] for name, column in self.episodes.items()}
+        start, n_frames = int(episode["start"]), int(episode["length"]) + 1
+        for name, column in self.steps.items():
+            episode[name] = column[start : start + n_frames]
+        if self.meta["quantize_speech"]:
+            episode["speech"] = episode["speech"].astype(np.float32) / self.meta["speech_scale"]
+        return episode
@@ -0,0 +1,93 @@
+"""Replays recorded episodes (see recorder.py) with GameEnv's drawing code.
+
+    python replay.py recordings/env_0 --list
+    python replay.py recordings/env_0 --episode 3                      # in a window
+    python replay.py recordings/env_0 --episode 3 --output ep3.mp4     # needs imageio (+ imageio-ffmpeg for mp4)
+    python replay.py recordings/env_0 --episode 3 --frames-dir frames  # one PNG per step
+"""
+import os
+import argparse
+import numpy as np
+
+from game_env import GameEnv
+from recorder import Recording
+
+def make_replay_env(recording : Recording, render_mode : str) -> GameEnv:
+    game_env = GameEnv(**recording.config, render_mode=render_mode)
+    game_env.init_instances(None)
+    return game_env
+
+def load_frame(game_env : GameEnv, episode : dict, frame : int):
+    # only what draw() looks at, the occupancy grids are left alone
+    world = game_env.world
+    world.agent_color[:] = episode["agent_color"]
+    world.agent_target[:] = episode["agent_target"]
+    world.piece_color[:] = episode["piece_color"]
+    world.piece_letter[:] = episode["piece_letter"]
+    for key in ("agent_pos", "agent_hand", "agent_offered", "agent_offer_from", "piece_pos", "piece_holder", "piece_alive"):
+        getattr(world, key)[...] = episode[key][frame]
+    game_env.pieces[:] = [game_env.all_pieces[i] for i in np.flatnonzero(world.piece_alive)]
+
+def render_episode(game_env : GameEnv, episode : dict):
+    """Yields what render() returns for every frame of the episode"""
+    for frame in range(len(episode["agent_pos"])):
+        load_frame(game_env, episode, frame)
+        yield game_env.render()
+
+def export_video(recording : Recording, episode : int, output : str, fps : int):
+    try:
+        import imageio.v2 as imageio
+    except ImportError:
+        raise ImportError("exporting video needs imageio (pip install imageio imageio-ffmpeg), "
+                          "--frames-dir writes PNG frames without it")
+
+    game_env = make_replay_env(recording, "rgb_array")
+    imageio.mimwrite(output, list(render_episode(game_env, recording.episode(episode))), fps=fps)
+    game_env.close()
+
+def export_frames(recording : Recording, episode : int, frames_dir : str):
+    import pygame
+
+    os.makedirs(frames_dir, exist_ok=True)
+    game_env = make_replay_env(recording, "rgb_array")
+    for frame, _ in enumerate(render_episode(game_env, recording.episode(episode))):
+        pygame.image.save(game_env.screen, os.path.join(frames_dir, f"{frame:05d}.png"))
+    game_env.close()
+
+def show(recording : Recording, episode : int, fps : int):
+    game_env = make_replay_env(recording, "human")
+    game_env.fps = fps
+    for _ in render_episode(game_env, recording.episode(episode)):
+        pass
+    game_env.close()
+
+def print_episodes(recording : Recording):
+    for i in range(len(recording)):
+        episode = recording.episode(i)
+        rewards = episode["reward"].sum(axis=0)
+        print(f"episode {i:>5}  steps {int(episode['length']):>5}  learning agent {int(episode['learning_agent_id'])}"
+              f"  pieces found {int((~episode['piece_alive'][-1]).sum())}  total reward {rewards.sum():.1f}")
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--episode", type=int, default=0, help="negative values count from the end")
+    parser.add_argument("--fps", type=int, default=5)
+    parser.add_argument("--list", action="store_true", help="list the recorded episodes and exit")
+    parser.add_argument("--output", default=None, help="write a video (any format imageio supports)")
+    parser.add_argument("--frames-dir", default=None, help="write one PNG per frame to this directory")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    recording = Recording(args.recording)
+    episode = args.episode % len(recording)
+
+    if args.list:
+        print_episodes(recording)
+    elif args.output:
+        export_video(recording, episode, args.output, args.fps)
+    elif args.frames_dir:
+        export_frames(recording, episode, args.frames_dir)
+    else:
+        show(recording, episode, args.fps)
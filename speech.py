@@ -0,0 +1,93 @@
+import numpy as np
+
+SPEECH_SIZE = 120
+SPEECH_MODES = ["continuous", "tokens"]
+
+def speech_format(speech_mode : str = "continuous", vocab_size : int = 16, length : int = 8) -> tuple[tuple, np.dtype]:
+    """Shape and dtype of an utterance, the shape of a speech observation.
+
+    continuous: a (1, 120) float vector in [-1, 1]. tokens: `length` tokens out of
+    1..vocab_size, 0 is silence, in the smallest unsigned int that holds them
+    """
+    assert speech_mode in SPEECH_MODES
+    if speech_mode == "tokens":
+        assert vocab_size > 0 and length > 0
+        return (length, ), np.min_scalar_type(vocab_size)
+    return (1, SPEECH_SIZE), np.dtype(np.float32)
+
+def random_speech(rng : np.random.Generator, batch_shape : tuple, speech_mode : str = "continuous",
+                  vocab_size : int = 16, length : int = 8) -> np.ndarray:
+    shape, dtype = speech_format(speech_mode, vocab_size, length)
+    if speech_mode == "tokens":
+        return rng.integers(0, vocab_size + 1, batch_shape + shape).astype(dtype)
+    return rng.uniform(-1, 1, batch_shape + shape).astype(dtype)
+
+class SpeechChannel:
+    """What every agent of a game said this turn and the utterances each of them heard.
+
+    histories is a ring buffer per agent: head[i] is agent i's oldest slot, where the next
+    utterance it hears is written, so hearing never shifts the older ones.
+    Utterances are `shape` arrays of `dtype`, see speech_format.
+    """
+
+    def __init__(self, n_agents : int, history_size : int, shape : tuple = (1, SPEECH_SIZE), dtype = np.float32):
+        self.n_agents = n_agents
+        self.history_size = history_size
+        self.utterances = np.zeros((n_agents, ) + shape, dtype=dtype)
+        self.speaking = np.zeros(n_agents, dtype=bool) # said something this turn
+        self.histories = np.zeros((n_agents, history_size) + shape, dtype=dtype)
+        self.head = np.zeros(n_agents, dtype=np.int64)
+        self.heard = np.zeros(n_agents, dtype=np.int64) # utterances heard so far, changes on every hear
+
+    def clear(self):
+        self.utterances.fill(0)
+        self.speaking.fill(False)
+        self.histories.fill(0)
+        self.head.fill(0)
+        self.heard.fill(0)
+
+    def say(self, agent : int, speech):
+        self.utterances[agent] = speech
+        self.speaking[agent] = self.utterances[agent].any()
+
+    def silence(self, agent : int):
+        # a silent agent's utterance is all zeros already
+        if self.speaking[agent]:
+            self.utterances[agent].fill(0)
+            self.speaking[agent] = False
+
+    def nearest_speakers(self, agent_pos : np.ndarray, radius : int):
+        """(listeners, speakers): for every agent with a speaker within radius, the nearest one, lowest index on ties"""
+        speakers = np.flatnonzero(self.speaking)
+        if len(speakers) == 0 or self.history_size == 0:
+            return speakers[:0], speakers[:0]
+
+        dist2 = ((agent_pos[:, None, :] - agent_pos[None, speakers, :]) ** 2).sum(-1) # (listener, speaker)
+        audible = dist2 <= radius ** 2
+        audible[speakers, np.arange(len(speakers))] = False # nobody hears themselves
+        keys = np.where(audible, dist2 * self.n_agents + speakers, np.iinfo(np.int64).max)
+        listeners = np.flatnonzero(audible.any(axis=1))
+        return listeners, speakers[np.argmin(keys[listeners], axis=1)]
+
+    def hear(self, listeners : np.ndarray, speakers : np.ndarray):
+        # the new utterance replaces each listener's oldest one
+        self.histories[listeners, self.head[listeners]] = self.utterances[speakers]
+        self.head[listeners] = (self.head[listeners] + 1) % self.history_size
+        self.heard[listeners] += 1
+
+    def hear_nearest(self, agent_pos : np.ndarray, radius : int):
+        self.hear(*self.nearest_speakers(agent_pos, radius))
+
+    def ordered_history(self, agent : int = None) -> np.ndarray:
+        """Copy of the histories (or of one agent's), oldest utterance first"""
+        order = (self.head[:, None] + np.arange(self.history_size)) % max(self.history_size, 1)
+        order = order.reshape(order.shape + (1, ) * (self.histories.ndim - 2))
+        histories = np.take_along_axis(self.histories, order, axis=1)
+        return histories if agent is None else histories[agent]
+
+    def get_state(self) -> dict:
+        return {key : getattr(self, key).copy() for key in ("utterances", "speaking", "histories", "head", "heard")}
+
+    def set_state(self, state : dict):
+        for key, value in state.items():
+            getattr(self, key)[...] = value
@@ -0,0 +1,12 @@
+import pytest
+
+from batched_env import check_against_reference
+
+@pytest.mark.parametrize("config", [
+    {},
+    {"flat_obs" : True},
+    {"speech_mode" : "tokens"},
+    {"grid_size" : 4, "vision_grid_size" : 3, "hearing_radius" : 1},
+], ids=["dict", "flat", "tokens", "small_vision"])
+def test_matches_the_reference_rules(config):
+    assert check_against_reference(n_steps=500, **config) == 500
@@ -0,0 +1,53 @@
+import os
+import time
+import numpy as np
+import pytest
+from stable_baselines3 import PPO
+
+from checkpoints import Checkpoint, CheckpointManager
+
+def test_rotation_and_latest_step(tmp_path, monkeypatch):
+    model = PPO("MlpPolicy", "CartPole-v1", n_steps=64, batch_size=64)
+    checkpoints = CheckpointManager(str(tmp_path), prefix="run", keep_last=3, keep_every=4)
+    assert checkpoints.latest_step() is None and checkpoints.latest_path() is None
+
+    # slow writes: save() waits for the previous one, so at most one snapshot is waiting in memory
+    write, written = Checkpoint.write, []
+    def slow_write(checkpoint, path):
+        time.sleep(0.02)
+        write(checkpoint, path)
+        written.append(checkpoint.step)
+    monkeypatch.setattr(Checkpoint, "write", slow_write)
+
+    for step in range(11):
+        checkpoints.save(model, step)
+        assert written == list(range(step))
+    checkpoints.close()
+    assert written == list(range(11))
+
+    assert checkpoints.kept(range(11)) == {0, 4, 8, 9, 10}
+    assert checkpoints.steps() == [0, 4, 8, 9, 10]
+    assert sorted(os.listdir(tmp_path)) == sorted(f"run_{step}.zip" for step in (0, 4, 8, 9, 10)) # no .tmp left
+    assert checkpoints.latest_step() == 10 and checkpoints.latest_path() == str(tmp_path / "run_10.zip")
+
+    loaded = PPO.load(checkpoints.latest_path())
+    for key, value in model.policy.state_dict().items():
+        assert np.array_equal(loaded.policy.state_dict()[key].numpy(), value.numpy())
+
+def test_failed_write_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    from stable_baselines3.common import save_util
+
+    model = PPO("MlpPolicy", "CartPole-v1", n_steps=64, batch_size=64)
+    checkpoints = CheckpointManager(str(tmp_path), prefix="run")
+    checkpoints.save(model, 0)
+    checkpoints.wait()
+    saved = (tmp_path / "run_0.zip").read_bytes()
+
+    def failing_save(f, **kwargs):
+        f.write(b"partial")
+        raise OSError("disk full")
+    monkeypatch.setattr(save_util, "save_to_zip_file", failing_save)
+    checkpoints.save(model, 0)
+    with pytest.raises(OSError, match="disk full"):
+        checkpoints.close()
+    assert (tmp_path / "run_0.zip").read_bytes() == saved
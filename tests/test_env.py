@@ -0,0 +1,117 @@
+import time
+import numpy as np
+from gymnasium.utils.env_checker import check_env
+from stable_baselines3.common.vec_env import DummyVecEnv
+
+from benchmark import RandomModel
+from env import CustomEnv
+from game_env import GameEnv
+from utils import copy_obs
+
+GAME_CONFIG = dict(max_steps=256, n_colors=3, n_agents=9, n_pieces=9, n_letters=2, grid_size=12)
+
+def make_env(**config) -> CustomEnv:
+    game_env = GameEnv(**dict(GAME_CONFIG, **config))
+    game_env.init_instances(RandomModel(game_env.n_agents - 1, game_env.speech_shape))
+    return CustomEnv(game_env)
+
+def same_obs(a, b) -> bool:
+    return all(np.array_equal(a[key], b[key]) for key in a)
+
+def test_gymnasium_env_checker():
+    check_env(make_env(), skip_render_check=True)
+
+def test_truncation_keeps_terminal_observation():
+    venv = DummyVecEnv([lambda : make_env(max_steps=5)])
+    venv.seed(0)
+    venv.reset()
+    for _ in range(5):
+        obs, _, dones, infos = venv.step([venv.action_space.sample()])
+    assert dones[0] and infos[0]["TimeLimit.truncated"]
+
+    terminal = infos[0]["terminal_observation"]
+    kept = copy_obs(terminal)
+    assert not same_obs(terminal, {key : value[0] for key, value in obs.items()})
+    venv.step([venv.action_space.sample()])
+    assert same_obs(terminal, kept)
+
+class SlowPolicy:
+    """Deterministic stand-in whose every action is its weight w, slow enough to still be running when swapped"""
+
+    def __init__(self, n_agents : int, speech_shape : tuple):
+        self.n_agents = n_agents
+        self.speech_shape = speech_shape
+        self.w = 0
+
+    def load_weights(self, weights : dict[str, np.ndarray]):
+        self.w = int(weights["w"])
+
+    def predict(self, obs, state = None, episode_start = None, deterministic = False):
+        time.sleep(0.05)
+        n = len(obs["eyes"])
+        return {"action" : np.full(n, self.w), "dx" : np.ones(n, dtype=np.int64), "dy" : np.ones(n, dtype=np.int64),
+                "agent" : np.zeros(n, dtype=np.int64),
+                "speech" : np.zeros((n, ) + self.speech_shape, dtype=np.float32)}, None
+
+def test_swap_waits_for_the_prefetch():
+    game_env = GameEnv(**GAME_CONFIG, pipeline_opponents=True, opponent_deterministic=True, opponent_action_cache=64)
+    game_env.init_instances(SlowPolicy(game_env.n_agents - 1, game_env.speech_shape))
+    game_env.push_opponent_snapshot({"w" : np.array(0)}, snapshot_id=0)
+    # snapshot 0's prefetch is running, snapshot 1 reuses its slot policy
+    game_env.push_opponent_snapshot({"w" : np.array(1)}, snapshot_id=1)
+    game_env.step({"action" : 0, "dx" : 1, "dy" : 1, "agent" : 0, "speech" : np.zeros(game_env.speech_shape, np.float32)})
+
+    # rows without a snapshot id come from the template policy, w = 0
+    cache = game_env.action_cache
+    for (snapshot_id, _), row in cache.rows.items():
+        assert cache.tables["action"][row] == (snapshot_id or 0)
+
+class UniformPolicy:
+    """Stochastic stand-in for the action cache: uniform logits, speech around 0"""
+
+    def __init__(self, action_space):
+        self.action_space = action_space
+
+    def distribution_params(self, obs) -> dict[str, np.ndarray]:
+        n = len(obs["eyes"])
+        params = {key + "/logits" : np.zeros((n, self.action_space[key].n)) for key in ("action", "agent", "dx", "dy")}
+        params["speech/mean"] = np.zeros((n, 120), dtype=np.float32)
+        params["speech/std"] = np.full((n, 120), 0.5, dtype=np.float32)
+        return params
+
+def play_positions(game_env : GameEnv, n_steps : int) -> list[np.ndarray]:
+    action = {"action" : 0, "dx" : 1, "dy" : 1, "agent" : 0, "speech" : np.zeros(game_env.speech_shape, np.float32)}
+    positions = []
+    for _ in range(n_steps):
+        game_env.step(action)
+        positions.append(game_env.world.agent_pos.copy())
+    return positions
+
+def test_sampled_cached_opponents_replay():
+    game_env = GameEnv(**GAME_CONFIG, opponent_action_cache=64)
+    game_env.init_instances(UniformPolicy(make_env().action_space))
+
+    game_env.reset(seed=1)
+    first = play_positions(game_env, 20)
+    game_env.reset(seed=1)
+    assert all(np.array_equal(a, b) for a, b in zip(first, play_positions(game_env, 20)))
+
+    state = game_env.get_state()
+    after = play_positions(game_env, 20)
+    game_env.set_state(state)
+    assert all(np.array_equal(a, b) for a, b in zip(after, play_positions(game_env, 20)))
+
+def test_branch_across_a_drop():
+    game_env = GameEnv(**GAME_CONFIG, opponent_action_cache=64, seed=3)
+    game_env.init_instances(UniformPolicy(make_env().action_space))
+    game_env.reset(seed=3)
+    play_positions(game_env, 10) # cell sets leave their initial order
+    game_env.world.give(game_env.pieces[0].ind, game_env.learning_agent.ind)
+
+    drop = {"action" : 5, "dx" : 1, "dy" : 1, "agent" : 0, "speech" : np.zeros(game_env.speech_shape, np.float32)}
+    state = game_env.get_state()
+    game_env.step(drop)
+    dropped = game_env.world.piece_pos.copy()
+    game_env.set_state(state)
+    game_env.step(drop)
+    assert np.array_equal(game_env.world.piece_pos, dropped)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from game_env import GameEnv
+from numpy_policy import NumpyPolicy
+from vec_env import make_inference_server
+
+from test_env import GAME_CONFIG, make_env, play_positions
+from test_numpy_policy import random_weights
+
+CONFIG = dict(GAME_CONFIG, opponent_deterministic=True)
+
+class PolicyFactory:
+    """Picklable factory for the server process"""
+
+    def __init__(self, weights : dict[str, np.ndarray]):
+        self.weights = weights
+
+    def __call__(self, observation_space, action_space) -> NumpyPolicy:
+        return NumpyPolicy(self.weights, observation_space, action_space)
+
+class RaisingPolicy:
+    def __init__(self, observation_space, action_space):
+        pass
+
+    def predict(self, obs, state = None, episode_start = None, deterministic = False):
+        raise ValueError("the forward pass failed")
+
+def test_server_plays_like_local_policies():
+    env = make_env()
+    first, second = (random_weights(env.observation_space, env.action_space, seed=seed) for seed in (1, 2))
+    server = make_inference_server(CONFIG, 2, PolicyFactory(first))
+    try:
+        server.push_weights(second, 0)
+        served, local = [], []
+        for slot in range(2):
+            game_env = GameEnv(**CONFIG, seed=slot)
+            client = server.client(slot)
+            game_env.connect_inference_server(client)
+            game_env.init_instances(client)
+            game_env.push_opponent_snapshot({}, 0)
+            served.append(game_env)
+
+            game_env = GameEnv(**CONFIG, seed=slot)
+            game_env.init_instances(NumpyPolicy(first, env.observation_space, env.action_space))
+            game_env.push_opponent_snapshot(second, 0)
+            local.append(game_env)
+
+        for served_env, local_env in zip(served, local):
+            served_env.reset(seed=3)
+            local_env.reset(seed=3)
+        # the slots take turns, so the server answers batches from both
+        for _ in range(20):
+            for served_env, local_env in zip(served, local):
+                assert np.array_equal(play_positions(served_env, 1)[0], play_positions(local_env, 1)[0])
+        for game_env in served:
+            game_env.inference_client.close()
+    finally:
+        server.close()
+
+def test_client_sees_server_failures():
+    server = make_inference_server(CONFIG, 1, RaisingPolicy, timeout=30)
+    client = server.client(0)
+    try:
+        with pytest.raises(RuntimeError, match="failed"):
+            client.predict(client.obs_slot(3), [None] * 3)
+    finally:
+        client.close()
+        server.close()
@@ -0,0 +1,54 @@
+import numpy as np
+from gymnasium import spaces
+
+from game_env import GameEnv
+from numpy_policy import NumpyPolicy, action_dims
+from opponents import compress_weights
+
+from test_env import GAME_CONFIG, make_env, play_positions
+
+def random_weights(observation_space, action_space, hidden : int = 16, seed : int = 0) -> dict[str, np.ndarray]:
+    """State dict of a one-layer MIMOPolicy-like policy"""
+    rng = np.random.default_rng(seed)
+    n_outputs = sum(action_dims(action_space).values())
+    n_boxes = sum(int(np.prod(space.shape)) for space in action_space.spaces.values() if isinstance(space, spaces.Box))
+    return {
+        "mlp_extractor.policy_net.0.weight" : rng.normal(0, 0.1, (hidden, spaces.flatdim(observation_space))).astype(np.float32),
+        "mlp_extractor.policy_net.0.bias" : rng.normal(0, 0.1, hidden).astype(np.float32),
+        "action_net.weight" : rng.normal(0, 1, (n_outputs, hidden)).astype(np.float32),
+        "action_net.bias" : np.zeros(n_outputs, dtype=np.float32),
+        "log_std" : np.full(n_boxes, -1, dtype=np.float32),
+    }
+
+def test_seeded_opponents_replay():
+    env = make_env()
+    weights = random_weights(env.observation_space, env.action_space)
+    game_env = GameEnv(**GAME_CONFIG)
+    game_env.init_instances(NumpyPolicy(weights, env.observation_space, env.action_space))
+    game_env.push_opponent_snapshot(weights, snapshot_id=0)
+
+    game_env.reset(seed=1)
+    first = play_positions(game_env, 20)
+    game_env.reset(seed=1)
+    assert all(np.array_equal(a, b) for a, b in zip(first, play_positions(game_env, 20)))
+
+    state = game_env.get_state()
+    after = play_positions(game_env, 20)
+    game_env.set_state(state)
+    assert all(np.array_equal(a, b) for a, b in zip(after, play_positions(game_env, 20)))
+
+def test_compressed_weights_load():
+    env = make_env(speech_mode="tokens")
+    weights = random_weights(env.observation_space, env.action_space)
+    policy = NumpyPolicy(weights, env.observation_space, env.action_space)
+    env.observation_space.seed(0)
+    obs = {key : np.stack([env.observation_space.sample()[key] for _ in range(64)]) for key in env.observation_space.spaces}
+    expected, _ = policy.predict(obs, deterministic=True)
+
+    for weight_dtype in ("float16", "int8"):
+        compressed = compress_weights(weights, weight_dtype)
+        assert sum(value.nbytes for value in compressed.values()) < sum(value.nbytes for value in weights.values()) / 1.9
+        assert compress_weights(compressed, weight_dtype).keys() == compressed.keys()
+        policy.load_weights(compressed)
+        actions, _ = policy.predict(obs, deterministic=True)
+        assert np.mean(actions["action"] == expected["action"]) > 0.9
@@ -0,0 +1,38 @@
+import numpy as np
+
+from evaluate import TournamentWorker
+from numpy_policy import NumpyPolicy
+from opponents import OpponentPool, OpponentSlots
+
+from test_env import GAME_CONFIG, make_env
+from test_numpy_policy import random_weights
+
+class WeightPolicy:
+    def __init__(self):
+        self.w = None
+
+    def load_weights(self, weights : dict[str, np.ndarray]):
+        self.w = int(weights["w"])
+
+def test_slots_reload_a_replaced_snapshot():
+    pool, slots = OpponentPool(4), OpponentSlots(WeightPolicy())
+    pool.add({"w" : np.array(1)}, 0)
+    pool.add({"w" : np.array(2)}, 1)
+    assert slots.load([0, 1], pool)[0].w == 1
+
+    pool.add({"w" : np.array(3)}, 0)
+    models = slots.load([0, 1], pool)
+    assert models[0].w == 3 and models[1].w == 2
+
+def test_tournament_worker_reloads_changed_weights():
+    env = make_env()
+    first, second = (random_weights(env.observation_space, env.action_space, seed=seed) for seed in (1, 2))
+    factory = lambda observation_space, action_space : NumpyPolicy(first, observation_space, action_space)
+    worker = TournamentWorker(dict(GAME_CONFIG, max_steps=4), factory)
+
+    games = [(0, 1, 0, False)]
+    worker.play(0, 1, {0 : first, 1 : first}, games)
+    loaded = worker.slots.policies[worker.slots.loaded_ids.index(1)]
+    worker.play(0, 1, {0 : first, 1 : second}, games)
+    assert loaded is worker.slots.policies[worker.slots.loaded_ids.index(1)]
+    assert np.array_equal(loaded.weights["layer 0"], second["mlp_extractor.policy_net.0.weight"].T)
@@ -0,0 +1,74 @@
+import numpy as np
+
+from benchmark import RandomModel
+from game_env import GameEnv
+from recorder import EpisodeRecorder, Recording
+from replay import load_frame, make_replay_env
+
+GAME_CONFIG = dict(max_steps=20, n_colors=3, n_agents=9, n_pieces=9, n_letters=2, grid_size=12)
+
+def make_game_env() -> GameEnv:
+    game_env = GameEnv(**GAME_CONFIG)
+    game_env.init_instances(RandomModel(game_env.n_agents - 1, game_env.speech_shape))
+    return game_env
+
+def play(game_env : GameEnv, n_episodes : int, seed : int = 0) -> list[list[np.ndarray]]:
+    """Agent positions of every frame of every episode, as the recording should hold them"""
+    model = RandomModel(game_env.n_agents, game_env.speech_shape, seed)
+    episodes = []
+    for episode in range(n_episodes):
+        obs = game_env.reset(seed=seed + episode)
+        frames = [game_env.world.agent_pos.copy()]
+        done = False
+        while not done:
+            obs, _, terminated, truncated = game_env.step(model.predict(obs)[0])
+            frames.append(game_env.world.agent_pos.copy())
+            done = terminated or truncated
+        episodes.append(frames)
+    return episodes
+
+def check_episodes(path : str, episodes : list):
+    recording = Recording(path)
+    assert 0 < len(recording) <= len(episodes)
+    game_env = make_replay_env(recording, None)
+    for i in range(len(recording)):
+        episode = recording.episode(i)
+        assert len(episode["agent_pos"]) == len(episodes[i])
+        for frame, agent_pos in enumerate(episodes[i]):
+            assert np.array_equal(episode["agent_pos"][frame], agent_pos)
+            load_frame(game_env, episode, frame)
+            assert np.array_equal(game_env.world.agent_pos, agent_pos)
+    return recording
+
+def test_round_trip(tmp_path):
+    game_env = make_game_env()
+    game_env.record(str(tmp_path), chunk_steps=64)
+    episodes = play(game_env, 10)
+    game_env.stop_recording()
+
+    assert len(check_episodes(str(tmp_path), episodes)) == 10
+
+def test_unclosed_recording_keeps_written_chunks(tmp_path):
+    game_env = make_game_env()
+    game_env.record(str(tmp_path), chunk_steps=64)
+    episodes = play(game_env, 10)
+    # no close(), as if the run had been killed: only the chunks written so far are indexed
+    recording = check_episodes(str(tmp_path), episodes)
+    n_episodes = len(recording)
+    assert recording.meta["n_steps"] == 192
+
+    # continuing the recording keeps what meta.json indexes
+    EpisodeRecorder(str(tmp_path), game_env, chunk_steps=64).close()
+    assert len(check_episodes(str(tmp_path), episodes)) == n_episodes
+
+def test_loud_speech_saturates(tmp_path):
+    game_env = make_game_env()
+    game_env.record(str(tmp_path))
+    game_env.reset(seed=0)
+    speech = np.tile([2.0, -3.0, 0.5], game_env.speech_shape[-1] // 3 + 1)[:game_env.speech_shape[-1]]
+    game_env.step({"action" : 6, "dx" : 1, "dy" : 1, "agent" : 0,
+                   "speech" : speech.reshape(game_env.speech_shape).astype(np.float32)})
+    game_env.stop_recording()
+
+    recorded = Recording(str(tmp_path)).episode(0)["speech"][1, game_env.learning_agent.ind]
+    assert np.allclose(recorded, np.clip(speech, -1, 1), atol=1 / 127)
@@ -1,9 +1,9 @@
 import numpy as np
-import random as rnd
-from typing import Dict, Union
+from typing import Dict, Tuple, Union
 
 AgentAction = Dict[int, Union[int, np.ndarray]]
-AgentObs = Dict[int, np.ndarray]
+AgentObs = Dict[int, np.ndarray] # or one flat array, see ObsLayout
+ObsLayout = Dict[str, Tuple[int, Tuple[int, ...]]] # key -> (offset, shape) of its entries in a flat observation
 
 def unpack_action(action : AgentAction):
     if type(action) is not dict:
@@ -15,6 +15,39 @@ def unpack_action(action : AgentAction):
     speech = action["speech"]
     return discrete_action, dx, dy, agent_ind, speech
 
+def get_obs_layout(shapes : dict[str, tuple]) -> ObsLayout:
+    layout, offset = {}, 0
+    for key, shape in shapes.items():
+        layout[key] = (offset, tuple(shape))
+        offset += int(np.prod(shape))
+    return layout
+
+def get_obs_layout_size(layout : ObsLayout) -> int:
+    return sum(int(np.prod(shape)) for _, shape in layout.values())
+
+def unflatten_obs(flat, layout : ObsLayout) -> AgentObs:
+    """Named views of flat observations of shape (..., size), numpy arrays or torch tensors. Nothing is copied"""
+    batch_shape = tuple(flat.shape[:-1])
+    return {key : flat[..., offset : offset + int(np.prod(shape))].reshape(batch_shape + shape)
+            for key, (offset, shape) in layout.items()}
+
+def copy_obs(obs : AgentObs) -> AgentObs:
+    if isinstance(obs, np.ndarray):
+        return obs.copy()
+    return {key : value.copy() for key, value in obs.items()}
+
+def stack_obs(obs_list : list[AgentObs], out : AgentObs = None) -> AgentObs:
+    if isinstance(obs_list[0], np.ndarray): # flat observations
+        return np.stack(obs_list, out=out)
+    if out is None:
+        out = {key : np.empty((len(obs_list), ) + value.shape, dtype=value.dtype) for key, value in obs_list[0].items()}
+    for key, value in out.items():
+        np.stack([obs[key] for obs in obs_list], out=value)
+    return out
+
+def unstack_action(actions : AgentAction, i : int) -> AgentAction:
+    return {key : value[i] for key, value in dict(actions).items()}
+
 def get_action_id(action : AgentAction):
     discrete_action, _, _, _, _ = unpack_action(action)
     return discrete_action
@@ -29,33 +62,7 @@ def get_action_queue():
 def calculate_dis(x1, y1, x2, y2):
     return ((x1 - x2) ** 2 + (y1 - y2) ** 2) ** 0.5
 
-def get_random_pos(instances, grid_size):
-    for i in range(grid_size ** 2):
-        x, y = rnd.randint(0, grid_size - 1), rnd.randint(0, grid_size - 1)
-        return_ = True
-        for instance in instances:
-            if instance.x == x and instance.y == y:
-                return_ = False
-                break
-        if return_:
-            return x, y
-    raise Exception("EMPTY CELL NOT FOUND")
-
 #TODO: replace action and obs space definitions in code
-def get_emtpy_speech():
-    return np.array([[0 for i in range(120)]], dtype=np.float32)
-
-def cell_free(x, y, agents):
-    for agent in agents:
-        if agent.x == x and agent.y == y:
-            return False
-    return True
-
-def drop_piece_in_room(piece, instances, grid_size, ):
-    new_x, new_y = get_random_pos(instances, grid_size)
-    piece.x = new_x
-    piece.y = new_y
-
 color_dict = {
     0 : (255, 255, 255),
     1 : (255, 0, 0),
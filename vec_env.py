@@ -0,0 +1,80 @@
+import os
+from env import CustomEnv
+from game_env import GameEnv
+from opponents import compress_weights, get_policy_weights
+from numpy_policy import NumpyPolicy
+
+class OpponentPolicyFactory:
+    """Builds an inference-only opponent policy inside a worker process"""
+
+    def __init__(self, policy_class, policy_kwargs : dict = None):
+        self.policy_class = policy_class
+        self.policy_kwargs = policy_kwargs or {}
+
+    def __call__(self, observation_space, action_space):
+        policy = self.policy_class(observation_space, action_space, lambda _: 0.0, **self.policy_kwargs)
+        policy.set_training_mode(False)
+        return policy
+
+def make_game_env(game_config : dict, seed : int, policy_factory : OpponentPolicyFactory, record_dir : str = None,
+                  inference_client = None):
+    def _init() -> CustomEnv:
+        game_env = GameEnv(**game_config, seed=seed)
+        env = CustomEnv(game_env)
+        env.action_space.seed(seed)
+        if record_dir is not None:
+            game_env.record(os.path.join(record_dir, f"env_{seed}"))
+        if inference_client is not None:
+            game_env.connect_inference_server(inference_client)
+            game_env.init_instances(inference_client)
+        else:
+            policy = policy_factory(env.observation_space, env.action_space)
+            if not isinstance(policy, NumpyPolicy):
+                import torch
+                # every worker runs its own tiny forward passes, one thread each avoids oversubscription
+                torch.set_num_threads(1)
+            game_env.init_instances(policy)
+        return env
+
+    return _init
+
+def make_vec_env(game_config : dict, n_envs : int, policy_factory : OpponentPolicyFactory,
+                 seed : int = 0, start_method : str = None, record_dir : str = None, inference_server = None):
+    """With an InferenceServer (see make_inference_server) worker rank plays its opponents on slot rank"""
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+
+    if inference_server is None:
+        env_fns = [make_game_env(game_config, seed + rank, policy_factory, record_dir) for rank in range(n_envs)]
+    else:
+        # no policy class shipped to the workers, unpickling it would import torch in each of them
+        env_fns = [make_game_env(game_config, seed + rank, None, record_dir, inference_server.client(rank))
+                   for rank in range(n_envs)]
+    return SubprocVecEnv(env_fns, start_method=start_method)
+
+def make_inference_server(game_config : dict, n_envs : int, policy_factory : OpponentPolicyFactory, **kwargs):
+    from inference_server import InferenceServer
+
+    game_env = GameEnv(**game_config)
+    env = CustomEnv(game_env)
+    return InferenceServer(policy_factory, env.observation_space, env.action_space, n_slots=n_envs,
+                           max_batch=game_env.n_agents - 1,
+                           pool_size=game_config.get("opponent_pool_size", 8),
+                           deterministic=game_config.get("opponent_deterministic", False), **kwargs)
+
+def broadcast_opponent_weights(vec_env, weights, snapshot_id : int = None, inference_server = None,
+                               weight_dtype : str = "float32") -> None:
+    """weights: a policy, or weights already taken from one (e.g. Checkpoint.policy_weights).
+
+    weight_dtype float16 / int8 compresses them once here, pools keep the compact copies (see compress_weights)
+    """
+    if not isinstance(weights, dict):
+        weights = get_policy_weights(weights)
+    weights = compress_weights(weights, weight_dtype)
+    if inference_server is not None:
+        # the server holds the only copy, workers just hot-swap to the new snapshot id
+        assert snapshot_id is not None, "the server and the workers have to agree on snapshot ids"
+        inference_server.push_weights(weights, snapshot_id)
+        vec_env.env_method("push_opponent_snapshot", {}, snapshot_id)
+        return
+    # every worker adds the snapshot to its own opponent pool and hot-swaps its opponents
+    vec_env.env_method("push_opponent_snapshot", weights, snapshot_id)
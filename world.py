@@ -0,0 +1,253 @@
+import numpy as np
+import random as rnd
+from speech import SPEECH_SIZE, SpeechChannel
+
+NONE = -1
+
+def disk_mask(radius):
+    """(mask, squared distance) over the (2r + 1)^2 window around a cell, mask marks cells within radius"""
+    offsets = np.arange(-radius, radius + 1)
+    dist2 = offsets[:, None] ** 2 + offsets[None, :] ** 2
+    return dist2 <= radius ** 2, dist2
+
+class CellSet:
+    """Set of grid cells with O(1) add, discard and uniform sampling"""
+
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+        self.fill()
+
+    def fill(self):
+        # members are cells[:size], where[cell] is the index of cell in cells
+        self.cells = list(range(self.grid_size ** 2))
+        self.where = list(range(self.grid_size ** 2))
+        self.size = len(self.cells)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, cell):
+        return self.where[cell] < self.size
+
+    def add(self, cell):
+        i = self.where[cell]
+        if i >= self.size:
+            self._swap(i, self.size)
+            self.size += 1
+
+    def discard(self, cell):
+        i = self.where[cell]
+        if i < self.size:
+            self.size -= 1
+            self._swap(i, self.size)
+
+    def get_state(self) -> tuple:
+        # sample() depends on the order of cells, not just on which cells are members
+        return list(self.cells), list(self.where), self.size
+
+    def set_state(self, state : tuple):
+        cells, where, self.size = state
+        self.cells, self.where = list(cells), list(where)
+
+    def sample(self, rng = rnd):
+        if self.size == 0:
+            raise Exception("EMPTY CELL NOT FOUND")
+        return divmod(self.cells[rng.randrange(self.size)], self.grid_size)
+
+    def _swap(self, i, j):
+        cells, where = self.cells, self.where
+        cells[i], cells[j] = cells[j], cells[i]
+        where[cells[i]] = i
+        where[cells[j]] = j
+
+class World:
+    """Array-backed state of one game. Agents and pieces are referred to by index (agent id - 1)."""
+
+    # grids and versions are derived from these, cell sets are saved as they are
+    STATE_ARRAYS = ("agent_pos", "agent_color", "agent_target", "agent_hand", "agent_offered", "agent_offer_from",
+                    "agent_found", "piece_pos", "piece_color", "piece_letter", "piece_holder", "piece_alive")
+
+    def __init__(self, n_agents, n_pieces, grid_size, rng = rnd, query_radius = 0, listen_history_size = 0,
+                 speech_shape = (1, SPEECH_SIZE), speech_dtype = np.float32):
+        self.rng = rng
+        self.n_agents = n_agents
+        self.n_pieces = n_pieces
+        self.grid_size = grid_size
+        self.pad = query_radius
+
+        self.agent_pos = np.full((n_agents, 2), NONE, dtype=np.int32)
+        self.agent_color = np.zeros(n_agents, dtype=np.int32)
+        self.agent_target = np.full(n_agents, NONE, dtype=np.int32) # piece the agent wants
+        self.agent_hand = np.full(n_agents, NONE, dtype=np.int32) # piece the agent is holding
+        self.agent_offered = np.full(n_agents, NONE, dtype=np.int32) # piece being offered to the agent
+        self.agent_offer_from = np.full(n_agents, NONE, dtype=np.int32) # agent making that offer
+        self.agent_found = np.zeros(n_agents, dtype=bool) # got a piece like the one it wants
+        self.speech = SpeechChannel(n_agents, listen_history_size, speech_shape, speech_dtype)
+
+        self.piece_pos = np.full((n_pieces, 2), NONE, dtype=np.int32)
+        self.piece_color = np.zeros(n_pieces, dtype=np.int32)
+        self.piece_letter = np.zeros(n_pieces, dtype=np.int32)
+        self.piece_holder = np.full(n_pieces, NONE, dtype=np.int32)
+        self.piece_alive = np.zeros(n_pieces, dtype=bool)
+
+        # occupancy grids hold the index of the agent / the piece lying on the ground at each cell.
+        # They double as the spatial index: they are padded by the largest query radius
+        # so a neighbourhood query is a plain slice, with no clipping at the borders.
+        padded_size = grid_size + 2 * self.pad
+        self.agent_grid_padded = np.full((padded_size, padded_size), NONE, dtype=np.int32)
+        self.piece_grid_padded = np.full((padded_size, padded_size), NONE, dtype=np.int32)
+        inner = slice(self.pad, self.pad + grid_size)
+        self.agent_grid = self.agent_grid_padded[inner, inner]
+        self.piece_grid = self.piece_grid_padded[inner, inner]
+
+        # every change to what a cell shows (its agent, that agent's hand, the piece on the ground)
+        # stamps the cell with a new version, observers compare it with the version they last saw
+        self.stamp = 0
+        self.cell_version = np.zeros((padded_size, padded_size), dtype=np.int64)
+
+        self.no_agent_cells = CellSet(grid_size)
+        self.no_piece_cells = CellSet(grid_size)
+        self.empty_cells = CellSet(grid_size)
+
+        self.piece_views = [] # set by the owner, one view per piece index
+
+    def clear(self):
+        for array in (self.agent_pos, self.agent_target, self.agent_hand, self.agent_offered,
+                      self.agent_offer_from, self.piece_pos, self.piece_holder,
+                      self.agent_grid_padded, self.piece_grid_padded):
+            array.fill(NONE)
+        self.agent_color.fill(0)
+        self.agent_found.fill(False)
+        self.speech.clear()
+        self.piece_color.fill(0)
+        self.piece_letter.fill(0)
+        self.piece_alive.fill(False)
+        self.stamp += 1
+        self.cell_version.fill(self.stamp)
+
+        self.no_agent_cells.fill()
+        self.no_piece_cells.fill()
+        self.empty_cells.fill()
+
+    def get_state(self) -> dict:
+        state = {key : getattr(self, key).copy() for key in World.STATE_ARRAYS}
+        state["speech"] = self.speech.get_state()
+        state["cell_sets"] = [cells.get_state() for cells in self._cell_sets()]
+        return state
+
+    def set_state(self, state : dict):
+        for key in World.STATE_ARRAYS:
+            getattr(self, key)[...] = state[key]
+        self.speech.set_state(state["speech"])
+
+        self.agent_grid_padded.fill(NONE)
+        self.piece_grid_padded.fill(NONE)
+        placed = np.flatnonzero(self.agent_pos[:, 0] != NONE)
+        self.agent_grid[self.agent_pos[placed, 0], self.agent_pos[placed, 1]] = placed
+        on_ground = np.flatnonzero(self.piece_alive & (self.piece_holder == NONE))
+        self.piece_grid[self.piece_pos[on_ground, 0], self.piece_pos[on_ground, 1]] = on_ground
+
+        for cells, cells_state in zip(self._cell_sets(), state["cell_sets"]):
+            cells.set_state(cells_state)
+        self.stamp += 1
+        self.cell_version.fill(self.stamp)
+
+    def _cell_sets(self) -> tuple:
+        return self.no_agent_cells, self.no_piece_cells, self.empty_cells
+
+    def cell_free(self, x, y):
+        return self.agent_grid[x, y] == NONE
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.grid_size and 0 <= y < self.grid_size
+
+    def agent_window(self, x, y, radius):
+        x, y = x + self.pad, y + self.pad
+        return self.agent_grid_padded[x - radius : x + radius + 1, y - radius : y + radius + 1]
+
+    def piece_window(self, x, y, radius):
+        x, y = x + self.pad, y + self.pad
+        return self.piece_grid_padded[x - radius : x + radius + 1, y - radius : y + radius + 1]
+
+    def window_version(self, x, y, radius):
+        x, y = x + self.pad, y + self.pad
+        return self.cell_version[x - radius : x + radius + 1, y - radius : y + radius + 1].max()
+
+    def random_free_cell(self, cells : CellSet):
+        return cells.sample(self.rng)
+
+    def move_agent(self, agent, x, y):
+        old_x, old_y = self.agent_pos[agent]
+        if old_x != NONE:
+            self.agent_grid[old_x, old_y] = NONE
+            self._refresh_cell(old_x, old_y)
+        self.agent_pos[agent] = x, y
+        self.agent_grid[x, y] = agent
+        self._refresh_cell(x, y)
+
+    def place_piece(self, piece, x, y):
+        self.piece_alive[piece] = True
+        self.piece_holder[piece] = NONE
+        self.piece_pos[piece] = x, y
+        self.piece_grid[x, y] = piece
+        self._refresh_cell(x, y)
+
+    def drop(self, piece, x, y):
+        self._lift(piece)
+        self.place_piece(piece, x, y)
+
+    def give(self, piece, agent):
+        # also used for pick-ups: the piece leaves the ground or its previous holder
+        self._lift(piece)
+        self.piece_holder[piece] = agent
+        self.agent_hand[agent] = piece
+        self._touch(*self.agent_pos[agent])
+
+    def remove_piece(self, piece):
+        self._lift(piece)
+        self.piece_alive[piece] = False
+
+    def _lift(self, piece):
+        # takes the piece out of its holder's hand or off the ground
+        holder = self.piece_holder[piece]
+        if holder != NONE:
+            self.agent_hand[holder] = NONE
+            self.piece_holder[piece] = NONE
+            self._touch(*self.agent_pos[holder])
+        else:
+            x, y = self.piece_pos[piece]
+            if self.piece_grid[x, y] == piece:
+                self.piece_grid[x, y] = NONE
+                self._refresh_cell(x, y)
+
+    def get_piece_pos(self, piece):
+        # held pieces travel with whoever is holding them
+        holder = self.piece_holder[piece]
+        if holder != NONE:
+            return self.agent_pos[holder]
+        return self.piece_pos[piece]
+
+    def _touch(self, x, y):
+        self.stamp += 1
+        self.cell_version[x + self.pad, y + self.pad] = self.stamp
+
+    def _refresh_cell(self, x, y):
+        self._touch(x, y)
+        cell = x * self.grid_size + y
+        no_agent = self.agent_grid[x, y] == NONE
+        no_piece = self.piece_grid[x, y] == NONE
+
+        if no_agent:
+            self.no_agent_cells.add(cell)
+        else:
+            self.no_agent_cells.discard(cell)
+
+        if no_piece:
+            self.no_piece_cells.add(cell)
+        else:
+            self.no_piece_cells.discard(cell)
+
+        if no_agent and no_piece:
+            self.empty_cells.add(cell)
+        else:
+            self.empty_cells.discard(cell)